@@ -1,11 +1,46 @@
-from rikiddo_core_functions import fixFee, getVolumeRatio, z_r, eValue, lsdCostFunction, lsdPriceFunction_i, minRevenue
-import pandas as pd
+from rikiddo_core_functions import fixFee, z_r, eValue, lsdCostFunction, lsdPriceFunction_i, minRevenue
+from rikiddo_volume import VolumeRatioTracker
+from rikiddo_record import RecordWriter
+from rikiddo_orders import order_stream
+from rikiddo_events import TradeEvent, DEBUG, ERROR, NullSink, StreamSink, FileSink
 import numpy as np
-import random
+import argparse
 import time
+import sys
+try:
+    import resource
+except ImportError:
+    resource = None
 
 
-random.seed(1)
+# %% Run mode
+#by default the simulation runs for one block time (4 seconds). Bounding it by a number of
+#transactions (or of simulated blocks) makes the amount of work independent of the machine,
+#so runs can be compared and used as a benchmark
+parser = argparse.ArgumentParser(description='LSD-LMSR pool simulation')
+parser.add_argument('--transactions', type=int, default=None,
+                    help='stop after this many transactions (a run gets stuck after a few thousand, see the README)')
+parser.add_argument('--blocks', type=int, default=None, help='stop after this many simulated blocks')
+parser.add_argument('--block-size', type=int, default=100, help='loop iterations per simulated block')
+parser.add_argument('--seed', type=int, default=1)
+parser.add_argument('--events', default=None, help='write the trade and warning events to this JSONL file instead of stdout')
+parser.add_argument('--log-level', default='info', choices=['debug', 'info', 'warning', 'error'])
+parser.add_argument('--quiet', action='store_true', help='drop the events (for benchmarking)')
+args = parser.parse_args()
+
+#trades and warnings go through an event sink: stdout by default, a JSONL file written by a
+#background thread with --events, or nowhere with --quiet
+if args.quiet:
+    events = NullSink()
+elif args.events:
+    events = FileSink(args.events, level=args.log_level)
+else:
+    events = StreamSink(level=args.log_level)
+
+maxTransactions = args.transactions
+maxBlocks = args.blocks
+blockSize = args.block_size
+rng = np.random.default_rng(args.seed)
 
 symbol1= 'Will'
 symbol2= 'Will_not'
@@ -25,7 +60,6 @@ liquidityBounds = [q_1<10000, q_2<10000]
 
 ratio_q_1 = q_1 / (q_1 + q_2)
 ratio_q_2 = q_2 / (q_1 + q_2)
-simulationRecord = pd.DataFrame([])
 indexer = 0
 
 #Initial state
@@ -51,65 +85,99 @@ data = {'transactionNumber': [0],
         'costPerUnit': [0], 
         'r': 1}
 
-simulationRecord = simulationRecord.append(pd.DataFrame.from_dict(data))
+#records are streamed to simulationRecord.csv (and simulationRecord_columns/) in chunks, with
+#the cumulated profit kept as a running sum, so memory doesn't grow with the simulation length
+recordColumns = {'transactionNumber': np.int64,
+                 account1: np.float64,
+                 account2: np.float64,
+                 account1_pool: np.float64,
+                 account2_pool: np.float64,
+                 'totalVolume': np.float64,
+                 'totalPoolVolume': np.float64,
+                 'totalFee': np.float64,
+                 'whoBuy': str,
+                 'ratioVolume': np.float64,
+                 'z': np.float64,
+                 'order': str,
+                 'transactCost': np.float64,
+                 'previousCost': np.float64,
+                 'deltaQ': np.float64,
+                 'costPerUnit': np.float64,
+                 'r': np.float64,
+                 'profitCumSum': np.float64}
+simulationRecord = RecordWriter('simulationRecord.csv', recordColumns, cumsum={'profitCumSum': 'transactCost'})
+simulationRecord.append({column: np.ravel(value)[0] for column, value in data.items()})
+
+#short window of 1 transaction vs long window of the last 6, same as getVolumeRatio
+volumeTracker = VolumeRatioTracker(1, 6, warmup=3)
+volumeTracker.update(data['totalPoolVolume'][0])
 
 transaction = 0
+iteration = 0
+#why the loop ended before its bound, if it did
+stopReason = None
+phaseTimes = {'ratio': 0, 'fee': 0, 'cost': 0, 'price': 0, 'record': 0}
+countBounded = (maxTransactions is not None) | (maxBlocks is not None)
 start_time = time.time()
+perfStart = time.perf_counter()
 print('--------------------------------------LOOP PRINTS--------------------------------------')
 #%% Loop simulation
 
 symbols = [symbol1, symbol2]
 previousStateCost = 0
-while time.time() - start_time <4:
+#the orders (asset, side, amount) are pre-drawn in blocks by rikiddo_orders, with a new market
+#signal every 500 orders, and consumed one per iteration
+orderFlow = order_stream(len(symbols), 'signal', rng=rng, max_amount=3000, signal_period=500)
+orders = (order for batch in orderFlow
+          for order in zip(batch.outcome.tolist(), batch.sell.tolist(), batch.amount.tolist()))
+while True:
+    if countBounded:
+        if (maxTransactions is not None) and (transaction >= maxTransactions):
+            break
+        if (maxBlocks is not None) and (iteration >= maxBlocks*blockSize):
+            break
+    elif time.time() - start_time >= 4:
+        break
+    iteration += 1
     # transaction += 1
     poolInventory= [q_1_pool, q_2_pool]
-    buysell = ['buy', 'sell']
-    signals = [0.5, 0.5]
-    buysellSignals = [0.5, 0.5]
-
-    #The signal changes every 500 transactions
-    if transaction%500 == 0:
-        signals[0] = random.random()
-        signals[1] = 1 - signals[0]
-        buysellSignals[0] = 1 - signals[0]
-        buysellSignals[1] = signals[0]
-    
-    buyAsset = np.random.choice(symbols, 1, True, signals)
-
-    marketSignal = np.random.choice(buysell, 1, True, buysellSignals)
 
-    indexNum = symbols.index(buyAsset)
-    if indexNum == 0:
-        yElement = symbols[1]
-    else:
-        yElement = symbols[0]
+    #how much you want to buy or sell
+    indexNum, sell, deltaQ = next(orders)
+    buyAsset = symbols[indexNum]
+    yElement = symbols[1 - indexNum]
     
-    if (q_1>=1000000) | (q_2>=1000000) | (q_1_pool<=0) | (q_2_pool<=0) & (marketSignal == 'sell'):
-        marketSignal = 'buy'
+    if (q_1>=1000000) | (q_2>=1000000) | (q_1_pool<=0) | (q_2_pool<=0) & sell:
+        sell = False
         #establishing bounds to the buy or sell decission
+    marketSignal = 'sell' if sell else 'buy'
 
     asset_pool = f'account_{symbols[indexNum]}_pool'
-    r = getVolumeRatio('totalPoolVolume', simulationRecord, transaction)
+    phaseStart = time.perf_counter()
+    if volumeTracker.count <= volumeTracker.warmup:
+        events.warn('warmup', 'long len less than 2', volumeTracker.count, level=DEBUG)
+    r = volumeTracker.ratio
+    phaseTimes['ratio'] += time.perf_counter() - phaseStart
 
+    phaseStart = time.perf_counter()
     z = z_r(r)
     totalFee = fee + z
     if totalFee < minRev:
-        print('Your fee is lower than expected. Bounding with minRevenue')
+        events.warn('min_revenue', 'Your fee is lower than expected. Bounding with minRevenue', totalFee)
         totalFee = minRev
 
-    #how much you want to buy or sell
-    deltaQ = random.uniform(0, 3000)
-
     #Pool liquidity bounds
     if (q_1<15000) | (q_2<15000):
-        print('LIQUIDITY WARNING: Rising fee dramatically')
+        events.warn('liquidity', 'LIQUIDITY WARNING: Rising fee dramatically', min(q_1, q_2))
         totalFee = 0.15
+    phaseTimes['fee'] += time.perf_counter() - phaseStart
     
     if totalFee <= traderMaxFee:
         #Cost function 
+        phaseStart = time.perf_counter()
         eVal, dynamicFee = eValue(poolInventory, totalFee)
 
-        if marketSignal == 'buy':
+        if not sell:
             if indexNum == 0:
                 q_1 -= deltaQ
                 q_1_pool += deltaQ
@@ -118,10 +186,11 @@ while time.time() - start_time <4:
                 q_2 -= deltaQ
 
             if (q_1<0) | (q_2<0): 
-                print('no liquidity')
+                events.warn('no_liquidity', 'no liquidity', level=ERROR)
+                stopReason = 'no liquidity'
                 break
         
-        elif marketSignal == 'sell':
+        else:
             if indexNum == 0:
                 q_1 += deltaQ
                 q_1_pool -= deltaQ
@@ -134,46 +203,70 @@ while time.time() - start_time <4:
         C_q = lsdCostFunction([q_1_pool, q_2_pool], dynamicFee)
         
         transactCost = C_q - previousStateCost
+        phaseTimes['cost'] += time.perf_counter() - phaseStart
 
+        phaseStart = time.perf_counter()
         previousState =[data[f'account_{symbol1}'][-1], data[f'account_{symbol2}'][-1]]
 
         P_q_1 = lsdPriceFunction_i(C_q, totalFee, previousState, poolInventory)
+        phaseTimes['price'] += time.perf_counter() - phaseStart
 
-        print(marketSignal, buyAsset, deltaQ, transactCost)
+        events.emit(TradeEvent(marketSignal, 'trader', buyAsset, deltaQ, transactCost))
 
         costPerUnit = transactCost/deltaQ
 
-        simdata = {'transactionNumber': [transaction], 
-        account1 : [q_1], 
-        account2: [q_2], 
-        account1_pool : [q_1_pool], 
-        account2_pool: [q_2_pool],
-        'totalVolume': [q_1+q_2],
-        'totalPoolVolume': [q_1_pool+q_2_pool],
-        'totalFee': [totalFee], 
-        'whoBuy': [buyAsset], 
-        'ratioVolume': [r], 
-        'z': [z], 
-        'order': [marketSignal],
-        'transactCost': [transactCost],
-        'previousCost': [previousStateCost],
-        'deltaQ': [deltaQ],
-        'costPerUnit': [costPerUnit], 
-        'r': r}
-
-        df_simdata = pd.DataFrame(data=simdata)
-        simulationRecord = simulationRecord.append(df_simdata)
-        simulationRecord['profitCumSum'] = simulationRecord['transactCost'].cumsum()
+        phaseStart = time.perf_counter()
+        simulationRecord.append({'transactionNumber': transaction, 
+        account1 : q_1, 
+        account2: q_2, 
+        account1_pool : q_1_pool, 
+        account2_pool: q_2_pool,
+        'totalVolume': q_1+q_2,
+        'totalPoolVolume': q_1_pool+q_2_pool,
+        'totalFee': totalFee, 
+        'whoBuy': buyAsset, 
+        'ratioVolume': r, 
+        'z': z, 
+        'order': marketSignal,
+        'transactCost': transactCost,
+        'previousCost': previousStateCost,
+        'deltaQ': deltaQ,
+        'costPerUnit': costPerUnit, 
+        'r': r})
+        volumeTracker.update(q_1_pool+q_2_pool)
+        phaseTimes['record'] += time.perf_counter() - phaseStart
         previousStateCost = C_q
         transaction += 1
     
     else:
-        print(f'Fee is too high for the trader. Its value is {totalFee}')
+        events.warn('fee_too_high', 'Fee is too high for the trader', totalFee)
+        #a rejected trade leaves the pool, the accounts and the volume ratio untouched, so the
+        #fee and every following trade would be rejected the same way
+        events.warn('stuck', 'The pool is stuck with this fee, stopping the simulation', level=ERROR)
+        stopReason = f'fee {totalFee} above the trader max fee {traderMaxFee}'
+        break
 
 ###############################################################################################
 
 finalTime= time.time() - start_time
+perfTime = time.perf_counter() - perfStart
+events.close()
 print(f"--- {finalTime} seconds ---")
 print(f'We made {transaction} transactions in {finalTime} seconds with LSD-LMSR')
-simulationRecord.to_csv('simulationRecord.csv')
+print(f'Throughput: {transaction/perfTime:.1f} transactions per second ({iteration} loop iterations)')
+for phase, phaseTime in phaseTimes.items():
+    print(f'  {phase:<7} {phaseTime:10.4f} s  {1e6*phaseTime/max(transaction, 1):10.2f} us/transaction')
+if resource is not None:
+    #ru_maxrss is reported in kilobytes on Linux
+    print(f'Peak memory: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024:.1f} MB')
+simulationRecord.close()
+if stopReason is not None:
+    print(f'The simulation stopped early: {stopReason}')
+    #a short bounded run isn't comparable with a full one: make it visible to scripts
+    if (maxTransactions is not None) and (transaction < maxTransactions):
+        print(f'Only {transaction} of the {maxTransactions} requested transactions ran')
+        sys.exit(1)
+    if (maxBlocks is not None) and (iteration < maxBlocks*blockSize):
+        print(f'Only {iteration} of the {maxBlocks*blockSize} requested iterations ({maxBlocks} blocks) ran')
+        sys.exit(1)
 
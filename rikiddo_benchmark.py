@@ -0,0 +1,235 @@
+from rikiddo_cpmm_compare.rikiddo import RikiddoScoringRule
+from rikiddo_cpmm_compare.cpmm import CPMM
+from rikiddo_record import RecordWriter, read_columns
+from rikiddo_orders import order_stream
+from rikiddo_events import NullSink
+import argparse
+import json
+import time
+import numpy as np
+
+
+#log-spaced latency buckets from 100ns to 1s, 1% wide
+LATENCY_EDGES = np.logspace(2, 9, 1621)
+
+
+def save_orders(path, chunks):
+    '''
+    Writes an order stream to `path` (CSV) and its binary columnar copy, which `load_orders`
+    reads back memory-mapped
+    '''
+    columns = {'outcome': np.int64, 'sell': np.int8, 'amount': np.float64}
+    with RecordWriter(path, columns, chunk_size=65536) as writer:
+        for outcome, sell, amount in chunks:
+            for row in zip(outcome.tolist(), sell.tolist(), amount.tolist()):
+                writer.append(dict(zip(columns, row)))
+    return writer.binary_path
+
+
+def load_orders(path, chunk_size=100000):
+    '''
+    Lazily yields (outcome, sell, amount) chunks of an order stream saved by `save_orders`
+    (`path` is its `_columns` directory)
+    '''
+    columns = read_columns(path, mmap=True)
+    for start in range(0, len(columns['amount']), chunk_size):
+        end = start + chunk_size
+        yield (np.asarray(columns['outcome'][start:end]),
+               np.asarray(columns['sell'][start:end]).astype(bool),
+               np.asarray(columns['amount'][start:end]))
+
+
+class _Metrics(object):
+    def __init__(self):
+        self.latency = np.zeros(LATENCY_EDGES.size + 1, dtype=np.int64)
+        self.seconds = 0.0
+        self.orders = 0
+        self.rejected = 0
+        self.fees = 0.0
+        self.slippage = 0.0
+        self.max_slippage = 0.0
+
+    def add_latencies(self, nanoseconds):
+        self.latency += np.bincount(np.searchsorted(LATENCY_EDGES, nanoseconds), minlength=self.latency.size)
+        self.seconds += nanoseconds.sum()/1e9
+
+    def add_slippage(self, slippage):
+        slippage = np.abs(slippage[np.isfinite(slippage)])
+        self.slippage += slippage.sum()
+        if slippage.size:
+            self.max_slippage = max(self.max_slippage, float(slippage.max()))
+
+    def percentile(self, q):
+        '''
+        Upper edge of the latency bucket holding the q-th percentile, in microseconds
+        '''
+        cumulative = np.cumsum(self.latency)
+        bucket = int(np.searchsorted(cumulative, q/100*cumulative[-1]))
+        return float(LATENCY_EDGES[min(bucket, LATENCY_EDGES.size - 1)])/1000
+
+    def report(self):
+        traded = self.orders - self.rejected
+        return {'orders': self.orders,
+                'rejected': self.rejected,
+                'seconds': self.seconds,
+                'orders_per_second': self.orders/self.seconds if self.seconds else 0.0,
+                'latency_us': {'p50': self.percentile(50), 'p90': self.percentile(90),
+                               'p99': self.percentile(99), 'p99.9': self.percentile(99.9)},
+                'fee_revenue': self.fees,
+                'mean_slippage': self.slippage/traded if traded else 0.0,
+                'max_slippage': self.max_slippage}
+
+
+def _cpmm_can_sell(cpmm, amount, asset):
+    '''
+    Whether `cpmm.sell_shares(amount, asset)` leaves both the ZTG and the asset reserve
+    positive: the fee-less amount must stay below the ZTG reserve R, and the asset reserve
+    is multiplied by 2 - R/(R - n) (see `CPMM.swap_many`)
+    '''
+    ztg = cpmm.state['ZTG']
+    remaining = ztg - amount/(1 + cpmm.fee)
+    return remaining > 0 and 2 - ztg/remaining > 0
+
+
+def replay(chunks, outcomes, n_params=(0.01, 6, 2), vig=0.1, init=1000.0, mrc=0.4, cpmm_fee=0.02,
+           cpmm_liquidity=1000.0):
+    '''
+    Replays the same order stream into a RikiddoScoringRule and a CPMM over `outcomes` assets.
+
+    A buy pays `amount` for the outcome in both markets. A sell sells the shares worth
+    `amount` at the pre-trade Rikiddo price, and takes `amount` of ZTG out of the CPMM.
+    CPMM sells that the reserves can't cover are rejected without trading.
+    Every call is timed on its own. Slippage is the relative difference between the average
+    execution price and the pre-trade price (the probability for Rikiddo, the ZTG spot price
+    of the asset for the CPMM), fee revenue the dynamic fee rate times the
+    amount (Rikiddo) or the fee of the CPMM book, and the price path divergence the total
+    variation distance between the normalized Rikiddo probabilities and CPMM prices after
+    every order.
+
+    The CPMM orders that traded are also replayed into a second CPMM with one `swap_many`
+    call per chunk (`cpmm_batch`: throughput of the batch API on the same swaps, and the
+    reserves it ends with).
+
+    -------
+    Returns         dict
+                    Throughput, latency percentiles and economic metrics of both markets
+    '''
+    rikiddo = RikiddoScoringRule(list(range(outcomes)), list(n_params), vig=vig, init=init, mrc=mrc,
+                                 events=NullSink())
+    assets = ['o%d' % i for i in range(outcomes)]
+    cpmm = CPMM(dict({'ZTG': cpmm_liquidity}, **{asset: cpmm_liquidity/outcomes for asset in assets}), cpmm_fee)
+    batched = CPMM(cpmm.state, cpmm_fee)
+    metrics = {'rikiddo': _Metrics(), 'cpmm': _Metrics()}
+    batch_orders = 0
+    batch_seconds = 0.0
+    divergence_sum = 0.0
+    divergence_max = 0.0
+    divergence = 0.0
+    clock = time.perf_counter_ns
+    started = time.perf_counter()
+
+    for outcome, sell, amount in chunks:
+        size = amount.size
+        latency = {name: np.zeros(size, dtype=np.int64) for name in metrics}
+        slippage = {name: np.full(size, np.nan) for name in metrics}
+        traded = np.zeros(size, dtype=bool)
+        for i, (o, s, a) in enumerate(zip(outcome.tolist(), sell.tolist(), amount.tolist())):
+            probability = rikiddo.p[o]
+            try:
+                t = clock()
+                if s:
+                    shares = a/probability
+                    paid = -rikiddo.sell_shares('trader', shares, o)
+                else:
+                    paid = a
+                    shares = rikiddo.buy_shares('trader', paid, o)
+                latency['rikiddo'][i] = clock() - t
+                metrics['rikiddo'].fees += rikiddo.last_dynamic_fee*abs(paid)
+                slippage['rikiddo'][i] = (paid/shares)/probability - 1
+            except ValueError:
+                latency['rikiddo'][i] = clock() - t
+                metrics['rikiddo'].rejected += 1
+
+            price = cpmm.get_prices(assets[o], 'ZTG')
+            t = clock()
+            if not s:
+                shares = cpmm.buy_shares(a, assets[o])
+            elif _cpmm_can_sell(cpmm, a, assets[o]):
+                shares = cpmm.sell_shares(a, assets[o])
+            else:
+                shares = 0.0
+            latency['cpmm'][i] = clock() - t
+            if np.isfinite(shares) and shares:
+                #the fee is charged on the ZTG side, as in the CPMM book
+                metrics['cpmm'].fees += a - a/(1 + cpmm.fee)
+                slippage['cpmm'][i] = abs(a/shares)/price - 1
+                traded[i] = True
+            else:
+                metrics['cpmm'].rejected += 1
+
+            prices = cpmm.prices()
+            probabilities = rikiddo.p
+            divergence = 0.5*float(np.abs(probabilities/probabilities.sum() - prices/prices.sum()).sum())
+            divergence_sum += divergence
+            divergence_max = max(divergence_max, divergence)
+
+        assets_traded = [assets[o] for o in outcome[traded].tolist()]
+        t = time.perf_counter()
+        batched.swap_many(amount[traded], assets_traded, sell[traded])
+        batch_seconds += time.perf_counter() - t
+        batch_orders += int(traded.sum())
+
+        for name, metric in metrics.items():
+            metric.orders += size
+            metric.add_latencies(latency[name])
+            metric.add_slippage(slippage[name])
+
+    orders = metrics['rikiddo'].orders
+    return {'orders': orders,
+            'outcomes': outcomes,
+            'cpmm_reserves': cpmm.state,
+            'wall_seconds': time.perf_counter() - started,
+            'rikiddo': metrics['rikiddo'].report(),
+            'cpmm': metrics['cpmm'].report(),
+            'cpmm_batch': {'orders': batch_orders,
+                           'seconds': batch_seconds,
+                           'orders_per_second': batch_orders/batch_seconds if batch_seconds else 0.0,
+                           'reserves': batched.state},
+            'divergence': {'mean': divergence_sum/orders if orders else 0.0,
+                           'max': divergence_max,
+                           'final': divergence}}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replays one order stream into the Rikiddo scoring rule and a CPMM')
+    parser.add_argument('--orders', type=int, default=100000)
+    parser.add_argument('--outcomes', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--flow', default='signal', choices=['signal', 'uniform'])
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    parser.add_argument('--save', default=None, help='also write the generated stream to this CSV file')
+    parser.add_argument('--load', default=None, help='replay a stream saved with --save (its _columns directory)')
+    parser.add_argument('--out', default=None, help='write the report as JSON')
+    args = parser.parse_args()
+
+    if args.load:
+        chunks = load_orders(args.load, args.chunk_size)
+    else:
+        chunks = order_stream(args.outcomes, args.flow, seed=args.seed, orders=args.orders, batch_size=args.chunk_size)
+        if args.save:
+            chunks = load_orders(save_orders(args.save, chunks), args.chunk_size)
+    report = replay(chunks, args.outcomes)
+
+    for name in ('rikiddo', 'cpmm'):
+        result = report[name]
+        latency = result['latency_us']
+        print(f"{name:8s} {result['orders_per_second']:10.0f} orders/s  latency p50 {latency['p50']:.1f}us"
+              f" p99 {latency['p99']:.1f}us p99.9 {latency['p99.9']:.1f}us  fees {result['fee_revenue']:.2f}"
+              f"  slippage {result['mean_slippage']:.4f} (max {result['max_slippage']:.4f})  rejected {result['rejected']}")
+    batch = report['cpmm_batch']
+    print(f"swap_many {batch['orders_per_second']:9.0f} orders/s over the {batch['orders']} CPMM orders that traded")
+    print(f"price path divergence: mean {report['divergence']['mean']:.4f}, max {report['divergence']['max']:.4f},"
+          f" final {report['divergence']['final']:.4f}")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
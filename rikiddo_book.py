@@ -0,0 +1,153 @@
+import numpy as np
+import math
+
+
+class TradeBook(object):
+    def __init__(self, columns, capacity=1024):
+        """
+        Append-only columnar trade book. Every column is a preallocated NumPy array that
+        doubles its capacity when full, so appends and `len` are O(1) (amortized) and the
+        book is never rebuilt from a list of dicts.
+
+        Parameters
+        ----------
+        columns             dict
+                            Column name -> dtype. Use `str` for text columns (names, outcomes
+                            given by label, operations), which are interned: every distinct
+                            string is stored once and the column keeps int32 codes
+
+        capacity            int
+                            Number of rows preallocated for every column
+        """
+        self._dtypes = {}
+        self._columns = {}
+        self._labels = {}
+        self._codes = {}
+        capacity = max(int(capacity), 1)
+        for column, dtype in columns.items():
+            if dtype is str:
+                self._labels[column] = []
+                self._codes[column] = {}
+                dtype = np.int32
+            self._dtypes[column] = np.dtype(dtype)
+            self._columns[column] = np.zeros(capacity, dtype=self._dtypes[column])
+        self._capacity = capacity
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    def _grow(self):
+        self._capacity *= 2
+        for column, values in self._columns.items():
+            grown = np.zeros(self._capacity, dtype=values.dtype)
+            grown[:self._len] = values[:self._len]
+            self._columns[column] = grown
+
+    def intern(self, column, label):
+        '''
+        Returns the code of `label` inside the text column `column`, registering it if it is new
+        '''
+        codes = self._codes[column]
+        code = codes.get(label)
+        if code is None:
+            code = len(self._labels[column])
+            codes[label] = code
+            self._labels[column].append(label)
+        return code
+
+    def _default(self, column):
+        if column in self._labels:
+            return self.intern(column, '')
+        if self._dtypes[column].kind == 'f':
+            return math.nan
+        return 0
+
+    def append(self, entry):
+        '''
+        Appends one row. Columns missing from `entry` are filled with NaN (float columns),
+        0 (integer columns) or an empty string (text columns)
+        '''
+        unknown = set(entry) - set(self._columns)
+        if unknown:
+            raise KeyError('Unknown book columns: %s' % sorted(unknown))
+        if self._len == self._capacity:
+            self._grow()
+        row = self._len
+        for column, values in self._columns.items():
+            if column in entry:
+                value = entry[column]
+                if column in self._labels:
+                    value = self.intern(column, value)
+            else:
+                value = self._default(column)
+            values[row] = value
+        self._len += 1
+
+    def extend(self, entries):
+        '''
+        Appends many rows at once from a dict column -> array of values (or a single value,
+        repeated on every row). Missing columns are filled as in `append`
+        '''
+        unknown = set(entries) - set(self._columns)
+        if unknown:
+            raise KeyError('Unknown book columns: %s' % sorted(unknown))
+        shape = np.broadcast(*[np.asarray(value, dtype=object) if column in self._labels else np.asarray(value)
+                               for column, value in entries.items()]).shape
+        if len(shape) > 1:
+            raise ValueError('Book columns need to be 1-D')
+        rows = shape[0] if shape else 1
+        while self._len + rows > self._capacity:
+            self._grow()
+        start, end = self._len, self._len + rows
+        for column, values in self._columns.items():
+            if column not in entries:
+                values[start:end] = self._default(column)
+            elif column in self._labels:
+                labels, inverse = np.unique(np.asarray(entries[column], dtype=str), return_inverse=True)
+                codes = np.array([self.intern(column, str(label)) for label in labels], dtype=np.int32)
+                values[start:end] = codes[inverse.ravel()] if shape else codes[0]
+            else:
+                values[start:end] = entries[column]
+        self._len = end
+
+    def __getitem__(self, column):
+        '''
+        Filled part of a column. Numeric columns are returned as read-only views,
+        text columns are decoded into an object array
+        '''
+        values = self._columns[column][:self._len]
+        if column in self._labels:
+            return np.array(self._labels[column], dtype=object)[values]
+        values = values.view()
+        values.flags.writeable = False
+        return values
+
+    def last(self, column):
+        if self._len == 0:
+            raise IndexError('The book is empty')
+        value = self._columns[column][self._len - 1]
+        if column in self._labels:
+            return self._labels[column][value]
+        return value.item()
+
+    def to_frame(self):
+        '''
+        Exports the book as a new pandas DataFrame. Numeric columns are copied in one block
+        each, so the frame can be modified without touching the book, and text columns become
+        Categoricals built on the interned codes
+        '''
+        import pandas as pd
+
+        data = {}
+        for column, values in self._columns.items():
+            values = values[:self._len]
+            if column in self._labels:
+                data[column] = pd.Categorical.from_codes(values, categories=self._labels[column])
+            else:
+                data[column] = values.copy()
+        return pd.DataFrame(data, copy=False)
@@ -0,0 +1,56 @@
+class VersionedCache(object):
+    def __init__(self):
+        """
+        Values derived from a market state (b, cost, exponentials, probabilities), each stored
+        with the state version it was computed at and an optional token of the other inputs it
+        depends on. A change of the state vector or of a parameter calls `invalidate`, after
+        which every value is recomputed. A book entry only calls `advance`: the version moves
+        on, but a value stays valid as long as its token (e.g. the fee b was computed with)
+        is unchanged, so a trade doesn't recompute b and the cost twice.
+
+        Hits and misses are counted per key, so it can be checked that the trading path stops
+        recomputing the same values.
+        """
+        self.version = 0
+        self._epoch = 0
+        self._values = {}
+        self.hits = {}
+        self.misses = {}
+
+    def invalidate(self):
+        self.version += 1
+        self._epoch += 1
+
+    def advance(self):
+        '''
+        Bumps the version without invalidating the values, which are checked by their token
+        '''
+        self.version += 1
+
+    def get(self, key, compute, token=None):
+        '''
+        Cached value of `key` computed since the last `invalidate` with the same `token`,
+        calling `compute()` on a miss
+        '''
+        entry = self._values.get(key)
+        if entry is not None and entry[0] == self._epoch and entry[1] == token:
+            self.hits[key] = self.hits.get(key, 0) + 1
+            return entry[2]
+        self.misses[key] = self.misses.get(key, 0) + 1
+        value = compute()
+        self._values[key] = (self._epoch, token, value)
+        return value
+
+    def clear_stats(self):
+        self.hits = {}
+        self.misses = {}
+
+    def info(self):
+        '''
+        Current version and total and per-key hit/miss counts
+        '''
+        return {'version': self.version,
+                'hits': sum(self.hits.values()),
+                'misses': sum(self.misses.values()),
+                'keys': {key: {'hits': self.hits.get(key, 0), 'misses': self.misses.get(key, 0)}
+                         for key in sorted(set(self.hits) | set(self.misses))}}
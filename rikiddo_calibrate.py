@@ -0,0 +1,175 @@
+from rikiddo_core_functions import fixFee, feeCurve
+from rikiddo_volume import volume_ratio_series
+from rikiddo_record import read_columns
+import itertools
+import argparse
+import json
+import csv
+import os
+import numpy as np
+
+
+def load_series(path, columns):
+    '''
+    Float columns of a recorded series: a CSV file (simulationRecord.csv or any trade export
+    with a header) or the `_columns` directory written next to it by RecordWriter, which is
+    read memory-mapped. Missing columns raise a KeyError
+    '''
+    if os.path.isdir(path):
+        data = read_columns(path)
+        return {column: np.asarray(data[column], dtype=np.float64) for column in columns}
+    binary = os.path.splitext(path)[0] + '_columns'
+    if os.path.isdir(binary):
+        return load_series(binary, columns)
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        missing = [column for column in columns if column not in header]
+        if missing:
+            raise KeyError('Columns not in %s: %s' % (path, missing))
+        positions = [header.index(column) for column in columns]
+        rows = [[row[i] for i in positions] for row in reader]
+    values = np.array(rows, dtype=np.float64).reshape(-1, len(columns))
+    return {column: values[:, i] for i, column in enumerate(columns)}
+
+
+def ratio_before_trades(volumes, short_window, long_window, warmup=0, round_up=True):
+    '''
+    Volume ratio seen by every trade of the series: the ratio of the volumes before it, as
+    the scoring rules and rikiddo.py read it before registering the trade
+    '''
+    after = volume_ratio_series(volumes, short_window, long_window, warmup, round_up)
+    return np.concatenate([[0.0], after[:-1]])
+
+
+def candidate_grid(param_1, param_2, param_3):
+    '''
+    Every (param_1, param_2, param_3) combination of the given values, as a (k, 3) array
+    '''
+    return np.array(list(itertools.product(param_1, param_2, param_3)), dtype=np.float64).reshape(-1, 3)
+
+
+def evaluate(r, amounts, candidates, alpha, mrc, max_fee=None, target=None, chunk_elements=1 << 22):
+    '''
+    Fee curve of every candidate over the whole ratio series, as 2-D (candidates x trades)
+    array operations, in blocks of candidates of about `chunk_elements` values.
+
+    The total fee of a trade is alpha + feeCurve(r), floored at alpha*mrc as in
+    RikiddoScoringRule._b. A trade is rejected when its total fee is above `max_fee`.
+
+    Parameters
+    ----------
+    r               array
+                    Volume ratio seen by every trade
+
+    amounts         array
+                    Amount of every trade; the LP revenue of a trade is total fee*|amount|
+                    (non-finite amounts count as no revenue)
+
+    candidates      array
+                    (k, 3) array of (param_1, param_2, param_3)
+
+    alpha           float
+                    Base fee
+
+    mrc             float
+                    Minimum revenue coefficient (floor alpha*mrc)
+
+    max_fee         float
+                    Optional. Highest total fee the traders accept
+
+    target          array
+                    Optional. Dynamic fee (without alpha) to fit, e.g. the recorded z
+
+    -------
+    Returns         dict
+                    Arrays with one value per candidate: lp_revenue, accepted (share of the
+                    trades), mean_fee and max_fee (total fee), and squared_error (mean,
+                    against `target`) when a target is given
+    '''
+    r = np.asarray(r, dtype=np.float64).ravel()
+    amounts = np.abs(np.asarray(amounts, dtype=np.float64).ravel())
+    amounts[~np.isfinite(amounts)] = 0.0
+    candidates = np.asarray(candidates, dtype=np.float64).reshape(-1, 3)
+    k = candidates.shape[0]
+    result = {name: np.zeros(k) for name in ('lp_revenue', 'accepted', 'mean_fee', 'max_fee')}
+    if target is not None:
+        target = np.asarray(target, dtype=np.float64).ravel()
+        result['squared_error'] = np.zeros(k)
+    block = max(1, chunk_elements//max(r.size, 1))
+    for start in range(0, k, block):
+        params = candidates[start:start + block]
+        fee = feeCurve(r[None, :], params[:, :1], params[:, 1:2], params[:, 2:3])
+        total = np.maximum(alpha + fee, alpha*mrc)
+        accepted = np.ones(total.shape, dtype=bool) if max_fee is None else total <= max_fee
+        rows = slice(start, start + params.shape[0])
+        result['lp_revenue'][rows] = np.where(accepted, total, 0.0) @ amounts
+        result['accepted'][rows] = accepted.mean(axis=1)
+        result['mean_fee'][rows] = total.mean(axis=1)
+        result['max_fee'][rows] = total.max(axis=1)
+        if target is not None:
+            result['squared_error'][rows] = ((fee - target[None, :])**2).mean(axis=1)
+    return result
+
+
+def calibrate(r, amounts, candidates, alpha, mrc, objective='revenue', max_fee=None, target=None):
+    '''
+    Best candidate for `objective`: 'revenue' maximizes the LP revenue of the accepted trades,
+    'fit' minimizes the squared error against `target`
+
+    -------
+    Returns         dict
+                    best parameters, their metrics, and the metrics of every candidate
+    '''
+    if objective not in ('revenue', 'fit'):
+        raise ValueError('Unknown objective %s' % objective)
+    if objective == 'fit' and target is None:
+        raise ValueError("The 'fit' objective needs a target series")
+    metrics = evaluate(r, amounts, candidates, alpha, mrc, max_fee=max_fee, target=target)
+    if objective == 'revenue':
+        best = int(np.argmax(metrics['lp_revenue']))
+    else:
+        best = int(np.argmin(metrics['squared_error']))
+    return {'best': dict(zip(['param_1', 'param_2', 'param_3'], candidates[best].tolist())),
+            'best_metrics': {name: float(values[best]) for name, values in metrics.items()},
+            'candidates': candidates,
+            'metrics': metrics}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Calibrates the dynamic fee curve against a recorded volume series')
+    parser.add_argument('--record', default='simulationRecord.csv', help='CSV file or RecordWriter _columns directory')
+    parser.add_argument('--volume', default='totalPoolVolume', help='column fed to the volume ratio')
+    parser.add_argument('--amount', default='transactCost', help='column with the amount of every trade')
+    parser.add_argument('--target', default=None, help="column with the dynamic fee to fit (e.g. z) for --objective fit")
+    parser.add_argument('--objective', default='revenue', choices=['revenue', 'fit'])
+    parser.add_argument('--param-1', type=float, nargs=3, default=[0.001, 0.1, 100], metavar=('LOW', 'HIGH', 'N'))
+    parser.add_argument('--param-2', type=float, nargs=3, default=[1, 10, 19], metavar=('LOW', 'HIGH', 'N'))
+    parser.add_argument('--param-3', type=float, nargs=3, default=[1, 3, 9], metavar=('LOW', 'HIGH', 'N'))
+    #defaults of rikiddo.py: fixFee(0.04, 2) as base fee, minRevenue with b = 0.7, 0.1 trader max fee
+    #and the 1 vs 6 trades volume windows
+    parser.add_argument('--alpha', type=float, default=fixFee(0.04, 2))
+    parser.add_argument('--mrc', type=float, default=0.7)
+    parser.add_argument('--max-fee', type=float, default=0.1)
+    parser.add_argument('--short-window', type=int, default=1)
+    parser.add_argument('--long-window', type=int, default=6)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--out', default=None, help='write the metrics of every candidate as JSON')
+    args = parser.parse_args()
+
+    columns = [args.volume, args.amount] + ([args.target] if args.target else [])
+    series = load_series(args.record, columns)
+    r = ratio_before_trades(series[args.volume], args.short_window, args.long_window, args.warmup)
+    candidates = candidate_grid(*[np.linspace(low, high, int(n)) for low, high, n in
+                                  (args.param_1, args.param_2, args.param_3)])
+    result = calibrate(r, series[args.amount], candidates, args.alpha, args.mrc, args.objective,
+                       max_fee=args.max_fee, target=series.get(args.target))
+
+    print(f"{len(candidates)} candidates over {r.size} trades")
+    print('best:', ', '.join(f'{name} {value:.6g}' for name, value in result['best'].items()))
+    print('     ', ', '.join(f'{name} {value:.6g}' for name, value in result['best_metrics'].items()))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'best': result['best'], 'best_metrics': result['best_metrics'],
+                       'candidates': result['candidates'].tolist(),
+                       'metrics': {name: values.tolist() for name, values in result['metrics'].items()}}, f)
@@ -1,16 +1,27 @@
 import numpy as np
-from scipy.optimize import fmin_cobyla
-import pandas as pd
 import math 
-from itertools import permutations
+from rikiddo_combo_index import ComboIndex
+from rikiddo_volume import VolumeRatioTracker
+from rikiddo_book import TradeBook
+from rikiddo_solver import solve_shares_terms
+from rikiddo_sparse import SparseState
+from rikiddo_cache import VersionedCache
+from rikiddo_history import StateHistory
+from rikiddo_instrument import instrumented, section
+from rikiddo_events import TradeEvent, DEBUG, default_sink
 
 class RikiddoComboScoringRule(object):
-    def __init__(self, possible_outcomes, n_params, initial_liquidity, vig=0.1, init=1.0, market='LS_LMSR', b=None):
+    #attributes that b depends on: setting any of them invalidates the cached state
+    _PARAMETERS = ('alpha', 'param_1', 'param_2', 'param_3')
+
+    def __init__(self, possible_outcomes, n_params, initial_liquidity, vig=0.1, init=1.0, market='LS_LMSR', b=None, volume_tracker=None, snapshot_every=64,
+                 instrumentation=None, events=None):
         """
         Parameters
         ----------
         possible_outcomes   list
-                            list of all possible outcomes of the market
+                            list of all possible outcomes of the market. Every ordered selection of
+                            them is a combo, traded by its id (see `combo_id`)
                             
         n_params            list
                             A list that consists on the 3 parameters that influnces the variable fee
@@ -25,47 +36,94 @@ class RikiddoComboScoringRule(object):
         init                float
                             The initial subsidies of the market, spread equally in this algorithm on all the outcomes.
         
-        
-                            
+        volume_tracker      VolumeRatioTracker/EMAVolumeRatioTracker
+                            Optional. Streaming tracker of the traded volume that feeds the ratio
+                            used by the dynamic fee. By default a 25 vs 45 trades window tracker
+
+        snapshot_every      int
+                            Trades between two full snapshots of the state in the history. The
+                            trades in between are stored as (combo id, delta) and replayed
+
+        instrumentation     Instrumentation
+                            Optional. As in RikiddoScoringRule
+
+        events              EventSink
+                            Optional. As in RikiddoScoringRule
+
+        b, the cost and the probabilities are cached as in RikiddoScoringRule
         """
+        self._cache = VersionedCache()
+        self.instrumentation = instrumentation
+        self.events = default_sink() if events is None else events
         
-        def combo_assets_maker(assets):
-            possible_combos = []
-            for L in range(1, len(assets)+1):
-                for subset in itertools.combinations(assets, L):
-                    possible_combos += [i for i in list(permutations(subset))]
-                    
-            combo_assets = []
-            for i in possible_combos:
-                value = ''
-                for j in range(len(i)):
-                    value += str(i[j])
-                combo_assets += [value]
-
-            return combo_assets
-            
-        self.possible_outcomes = combo_assets_maker(possible_outcomes)
+        #combos are addressed by integer ids, ranked on demand instead of enumerated
+        self.possible_outcomes = ComboIndex(possible_outcomes)
         
         self.initial_liquidity = initial_liquidity
         
         self.init = init
         self.n = len(self.possible_outcomes)
-        self._x = [np.ones([self.n])*init/self.n]
-        self._book = []
+        #sparse state: every combo starts at init/n and only the traded ones are stored
+        self._states = StateHistory(SparseState(self.n, init/self.n),
+                                    lambda x, b: x.probabilities(b),
+                                    snapshot_every=snapshot_every)
+        self._book = TradeBook({'name': str,
+                                'shares': np.float64,
+                                'outcome': np.int64,
+                                'paid': np.float64,
+                                'fee_cost': np.float64,
+                                'unit_price': np.float64,
+                                'lp': np.int8})
+        #book entries dropped when the market was restored from a snapshot (rikiddo_snapshot)
+        self._book_base = 0
         self.market_value = init
-        self._history = []
         self.alpha = vig*self.n/np.log(self.n)
         
         self.param_1 = n_params[0]
         self.param_2 = n_params[1]
         self.param_3 = n_params[2]
         
+        if volume_tracker is None:
+            volume_tracker = VolumeRatioTracker(25, 45, warmup=5)
+        self._volume = volume_tracker
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self._PARAMETERS:
+            self._cache.invalidate()
+
+    @property
+    def state_version(self):
+        '''
+        Version of the market state, bumped by every trade, book entry and parameter change
+        '''
+        return self._cache.version
+
+    def cache_info(self):
+        '''
+        State version and hit/miss counts of the cached b, cost, exponentials and probabilities
+        '''
+        return self._cache.info()
+
     @property
+    @instrumented('b')
     def b(self):
-        if len(self.book)<45:
-            return self._b_init(self.x)
+        return self._cache.get('b', self._compute_b, self._fee_token())
+
+    def _fee_token(self):
+        '''
+        What b depends on besides the state vector: nothing during the first 45 book entries,
+        the volume ratio afterwards
+        '''
+        if self._book_entries()<45:
+            return None
+        return self.ratio_function()
+
+    def _compute_b(self):
+        if self._book_entries()<45:
+            return self._b_init(self._states.current)
         else:
-              return self._b(self.x, self.ratio_function(self.book))
+              return self._b(self._states.current, self.ratio_function())
     
     def _b_init(self, x):
         return self.alpha * x.sum()
@@ -76,46 +134,30 @@ class RikiddoComboScoringRule(object):
             total_fee = self.alpha * 0.4
         return  total_fee * x.sum()
     
-    def ratio_function(self, book):
-        temp = book.copy()
+    @instrumented('ratio_function')
+    def ratio_function(self):
+        '''
+        Ratio between the short and long window average of the traded shares.
+        The windows are updated incrementally on every book entry, so reading it is O(1)
+        '''
+        return self._volume.ratio
 
-        if self.book.index[-1] <6:
-            periodLengthLong = self.book.index[-1]+1
-        else:
-            periodLengthLong = 5 
-        
-        periodLengthShort = 1 
-        if book.shape[0]<1:
-            periodLengthShort = 1
-        if book.shape[0]<2:
-            periodLengthLong = 1
-            
-        periodLengthLong = 45
-        periodLengthShort = 25
+    def _book_entries(self):
+        '''
+        Entries ever written to the book, including the ones left out of a restored snapshot
+        '''
+        return len(self._book) + self._book_base
 
-        #calculate EMA for the average volume
-        if len(temp['shares']) >5:
-            longWindow = math.ceil((temp['shares'].rolling(periodLengthLong).mean().tolist())[-1])
-            shortWindow = math.ceil((temp['shares'].rolling(periodLengthShort).mean()).tolist()[-1])
-            
-        else:
-            if len(temp['shares'])>1:
-                shortWindow = temp['shares'].mean()
-                longWindow = temp['shares'].mean()
-            elif len(temp['shares'])==1:
-                shortWindow = math.ceil(temp['shares'][0])
-                longWindow = math.ceil(temp['shares'][0])
-                
-        if longWindow ==0:
-            r = 0
-        else:
-            r = shortWindow/longWindow
-        return r
+    def _append_book(self, entry):
+        self._book.append(entry)
+        self._volume.update(entry['shares'])
+        #the state vector didn't move: b and the cost are rechecked against the new ratio
+        self._cache.advance()
     
     def initial_liquidity(self, amount):
-        print(self.possible_outcomes)
+        self.events.warn('initial_liquidity', 'Initial liquidity on the outcomes', str(self.possible_outcomes), level=DEBUG)
         for i in range(0, len(self.possible_outcomes)):
-            self._book.append({'name': 'Zeitgeist', 
+            self._append_book({'name': 'Zeitgeist', 
                                 'shares': amount, 
                                 'outcome': i, 
                                 'paid': amount*(1/len(self.possible_outcomes)), 
@@ -124,58 +166,144 @@ class RikiddoComboScoringRule(object):
         
         return self.book
         
+    def combo_id(self, combo):
+        '''
+        Id of a combo given as a tuple of outcomes, to be used as `outcome` in the trades
+        '''
+        return self.possible_outcomes.rank(tuple(combo))
+
+    def combo(self, id):
+        return self.possible_outcomes.unrank(id)
+        
     @property
     def book(self):
-        return pd.DataFrame(self._book)
+        return self._book.to_frame()
     
     @property
     def x(self):
-        return self._x[-1].copy()
+        return self._states.current.copy()
     
+    @instrumented('cost')
     def cost(self, x):
-        return self.b*np.log(np.exp(x/self.b).sum())
+        return x.cost(self.b)
+
+    def _state(self):
+        '''
+        (cost, shift, baseline term, touched terms, total) of the current state, computed once
+        per state and b
+        '''
+        def compute():
+            b = self.b
+            shift, base_term, terms, total = self._states.current.exp_terms(b)
+            return b*(shift + math.log(total)), shift, base_term, terms, total
+        return self._cache.get('state', compute, self.b)
+
+    def _probabilities(self):
+        '''
+        Probabilities of the current state as a SparseState, computed once per state and b
+        '''
+        b = self.b
+        return self._cache.get('probabilities', lambda: self._states.current.probabilities(b), b)
     
     def _new_x(self, shares, outcome):
         new_x = self.x
-        new_x[outcome] += shares        
+        new_x.add(outcome, shares)
         return new_x
             
     def price(self, shares, outcome):
         return self._price(self._new_x(shares, outcome))
         
     def _price(self, x):
-        return self.cost(x)-self.cost(self.x)
+        return self.cost(x)-self._state()[0]
+
+    def quote_many(self, shares, outcomes):
+        '''
+        Quotes many (shares, outcome) trades against the current state at once.
+        b and the current cost are computed a single time and every candidate state
+        is evaluated in one 2-D pass.
+
+        Parameters
+        ----------
+        shares          array
+                        Shares to buy (negative to sell) of every quote
+
+        outcomes        array
+                        Outcome index of every quote
+
+        -------
+        Returns         tuple
+                        (costs, average prices, post-trade probabilities). costs[i] is what
+                        `price(shares[i], outcomes[i])` returns and probabilities[i] is the probability
+                        of outcomes[i] after its trade (the full vectors would be of the size of the combo space)
+        '''
+        shares, outcomes = np.broadcast_arrays(np.asarray(shares, dtype=np.float64), np.asarray(outcomes))
+        shares = shares.ravel()
+        outcomes = outcomes.ravel()
+        state = self._states.current
+        b = self.b
+        _, shift, _, _, total = self._state()
+        current = state[outcomes]
+        #only the term of the traded combo changes in the sum of exponentials
+        new_terms = np.exp((current + shares)/b - shift)
+        new_totals = total - np.exp(current/b - shift) + new_terms
+        costs = b*np.log(new_totals/total)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            average_prices = costs/shares
+        return costs, average_prices, new_terms/new_totals
     
     def register_x(self, x):
-        self._x.append(x)
+        self._states.replace(x)
+        self._cache.invalidate()
+
+    def _register_trade(self, shares, outcome):
+        self._states.apply(outcome, shares)
+        self._cache.invalidate()
         
-    def calculate_shares(self, paid, outcome):
-        obj_func = lambda s: np.abs(self.price(s, outcome) - paid)
-        return fmin_cobyla(obj_func, paid/self.p[outcome], [])
+    @instrumented('calculate_shares')
+    def calculate_shares(self, paid, outcome, method='closed_form'):
+        '''
+        Number of shares of `outcome` that can be bought with `paid` at the current state.
+        `paid` and `outcome` can also be arrays to solve many requests at once.
+        method='cobyla' keeps the original derivative-free search for comparison
+        '''
+        if method == 'cobyla':
+            #scipy is only needed by this legacy path, so it is imported here
+            from scipy.optimize import fmin_cobyla
+            obj_func = lambda s: np.abs(self.price(s[0], outcome) - paid)
+            with section(self.instrumentation, 'fmin_cobyla'):
+                return float(fmin_cobyla(obj_func, paid/self.probability(outcome), [])[0])
+        state = self._states.current
+        b = self.b
+        _, shift, _, _, total = self._state()
+        current = state[outcome]
+        shares = solve_shares_terms(current, b, paid, shift, total, np.exp(current/b - shift))
+        if np.any(np.isnan(shares)):
+            raise ValueError('The market cannot pay out %s for outcome %s' % (paid, outcome))
+        return shares
     
+    @instrumented('buy_shares')
     def buy_shares(self, name, paid, outcome):
         shares = self.calculate_shares(paid, outcome)
-        self.register_x(self._new_x(shares, outcome))
-        self._book.append({'name':name, 
+        self._register_trade(shares, outcome)
+        self._append_book({'name':name, 
                            'shares':shares, 
                            'outcome':outcome, 
                            'paid':paid})
-        self._history.append(self.p)
+        self._states.record(self.b)
         self.market_value += paid
-        print("%s BOUGHT %2.2f shares of outcome %d"%(
-                name, shares, outcome))
+        self.events.emit(TradeEvent('buy', name, outcome, shares, paid))
         return shares
     
+    @instrumented('sell_shares')
     def sell_shares(self, name, shares, outcome):
         price = self.price(-shares, outcome)
-        self._book.append({'name':name, 
+        self._append_book({'name':name, 
                            'shares':-shares, 
                            'outcome':outcome, 
                            'paid':-price}) 
         self.market_value -= price        
-        self._history.append(self.p)   
-        print("%s SOLD %2.2f shares of outcome %d"%(
-                name, shares, outcome))
+        self._states.record(self.b)
+        self.events.emit(TradeEvent('sell', name, outcome, shares, price))
         
         return price
     
@@ -188,28 +316,48 @@ class RikiddoComboScoringRule(object):
         for i in range(len(prices)):
             share = shares*prices[i]
             #exec(f'asset_{i} = shares*prices[{i}]')
-            self._book.append({'name':name, 
+            self._append_book({'name':name, 
                             'shares': share,
-                            'outcome': self.possible_outcomes[i],
+                            'outcome': i,
                             'paid': prices[i], 
                             'fee_cost': 0,
                             'unit_price': prices[i]/share,
                             'lp': 1})
             price_share += []
             
-        self._history.append(list(self.p))
-        print("%s provided liquidity the equivalent to %2.2f ZTG."%(
-                name, shares))
+        self._states.record(self.b)
+        self.events.emit(TradeEvent('liquidity', name, None, price_share, shares))
         
         return price_share
 
     def outcome_probability(self):
-        K = np.exp(self.x/self.b)
-        return K/K.sum()
+        return self._probabilities().to_dense()
+
+    def probability(self, outcome):
+        '''
+        Probability of one combo (or an array of them) without building the full vector
+        '''
+        return self._probabilities()[outcome]
     
     @property
     def p(self):
         return self.outcome_probability()
     
-    def history(self):
-        return np.array(self._history)
+    def x_at(self, t):
+        '''
+        State (SparseState) after the t-th entry of the history (negative indexes count from the end)
+        '''
+        return self._states.x_at(t)
+
+    def p_at(self, t):
+        '''
+        Probabilities of every combo recorded at the t-th entry of the history
+        '''
+        return self._states.p_at(t).to_dense()
+
+    def history(self, chunk_size=1024):
+        '''
+        Probabilities of every combo after every buy, sell and liquidity provision, lazily
+        yielded as 2-D arrays of up to `chunk_size` rows
+        '''
+        return self._states.chunks(chunk_size, dense=SparseState.to_dense)
@@ -0,0 +1,140 @@
+from itertools import permutations, islice
+import bisect
+
+
+class ComboIndex(object):
+    def __init__(self, outcomes, max_size=None):
+        """
+        Indexed space of combinatorial outcomes: every ordered selection of 1 to `max_size`
+        distinct outcomes. Combos are ranked to integer ids (and back) arithmetically, so the
+        space is never materialized.
+
+        Ids are ordered by combo size and, inside a size, lexicographically by the position
+        of the outcomes in `outcomes` (the order of itertools.permutations(outcomes, k)).
+
+        Parameters
+        ----------
+        outcomes        list
+                        Distinct labels of the base outcomes of the market
+
+        max_size        int
+                        Optional. Biggest combo size (default: all the outcomes)
+        """
+        self.outcomes = list(outcomes)
+        self._positions = {outcome: i for i, outcome in enumerate(self.outcomes)}
+        if len(self._positions) != len(self.outcomes):
+            raise ValueError('Outcome labels need to be unique')
+        n = len(self.outcomes)
+        self.max_size = n if max_size is None else min(max_size, n)
+
+        #falling factorials P(n - i, j) used as the mixed radix of the ranks
+        self._falling = [[1]*(self.max_size + 1) for _ in range(n + 1)]
+        for m in range(n + 1):
+            for j in range(1, self.max_size + 1):
+                self._falling[m][j] = self._falling[m][j - 1]*(m - j + 1) if j <= m else 0
+        #offsets[k] is the id of the first combo of size k
+        self._offsets = [0, 0]
+        for k in range(1, self.max_size + 1):
+            self._offsets.append(self._offsets[-1] + self._falling[n][k])
+
+    def __len__(self):
+        return self._offsets[-1]
+
+    @property
+    def size(self):
+        '''
+        Number of combos. Unlike len(), not limited to sys.maxsize (about 20 outcomes)
+        '''
+        return self._offsets[-1]
+
+    def __repr__(self):
+        return 'ComboIndex(%d outcomes, %d combos)' % (len(self.outcomes), self.size)
+
+    def size_range(self, k):
+        '''
+        First id and end id (exclusive) of the combos of size k
+        '''
+        return self._offsets[k], self._offsets[k + 1]
+
+    def rank(self, combo):
+        '''
+        Id of an ordered combo, given as a tuple of outcome labels.
+
+        Every element is located among the positions already used with a binary search, so
+        a rank takes O(k log k) comparisons for k outcomes. Keeping the used positions sorted
+        costs one list insert per element, i.e. O(k^2) pointer moves in the worst case, but
+        those are memmoves of at most k pointers (a few hundred bytes for any combo a market
+        can trade) and the mixed-radix big integers already make the arithmetic superlinear
+        in k. A swap-based O(k) scheme (Myrvold-Ruskey) would not give the lexicographic ids
+        that `__iter__`, `chunks` and saved combo states rely on.
+        '''
+        k = len(combo)
+        if not 1 <= k <= self.max_size:
+            raise ValueError('Combos need between 1 and %d outcomes' % self.max_size)
+        n = len(self.outcomes)
+        used = []
+        rank = 0
+        for i, outcome in enumerate(combo):
+            position = self._positions[outcome]
+            slot = bisect.bisect_left(used, position)
+            if slot < len(used) and used[slot] == position:
+                raise ValueError('Outcome %s is repeated in the combo' % (outcome,))
+            rank += (position - slot)*self._falling[n - i - 1][k - i - 1]
+            used.insert(slot, position)
+        return self._offsets[k] + rank
+
+    def unrank(self, id):
+        '''
+        Ordered combo (tuple of outcome labels) of an id, with the same costs as `rank`
+        '''
+        if not 0 <= id < self.size:
+            raise IndexError('Combo id %d out of range' % id)
+        k = bisect.bisect_right(self._offsets, id) - 1
+        rank = id - self._offsets[k]
+        n = len(self.outcomes)
+        used = []
+        combo = []
+        for i in range(k):
+            digit, rank = divmod(rank, self._falling[n - i - 1][k - i - 1])
+            #the digit-th outcome not used yet: before used[j] there are used[j] - j unused
+            #positions, so it comes right after the first j used positions with more than
+            #`digit` unused ones before them (binary search, used[j] - j doesn't decrease)
+            lo, hi = 0, len(used)
+            while lo < hi:
+                mid = (lo + hi)//2
+                if used[mid] - mid <= digit:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            position = digit + lo
+            used.insert(lo, position)
+            combo.append(self.outcomes[position])
+        return tuple(combo)
+
+    def __getitem__(self, id):
+        return self.unrank(id)
+
+    def __iter__(self):
+        for k in range(1, self.max_size + 1):
+            for combo in permutations(self.outcomes, k):
+                yield combo
+
+    def chunks(self, size, start=0):
+        '''
+        Lazily yields (first id, list of combos) blocks of `size` combos from id `start`.
+        From the beginning the combos come straight from itertools.permutations, otherwise
+        every id is unranked
+        '''
+        id = start
+        if start == 0:
+            combos = iter(self)
+            while True:
+                block = list(islice(combos, size))
+                if not block:
+                    return
+                yield id, block
+                id += len(block)
+        while id < self.size:
+            end = min(id + size, self.size)
+            yield id, [self.unrank(i) for i in range(id, end)]
+            id = end
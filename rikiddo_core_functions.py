@@ -1,9 +1,7 @@
-import pandas as pd
-from datetime import datetime, date, timedelta
-import json
 import numpy as np
-import random
 import math
+from rikiddo_kernel import exp_terms, logsumexp
+from rikiddo_events import DEBUG, default_sink
 
 def fixFee(vig, n):
     fee = vig/(n*math.log(n))
@@ -12,7 +10,8 @@ def fixFee(vig, n):
 def getVolumeRatio(totalCol, df, transactionNumber):
     '''
     totalCol: the name of the column that stores the total volume of the entire amount of assets.
-    df: the name of the dataframe where the data is storaged
+    df: the name of the dataframe where the data is storaged (a pandas DataFrame, pandas
+    itself isn't imported here)
     '''
     temp = df.copy()
     volumeSum = temp[totalCol]
@@ -31,7 +30,7 @@ def getVolumeRatio(totalCol, df, transactionNumber):
         longWindow = math.ceil((temp[totalCol].rolling(periodLengthLong).mean().tolist())[-1])
         shortWindow = math.ceil((temp[totalCol].rolling(periodLengthShort).mean()).tolist()[-1])
     else:
-        print('long len less than 2')
+        default_sink().warn('warmup', 'long len less than 2', len(volumeSum), level=DEBUG)
         if len(volumeSum)>1:
             shortWindow = volumeSum.mean()
             longWindow = volumeSum.mean()
@@ -48,22 +47,27 @@ def getVolumeRatio(totalCol, df, transactionNumber):
     return r
 
 def z_r(r):
-    z = (0.01*(r))/math.sqrt(6 + (r)**2)
+    z = (0.01*(r))/np.sqrt(6 + (r)**2)
     return z
 
+def feeCurve(r, param_1, param_2, param_3):
+    '''
+    Dynamic fee param_1*r/sqrt(param_2 + r**param_3) (z_r is feeCurve(r, 0.01, 6, 2)).
+    Every argument broadcasts, e.g. a column of candidate parameters against a row of ratios
+    '''
+    r = np.asarray(r, dtype=np.float64)
+    return param_1*r/np.sqrt(param_2 + r**param_3)
+
 
 def eValue(q, totalFee):
-    eVal = 0
     sumQ = sum(q)
     dynamicFee = totalFee*sumQ
-    for q_i in q:
-        if dynamicFee !=0:
-            e = math.exp(q_i/dynamicFee)
-        else:
-            e = math.exp(q_i/0.005) #0.005 is the fixed value assumed for the initial fee
-        eVal += e
+    if dynamicFee !=0:
+        eVal = np.exp(logsumexp(np.array(q)/dynamicFee))
+    else:
+        eVal = np.exp(logsumexp(np.array(q)/0.005)) #0.005 is the fixed value assumed for the initial fee
 
-    return eVal, dynamicFee
+    return float(eVal), dynamicFee
 
 def lsdCostFunction(q, dynamicFee):
     '''
@@ -71,35 +75,34 @@ def lsdCostFunction(q, dynamicFee):
     The cost function captures the amount of total assets wagered in the market where C(q0) 
     is the market maker’s maximum subsidy to the market
     '''
-    qa = np.array(q)
-    qa = qa/dynamicFee
-    vector = np.vectorize(np.exp)
-    x = vector(qa)
-    cost= dynamicFee*math.log(x.sum())
-    return cost
+    qa = np.array(q, dtype=np.float64)
+    cost = dynamicFee*logsumexp(qa/dynamicFee)
+    return float(cost)
 
 def lsdPriceFunction_i(costFunction,totalFee,q_i,q_j):
     '''
     The price function Pi(q) gives the current cost of buying an infinitely 
     small quantity of the category i token.
+    The sums of exponentials are only formed relative to their shift, so large
+    balances don't overflow.
     '''
-    sumQj = sum(q_j)
-    e_j, dynamicFee = eValue(q_j, totalFee)
-    e_i, dynamicFee = eValue(q_i, totalFee)
-    sum_ej = 0
-    qxe = 0
-    for q in q_j:
-        e = math.exp(q/dynamicFee)
-        sum_ej += e
-        qxe += q*e
-    
-    numerator = e_i*sumQj - qxe
-    denominator = sumQj*sum_ej
+    q_i = np.array(q_i, dtype=np.float64)
+    q_j = np.array(q_j, dtype=np.float64)
+    sumQj = q_j.sum()
+    dynamicFee_j = totalFee*sumQj
+    dynamicFee = totalFee*q_i.sum()
+    lse_j = logsumexp(q_j/(dynamicFee_j if dynamicFee_j != 0 else 0.005))
+    lse_i = logsumexp(q_i/(dynamicFee if dynamicFee != 0 else 0.005))
+
     if sumQj != 0:
-        p_i = totalFee*math.log(e_j) + (numerator/denominator)
+        terms = exp_terms(q_j/dynamicFee)
+        qxe = (q_j*terms.terms).sum()
+        numerator = np.exp(lse_i - terms.shift)*sumQj - qxe
+        denominator = sumQj*terms.total
+        p_i = totalFee*lse_j + (numerator/denominator)
     else:
-        p_i = totalFee*math.log(e_j)
-    return p_i
+        p_i = totalFee*lse_j
+    return float(p_i)
 
 def minRevenue(b, fee):
     '''
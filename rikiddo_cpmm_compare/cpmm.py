@@ -1,4 +1,9 @@
-import pandas as pd
+import numpy as np
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rikiddo_book import TradeBook
 
 class CPMM(object):
     def __init__(self, initial_state, fee):
@@ -10,16 +15,48 @@ class CPMM(object):
 
         fee             float
                         number between 0 and 1 representing the fixed fee of the CPMM
+
+        The reserves are kept in a NumPy array (in the order of `initial_state`), so prices are
+        refreshed in one O(n) pass. The sum of the outcome reserves is taken from the array on
+        every refresh: a running sum loses all its precision once trades drain the reserves
         '''
-        self._state = initial_state.copy()
+        if (fee<0) | (fee>1):
+            raise ValueError('Fee needs to be inside [0,1] interval')
+        self._assets = list(initial_state)
+        self._index = {asset: i for i, asset in enumerate(self._assets)}
+        self._reserves = np.array([initial_state[asset] for asset in self._assets], dtype=np.float64)
+        #outcome assets, i.e. every asset but ZTG
+        self._outcomes = np.array([i for i, asset in enumerate(self._assets) if asset != 'ZTG'], dtype=np.int64)
+        self._is_outcome = np.zeros(len(self._assets), dtype=bool)
+        self._is_outcome[self._outcomes] = True
         self._fee = fee
         self._fee_inverse = 1.0 + fee
         self._fee_sum = []
         self._liquidity = {}
-        self._book = []
+        self._book = TradeBook({'operation': str,
+                                'shares': np.float64,
+                                'outcome': str,
+                                'paid': np.float64,
+                                'fee': np.float64})
         self._history = []
-        if (fee<0) | (fee>1):
-            raise ValueError('Fee needs to be inside [0,1] interval')
+
+    def _position(self, asset):
+        try:
+            return self._index[asset]
+        except KeyError:
+            raise KeyError('Unknown asset %s' % (asset,)) from None
+
+    def prices(self):
+        '''
+        Prices of the outcome assets as an array, in the order of `outcomes`
+        '''
+        reserves = self._reserves[self._outcomes]
+        total = reserves.sum()
+        return (total - reserves)/total
+
+    @property
+    def outcomes(self):
+        return [self._assets[i] for i in self._outcomes]
 
     def get_prices(self, asset=None, compared_to=None):
         '''
@@ -30,23 +67,19 @@ class CPMM(object):
 
         comparet_to     str
                         Optional. Name of the asset inside the pool that you want to compare with
-        
+
         -------
         Returns         float/dict
                         Returns a float number in case that the name of the asset is provided.
                         If not, returns a dictionary with all the asset prices in the pool
         '''
-        temp_dict = self._state.copy()
-        del temp_dict['ZTG']
-        
         if (asset is None) & (compared_to is None):
-            prices = {}
-            for key, value in temp_dict.items():
-                prices[key] = (sum(temp_dict.values())-value)/(sum(temp_dict.values()))
+            prices = dict(zip(self.outcomes, self.prices().tolist()))
         elif compared_to is None:
-            prices = (sum(temp_dict.values())-temp_dict[asset])/sum(temp_dict.values())
+            total = self._reserves[self._outcomes].sum()
+            prices = (total-self._reserves[self._position(asset)])/total
         else:
-            prices = temp_dict[compared_to]/temp_dict[asset]
+            prices = self._reserves[self._position(compared_to)]/self._reserves[self._position(asset)]
 
         return prices
 
@@ -57,10 +90,10 @@ class CPMM(object):
         ----------
         in_number       int
                         Asset amount that is intended to put into the pool
-        
+
         asset_out       float
                         Name of the asset that is taken out of the pool (bought)
-        
+
         asset_in        float
                         Name of asset that is put into the pool (ZTG by default)
 
@@ -68,11 +101,12 @@ class CPMM(object):
         Returns         float
                         Amount of assets that the pool is going to give away (fees discounted)
         '''
-        k = self._state[asset_in] * self._state[asset_out]
+        i_in, i_out = self._position(asset_in), self._position(asset_out)
+        k = self._reserves[i_in] * self._reserves[i_out]
         num_in = in_number / self._fee_inverse
-        num_out = self._state[asset_out] - k / (self._state[asset_in] + num_in)
-        self._state[asset_in] += in_number
-        self._state[asset_out] -= num_out
+        num_out = float(self._reserves[i_out] - k / (self._reserves[i_in] + num_in))
+        self._reserves[i_in] += in_number
+        self._reserves[i_out] -= num_out
         self._fee_sum += [in_number - num_in] #fee is expressed in ZTG
         self._book.append({'operation': 'buy',
                             'shares': num_out,
@@ -80,8 +114,8 @@ class CPMM(object):
                             'paid': in_number,
                             'fee': in_number - num_in
                         })
-        self._history.append(list(self.get_prices().values()))
-        
+        self._history.append(self.prices())
+
         return num_out
 
     def sell_shares(self, out_number, asset_in, asset_out='ZTG'):
@@ -90,10 +124,10 @@ class CPMM(object):
         ----------
         out_number      int
                         Asset amount that is intended to extract outside the pool
-        
+
         asset_in        float
                         Name of the asset that is taken out of the pool (sold)
-        
+
         asset_out       float
                         Name of asset that is put into the pool (ZTG by default)
 
@@ -101,22 +135,105 @@ class CPMM(object):
         Returns         float
                         Amount of assets that the pool is going to receive (fees discounted)
         '''
-        k = self._state[asset_in] * self._state[asset_out]
+        i_in, i_out = self._position(asset_in), self._position(asset_out)
+        k = self._reserves[i_in] * self._reserves[i_out]
         num_out = out_number/self._fee_inverse
-        num_in = self._state[asset_in] - k / (self._state[asset_out] - num_out)
-        self._state[asset_out] -= num_out
-        self._state[asset_in] += num_in
-        self._fee_sum += [out_number - num_out] 
+        num_in = float(self._reserves[i_in] - k / (self._reserves[i_out] - num_out))
+        self._reserves[i_out] -= num_out
+        self._reserves[i_in] += num_in
+        self._fee_sum += [out_number - num_out]
         self._book.append({'operation': 'sell',
                             'shares': num_in,
                             'outcome': asset_in,
                             'paid': out_number,
                             'fee': out_number - num_out
                         })
-        self._history.append(list(self.get_prices().values()))
-        
+        self._history.append(self.prices())
+
         return num_in
 
+    def swap_many(self, amounts, assets, sell=False):
+        '''
+        Applies a sequence of swaps against ZTG at once, with the same result as calling
+        `buy_shares(amounts[i], assets[i])` (or `sell_shares` where `sell[i]`) in order.
+
+        Every swap only moves ZTG and its own asset, so the ZTG reserve R before each swap is
+        a cumulative sum of the previous ones and the reserve of every asset evolves by the
+        product of the factors of the swaps on it: R/(R + n) for a buy and, as in
+        `sell_shares`, 2 - R/(R - n) for a sell, with n = amount/(1 + fee). Everything is
+        computed with array operations, with a loop over the distinct assets only.
+
+        Parameters
+        ----------
+        amounts         array
+                        ZTG put into the pool (buys) or taken out of it (sells)
+
+        assets          list/array
+                        Name of the asset bought or sold in every swap
+
+        sell            bool/array
+                        Which swaps are sells
+
+        -------
+        Returns         array
+                        Shares given away (buys) or received (sells) by the pool in every swap
+        '''
+        amounts = np.asarray(amounts, dtype=np.float64).ravel()
+        positions = np.array([self._position(asset) for asset in np.asarray(assets, dtype=object).ravel().tolist()],
+                             dtype=np.int64)
+        sell = np.broadcast_to(np.asarray(sell, dtype=bool), amounts.shape)
+        if positions.shape != amounts.shape:
+            raise ValueError('amounts and assets need the same length')
+        if not amounts.size:
+            return np.zeros(0)
+        if not self._is_outcome[positions].all():
+            raise ValueError('swap_many trades outcome assets against ZTG')
+        ztg = self._position('ZTG')
+
+        effective = amounts/self._fee_inverse
+        #ZTG added to the pool by every swap: the whole amount on buys, the fee-less one on sells
+        ztg_delta = np.where(sell, -effective, amounts)
+        ztg_before = self._reserves[ztg] + np.concatenate([[0.0], np.cumsum(ztg_delta[:-1])])
+        denominator = ztg_before + np.where(sell, -effective, effective)
+        if np.any(denominator <= 0):
+            raise ValueError('A sell takes out more ZTG than the pool holds')
+        factors = ztg_before/denominator
+        factors = np.where(sell, 2 - factors, factors)
+
+        before = np.empty_like(amounts)
+        after = np.empty_like(amounts)
+        reserves = self._reserves.copy()
+        #price path: outcome reserves after every swap, each asset holding its last value
+        #between its own swaps (no running sums, which lose precision as the reserves drain)
+        levels = np.tile(reserves[self._outcomes], (amounts.size, 1))
+        for i in np.unique(positions).tolist():
+            swaps = np.flatnonzero(positions == i)
+            path = reserves[i]*np.multiply.accumulate(factors[swaps])
+            after[swaps] = path
+            before[swaps[0]] = reserves[i]
+            before[swaps[1:]] = path[:-1]
+            last = np.full(amounts.size, -1)
+            last[swaps] = np.arange(swaps.size)
+            last = np.maximum.accumulate(last)
+            column = np.searchsorted(self._outcomes, i)
+            levels[:, column] = np.where(last >= 0, path[last], reserves[i])
+            reserves[i] = path[-1]
+        reserves[ztg] += ztg_delta.sum()
+        shares = np.where(sell, after - before, before - after)
+
+        totals = levels.sum(axis=1, keepdims=True)
+        self._history.extend((totals - levels)/totals)
+
+        self._reserves = reserves
+        fees = amounts - effective
+        self._fee_sum += fees.tolist()
+        self._book.extend({'operation': np.where(sell, 'sell', 'buy'),
+                           'shares': shares,
+                           'outcome': [self._assets[i] for i in positions.tolist()],
+                           'paid': amounts,
+                           'fee': fees})
+        return shares
+
     def provide_liquidity(self, id, amount):
         '''
         Use
@@ -127,7 +244,7 @@ class CPMM(object):
         ----------
         id              int
                         Number that enables to identify each Liquidity Provider by separate
-        
+
         amount          int
                         Total amount of ZTG provided
 
@@ -135,12 +252,10 @@ class CPMM(object):
         Returns         dict
                         A dictionary with the quantity of shares provided plus the total amount of ZTG
         '''
-        getprices = self.get_prices()
-        liquidity_prividing = {}
-        for key, value in getprices.items():
-            liquidity_prividing[key] = value*amount
-            self._state[key] += value*amount
-        
+        provided = self.prices()*amount
+        self._reserves[self._outcomes] += provided
+        liquidity_prividing = dict(zip(self.outcomes, provided.tolist()))
+
         liquidity_prividing['total_provided'] = amount
         self._liquidity[id] = liquidity_prividing
 
@@ -150,15 +265,24 @@ class CPMM(object):
                             'paid': amount,
                             'fee': 0
                         })
-        
-        self._history.append(list(self.get_prices().values()))
-        
+
+        self._history.append(self.prices())
+
         return liquidity_prividing
 
+    @property
+    def fee(self):
+        return self._fee
+
     @property
     def book(self):
-        return pd.DataFrame(self._book)
-    
+        return self._book.to_frame()
+
     @property
     def state(self):
-        return self._state
+        '''
+        Reserves of every asset, as a new dict. The reserves live in an array, so unlike the
+        dict this property used to return, writing to it doesn't change the pool: trade
+        through the methods
+        '''
+        return dict(zip(self._assets, self._reserves.tolist()))
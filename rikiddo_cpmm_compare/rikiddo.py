@@ -1,10 +1,24 @@
 import numpy as np
-from scipy.optimize import fmin_cobyla
-import pandas as pd
 import math 
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rikiddo_volume import VolumeRatioTracker
+from rikiddo_book import TradeBook
+from rikiddo_solver import solve_shares_terms
+from rikiddo_kernel import cost_and_prices
+from rikiddo_cache import VersionedCache
+from rikiddo_history import StateHistory
+from rikiddo_instrument import instrumented, section
+from rikiddo_events import TradeEvent, default_sink
 
 class RikiddoScoringRule(object):
-    def __init__(self, possible_outcomes, n_params, vig=0.1, init=1.0, mrc = 0.4):
+    #attributes that b depends on: setting any of them invalidates the cached state
+    _PARAMETERS = ('alpha', 'param_1', 'param_2', 'param_3', 'mrc')
+
+    def __init__(self, possible_outcomes, n_params, vig=0.1, init=1.0, mrc = 0.4, volume_tracker=None, snapshot_every=64,
+                 instrumentation=None, events=None):
         """
         Parameters
         ----------
@@ -24,15 +38,48 @@ class RikiddoScoringRule(object):
         
         mrc                 float
                             Value for the Minimum Revenue Coefficient
+
+        volume_tracker      VolumeRatioTracker/EMAVolumeRatioTracker
+                            Optional. Streaming tracker of the traded volume that feeds the ratio
+                            used by the dynamic fee. By default a 25 vs 45 trades window tracker
+
+        snapshot_every      int
+                            Trades between two full snapshots of the state in the history. The
+                            trades in between are stored as (outcome, delta) and replayed
+
+        instrumentation     Instrumentation
+                            Optional. Counters and timers of cost, b, ratio_function,
+                            calculate_shares (and fmin_cobyla), buy_shares and sell_shares.
+                            It can also be attached or removed later through `instrumentation`
+
+        events              EventSink
+                            Optional. Where the trade events are sent (see rikiddo_events).
+                            By default the text lines printed on stdout; NullSink() drops them
                             
+        b, the cost and the exponentials and probabilities of the current state are cached
+        until the state vector or a parameter changes. A book entry only moves the volume
+        ratio, so b is then reused as long as the fee it was computed with is unchanged, and
+        the cost as long as b is (see `state_version` and `cache_info`)
         """
+        self._cache = VersionedCache()
+        self.instrumentation = instrumentation
+        self.events = default_sink() if events is None else events
         self.possible_outcomes = possible_outcomes
         
         self.n = len(possible_outcomes)
-        self._x = [np.ones([self.n])*init/self.n]
-        self._book = []
+        self._states = StateHistory(np.ones([self.n])*init/self.n,
+                                    lambda x, b: cost_and_prices(x, b)[1],
+                                    snapshot_every=snapshot_every)
+        self._book = TradeBook({'name': str,
+                                'shares': np.float64,
+                                'outcome': np.int64,
+                                'paid': np.float64,
+                                'cost_function': np.float64,
+                                'dynamic_fee': np.float64,
+                                'lp': np.int8})
+        #book entries dropped when the market was restored from a snapshot (rikiddo_snapshot)
+        self._book_base = 0
         self.market_value = init
-        self._history = []
         self.alpha = vig*self.n/np.log(self.n)
         
         self.param_1 = n_params[0]
@@ -41,12 +88,49 @@ class RikiddoScoringRule(object):
         
         self.mrc = mrc
         
+        if volume_tracker is None:
+            volume_tracker = VolumeRatioTracker(25, 45, warmup=5)
+        self._volume = volume_tracker
+        #orders waiting for the end of the block (see submit_order and settle_block)
+        self._block = []
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self._PARAMETERS:
+            self._cache.invalidate()
+
+    @property
+    def state_version(self):
+        '''
+        Version of the market state, bumped by every trade, book entry and parameter change
+        '''
+        return self._cache.version
+
+    def cache_info(self):
+        '''
+        State version and hit/miss counts of the cached b, cost, exponentials and probabilities
+        '''
+        return self._cache.info()
+
     @property
+    @instrumented('b')
     def b(self):
-        if len(self.book)<45:
-            return self._b_init(self.x)
+        return self._cache.get('b', self._compute_b, self._fee_token())
+
+    def _fee_token(self):
+        '''
+        What b depends on besides the state vector: nothing during the first 45 book entries,
+        the volume ratio afterwards
+        '''
+        if self._book_entries()<45:
+            return None
+        return self.ratio_function()
+
+    def _compute_b(self):
+        if self._book_entries()<45:
+            return self._b_init(self._states.current)
         else:
-              return self._b(self.x, self.ratio_function(self.book))
+              return self._b(self._states.current, self.ratio_function())
     
     def _b_init(self, x):
         return self.alpha * x.sum()
@@ -56,53 +140,67 @@ class RikiddoScoringRule(object):
         if total_fee < self.alpha * self.mrc:
             total_fee = self.alpha * self.mrc
         return  total_fee * x.sum()
+
+    def _dynamic_fee(self):
+        '''
+        Fee recorded in the book for a trade at the current state
+        '''
+        if self._book_entries() < 45:
+            return 0
+        ratio = self.ratio_function()
+        return self.param_1 * ratio/math.sqrt(self.param_2+ratio**self.param_3)
     
-    def ratio_function(self, book):
-        temp = book.copy()
+    @instrumented('ratio_function')
+    def ratio_function(self):
+        '''
+        Ratio between the short and long window average of the traded shares.
+        The windows are updated incrementally on every book entry, so reading it is O(1)
+        '''
+        return self._volume.ratio
 
-        if self.book.index[-1] <6:
-            periodLengthLong = self.book.index[-1]+1
-        else:
-            periodLengthLong = 5 
-        
-        periodLengthShort = 1 
-        if book.shape[0]<1:
-            periodLengthShort = 1
-        if book.shape[0]<2:
-            periodLengthLong = 1
-            
-        periodLengthLong = 45
-        periodLengthShort = 25
+    def _book_entries(self):
+        '''
+        Entries ever written to the book, including the ones left out of a restored snapshot
+        '''
+        return len(self._book) + self._book_base
 
-        #calculate EMA for the average volume
-        if len(temp['shares']) >5:
-            longWindow = math.ceil((temp['shares'].rolling(periodLengthLong).mean().tolist())[-1])
-            shortWindow = math.ceil((temp['shares'].rolling(periodLengthShort).mean()).tolist()[-1])
-            
-        else:
-            if len(temp['shares'])>1:
-                shortWindow = temp['shares'].mean()
-                longWindow = temp['shares'].mean()
-            elif len(temp['shares'])==1:
-                shortWindow = math.ceil(temp['shares'][0])
-                longWindow = math.ceil(temp['shares'][0])
-                
-        if longWindow ==0:
-            r = 0
-        else:
-            r = shortWindow/longWindow
-        return r
+    def _append_book(self, entry):
+        self._book.append(entry)
+        self._volume.update(entry['shares'])
+        #the state vector didn't move: b and the cost are rechecked against the new ratio
+        self._cache.advance()
     
+    @property
+    def last_dynamic_fee(self):
+        '''
+        Dynamic fee recorded in the last book entry (0 while the book is empty)
+        '''
+        return self._book.last('dynamic_fee') if len(self._book) else 0.0
+
     @property
     def book(self):
-        return pd.DataFrame(self._book)
+        return self._book.to_frame()
     
     @property
     def x(self):
-        return self._x[-1].copy()
+        return self._states.current.copy()
     
+    @instrumented('cost')
     def cost(self, x):
-        return self.b*np.log(np.exp(x/self.b).sum())
+        return float(cost_and_prices(x, self.b)[0])
+
+    def _state(self):
+        '''
+        (cost, probabilities, ExpTerms) of the current state, computed once per state and b
+        '''
+        def compute():
+            cost, prices, terms = cost_and_prices(self._states.current, self.b)
+            prices.setflags(write=False)
+            return float(cost), prices, terms
+        return self._cache.get('state', compute, self.b)
+
+    def _current_cost(self):
+        return self._state()[0]
     
     def _new_x(self, shares, outcome):
         new_x = self.x
@@ -113,55 +211,178 @@ class RikiddoScoringRule(object):
         return self._price(self._new_x(shares, outcome))
         
     def _price(self, x):
-        return self.cost(x)-self.cost(self.x)
+        return self.cost(x)-self._current_cost()
+
+    def quote_many(self, shares, outcomes):
+        '''
+        Quotes many (shares, outcome) trades against the current state at once.
+        b and the current cost are computed a single time and every candidate state
+        is evaluated in one 2-D pass.
+
+        Parameters
+        ----------
+        shares          array
+                        Shares to buy (negative to sell) of every quote
+
+        outcomes        array
+                        Outcome index of every quote
+
+        -------
+        Returns         tuple
+                        (costs, average prices, post-trade probabilities). costs[i] is what
+                        `price(shares[i], outcomes[i])` returns and probabilities has one row per quote
+        '''
+        shares, outcomes = np.broadcast_arrays(np.asarray(shares, dtype=np.float64), np.asarray(outcomes))
+        shares = shares.ravel()
+        outcomes = outcomes.ravel()
+        x = self._states.current
+        b = self.b
+        base = self._current_cost()
+        states = np.repeat(x[None, :], shares.size, axis=0)
+        states[np.arange(shares.size), outcomes] += shares
+        costs, probabilities, _ = cost_and_prices(states, np.full(shares.size, b))
+        costs = costs - base
+        with np.errstate(divide='ignore', invalid='ignore'):
+            average_prices = costs/shares
+        return costs, average_prices, probabilities
     
     def register_x(self, x):
-        self._x.append(x)
+        self._states.replace(x)
+        self._cache.invalidate()
+
+    def _register_trade(self, shares, outcome):
+        self._states.apply(outcome, shares)
+        self._cache.invalidate()
         
-    def calculate_shares(self, paid, outcome):
-        obj_func = lambda s: np.abs(self.price(s, outcome) - paid)
-        return fmin_cobyla(obj_func, paid/self.p[outcome], [])
+    @instrumented('calculate_shares')
+    def calculate_shares(self, paid, outcome, method='closed_form'):
+        '''
+        Number of shares of `outcome` that can be bought with `paid` at the current state.
+        `paid` and `outcome` can also be arrays to solve many requests at once.
+        method='cobyla' keeps the original derivative-free search for comparison
+        '''
+        if method == 'cobyla':
+            #scipy is only needed by this legacy path, so it is imported here
+            from scipy.optimize import fmin_cobyla
+            obj_func = lambda s: np.abs(self.price(s[0], outcome) - paid)
+            with section(self.instrumentation, 'fmin_cobyla'):
+                return float(fmin_cobyla(obj_func, paid/self.p[outcome], [])[0])
+        paid, outcome = np.broadcast_arrays(np.asarray(paid, dtype=np.float64), np.asarray(outcome))
+        terms = self._state()[2]
+        shares = solve_shares_terms(self._states.current[outcome], self.b, paid, terms.shift, terms.total, terms.terms[outcome])
+        if np.any(np.isnan(shares)):
+            raise ValueError('The market cannot pay out %s for outcome %s' % (paid, outcome))
+        return shares
     
+    @instrumented('buy_shares')
     def buy_shares(self, name, paid, outcome):
         shares = self.calculate_shares(paid, outcome)
-        self.register_x(self._new_x(shares, outcome))
-        if len(self.book) < 45:
-            dynamic_fee = 0
-        else:
-            dynamic_fee = self.param_1 * self.ratio_function(self.book)/math.sqrt(self.param_2+self.ratio_function(self.book)**self.param_3)
-        self._book.append({'name':name, 
+        self._register_trade(shares, outcome)
+        dynamic_fee = self._dynamic_fee()
+        self._append_book({'name':name, 
                            'shares':shares, 
                            'outcome':outcome, 
                            'paid':paid, 
-                           'cost_function': self.cost(self.x),
+                           'cost_function': self._current_cost(),
                            'dynamic_fee': dynamic_fee,
                            'lp': 0})
-        self._history.append(self.p)
+        self._states.record(self.b)
         self.market_value += paid
-        print("%s BOUGHT %2.2f shares of outcome %d"%(
-                name, shares, outcome))
+        self.events.emit(TradeEvent('buy', name, outcome, shares, paid))
               
         return shares
     
+    @instrumented('sell_shares')
     def sell_shares(self, name, shares, outcome):
         price = self.price(-shares, outcome)
-        if len(self.book) < 45:
-            dynamic_fee = 0
-        else:
-            dynamic_fee = self.param_1 * self.ratio_function(self.book)/math.sqrt(self.param_2+self.ratio_function(self.book)**self.param_3)
-        self._book.append({'name':name, 
+        dynamic_fee = self._dynamic_fee()
+        self._append_book({'name':name, 
                            'shares':-shares, 
                            'outcome':outcome, 
                            'paid':-price, 
-                           'cost_function': self.cost(self.x),
+                           'cost_function': self._current_cost(),
                            'dynamic_fee': dynamic_fee,
                            'lp': 0}) 
         self.market_value -= price        
-        self._history.append(self.p)  
-        print("%s SOLD %2.2f shares of outcome %d"%(
-                name, shares, outcome))
+        self._states.record(self.b)
+        self.events.emit(TradeEvent('sell', name, outcome, shares, price))
         return price
 
+    def submit_order(self, name, shares, outcome):
+        '''
+        Queues an order for the end of the block: `shares` of `outcome` to buy (negative to
+        sell). Nothing is priced until `settle_block`. Returns the position of the order in
+        the block
+        '''
+        if not 0 <= outcome < self.n:
+            raise IndexError('Unknown outcome %s' % (outcome,))
+        self._block.append((name, float(shares), int(outcome)))
+        return len(self._block) - 1
+
+    @property
+    def pending_orders(self):
+        return len(self._block)
+
+    @instrumented('settle_block')
+    def settle_block(self):
+        '''
+        Settles every order submitted since the last block at once. The orders are netted per
+        outcome and the state moves by the net amounts, so the market collects the cost
+        difference of a single move, C(x + net) - C(x), with b and the dynamic fee of the
+        state at the start of the block.
+
+        Allocation rule: every order is first quoted on its own against the start of the
+        block, C(x + shares_i e_o) - C(x) (all of them in one vectorized pass). The difference
+        between the block cost and the sum of these quotes (the gain of the orders that
+        cancelled out, or the extra impact of orders on the same side) is then spread over the
+        orders in proportion to their number of shares. The charges add up exactly to the
+        block cost, and an order alone in its block pays what `price` quotes.
+
+        Unlike `sell_shares`, sells in a block take their shares out of the state. The book
+        gets one entry per order, with the post-block cost, and the history one entry per block.
+
+        -------
+        Returns         array
+                        Charge of every order, in submission order (negative: paid to the trader)
+        '''
+        if not self._block:
+            return np.zeros(0)
+        names, shares, outcomes = zip(*self._block)
+        shares = np.array(shares)
+        outcomes = np.array(outcomes, dtype=np.int64)
+        net = np.bincount(outcomes, weights=shares, minlength=self.n)
+
+        standalone, _, _ = self.quote_many(shares, outcomes)
+        total = self.cost(self._states.current + net) - self._current_cost()
+        volume = np.abs(shares)
+        charges = standalone
+        if volume.sum() > 0:
+            charges = standalone + (total - standalone.sum())*volume/volume.sum()
+        if not np.all(np.isfinite(charges)):
+            raise ValueError('The block cannot be settled at the current state')
+        self._block = []
+
+        for outcome in np.flatnonzero(net).tolist():
+            self._states.apply(outcome, net[outcome])
+        self._cache.invalidate()
+        dynamic_fee = self._dynamic_fee()
+        cost = self._current_cost()
+        self._book.extend({'name': list(names),
+                           'shares': shares,
+                           'outcome': outcomes,
+                           'paid': np.where(shares < 0, -charges, charges),
+                           'cost_function': cost,
+                           'dynamic_fee': dynamic_fee,
+                           'lp': 0})
+        for traded in shares.tolist():
+            self._volume.update(traded)
+        self._cache.invalidate()
+        self._states.record(self.b)
+        self.market_value += float(charges.sum())
+        for name, traded, outcome, charge in zip(names, shares.tolist(), outcomes.tolist(), charges.tolist()):
+            self.events.emit(TradeEvent('sell' if traded < 0 else 'buy', name, outcome, abs(traded), charge))
+        return charges
+
     def liquidity_providing(self, name, shares):
         '''
         Liquidity Providers don't perceive a fee
@@ -169,25 +390,24 @@ class RikiddoScoringRule(object):
         prices = list(self.p)
         asset_1 = shares*prices[0]
         asset_2 = shares*prices[1]
-        self._book.append({'name':name, 
+        self._append_book({'name':name, 
                             'shares': asset_1,
-                            'outcome': self.possible_outcomes[0],
+                            'outcome': 0,
                             'paid': prices[0], 
-                            'cost_function': list(self.book['cost_function'])[-1],
-                            'dynamic': 0,
+                            'cost_function': self._book.last('cost_function'),
+                            'dynamic_fee': 0,
                             'lp': 1})
-        self._book.append({'name':name, 
+        self._append_book({'name':name, 
                             'shares': asset_2, 
-                            'outcome': self.possible_outcomes[1],
+                            'outcome': 1,
                             'paid': prices[1],
-                            'cost_function': list(self.book['cost_function'])[-1],
-                            'dynamic': 0,
+                            'cost_function': self._book.last('cost_function'),
+                            'dynamic_fee': 0,
                             'lp': 1})
-        self._history.append(list(self.p))
+        self._states.record(self.b)
         share = [asset_1, asset_2]
         
-        print("%s provided liquidity the equivalent to %2.2f ZTG. %2.2f units of asset 1, and %2.2f units of asset 2"%(
-                name, shares, share[0], share[1]))
+        self.events.emit(TradeEvent('liquidity', name, None, share, shares))
         
         return share
     
@@ -195,12 +415,27 @@ class RikiddoScoringRule(object):
         pass
               
     def outcome_probability(self):
-        K = np.exp(self.x/self.b)
-        return K/K.sum()
+        return self._state()[1]
     
     @property
     def p(self):
         return self.outcome_probability()
     
-    def history(self):
-        return np.array(self._history)
+    def x_at(self, t):
+        '''
+        State after the t-th entry of the history (negative indexes count from the end)
+        '''
+        return self._states.x_at(t)
+
+    def p_at(self, t):
+        '''
+        Probabilities recorded at the t-th entry of the history
+        '''
+        return self._states.p_at(t)
+
+    def history(self, chunk_size=1024):
+        '''
+        Probabilities after every buy, sell and liquidity provision, lazily yielded as 2-D
+        arrays of up to `chunk_size` rows
+        '''
+        return self._states.chunks(chunk_size)
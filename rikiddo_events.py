@@ -0,0 +1,267 @@
+from collections import namedtuple
+import abc
+import threading
+import queue
+import json
+import time
+import sys
+
+
+#levels, as in the logging module
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+
+#a buy, sell or liquidity provision. side is 'buy', 'sell' or 'liquidity', amount what was paid
+#(or received), shares the shares traded (for liquidity, the units provided of every outcome)
+TradeEvent = namedtuple('TradeEvent', ['side', 'name', 'outcome', 'shares', 'amount'])
+#something unusual in the market: code identifies it, value is the quantity involved if any
+WarningEvent = namedtuple('WarningEvent', ['code', 'message', 'value'])
+
+_TYPES = {TradeEvent: 'trade', WarningEvent: 'warning'}
+_DEFAULT_LEVELS = {TradeEvent: INFO, WarningEvent: WARNING}
+
+
+def parse_level(level):
+    '''
+    Level number from a number or a name ('debug', 'INFO'...)
+    '''
+    if isinstance(level, str):
+        names = {name: number for number, name in LEVEL_NAMES.items()}
+        try:
+            return names[level.upper()]
+        except KeyError:
+            raise ValueError('Unknown level %s' % level) from None
+    return int(level)
+
+
+def format_text(event):
+    '''
+    One human readable line for an event, as the simulation used to print it
+    '''
+    if isinstance(event, TradeEvent):
+        if event.side == 'liquidity':
+            line = '%s provided liquidity the equivalent to %2.2f ZTG.' % (event.name, event.amount)
+            if event.shares:
+                line += ' ' + ', and '.join('%2.2f units of asset %d' % (units, i + 1)
+                                            for i, units in enumerate(event.shares))
+            return line
+        verb = 'SOLD' if event.side == 'sell' else 'BOUGHT'
+        return '%s %s %2.2f shares of outcome %s for %2.2f' % (event.name, verb, event.shares, event.outcome,
+                                                               event.amount)
+    if isinstance(event, WarningEvent):
+        if event.value is None:
+            return event.message
+        return '%s (%s)' % (event.message, event.value)
+    return str(event)
+
+
+def _plain(value):
+    #numpy scalars and 0-d arrays
+    return value.tolist()
+
+
+def format_json(event, level, timestamp):
+    '''
+    One JSON line for an event: time, level, type and the fields of the event
+    '''
+    record = {'time': timestamp, 'level': LEVEL_NAMES.get(level, level), 'type': _TYPES.get(type(event), 'event')}
+    record.update(event._asdict())
+    return json.dumps(record, default=_plain)
+
+
+class EventSink(abc.ABC):
+    def __init__(self, level=INFO, format='text'):
+        """
+        Destination of the trade and warning events of the markets and simulations. Events
+        below `level` are dropped before anything is formatted. Subclasses implement `_write`,
+        which receives every event that passed the level filter.
+
+        Parameters
+        ----------
+        level           int/str
+                        Minimum level of the events written (DEBUG, INFO, WARNING, ERROR)
+
+        format          str
+                        'text' for the human readable lines, 'jsonl' for one JSON object per line
+        """
+        if format not in ('text', 'jsonl'):
+            raise ValueError('Unknown event format %s' % format)
+        self.level = parse_level(level)
+        self.format = format
+
+    def enabled_for(self, level):
+        return level >= self.level
+
+    def emit(self, event, level=None):
+        if level is None:
+            level = _DEFAULT_LEVELS.get(type(event), INFO)
+        if level >= self.level:
+            self._write(event, level, time.time())
+
+    def warn(self, code, message, value=None, level=WARNING):
+        if level >= self.level:
+            self._write(WarningEvent(code, message, value), level, time.time())
+
+    def _format(self, event, level, timestamp):
+        if self.format == 'jsonl':
+            return format_json(event, level, timestamp)
+        return format_text(event)
+
+    @abc.abstractmethod
+    def _write(self, event, level, timestamp):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class NullSink(EventSink):
+    def __init__(self):
+        '''
+        Drops every event, for benchmarks and batch runs
+        '''
+        EventSink.__init__(self, level=ERROR + 1)
+
+    def emit(self, event, level=None):
+        pass
+
+    def warn(self, code, message, value=None, level=WARNING):
+        pass
+
+    def _write(self, event, level, timestamp):
+        pass
+
+
+class StreamSink(EventSink):
+    def __init__(self, stream=None, level=INFO, format='text'):
+        '''
+        Writes every event synchronously to `stream`, by default whatever sys.stdout is at the
+        time of the event (so the output can still be redirected)
+        '''
+        EventSink.__init__(self, level, format)
+        self.stream = stream
+
+    def _write(self, event, level, timestamp):
+        stream = sys.stdout if self.stream is None else self.stream
+        stream.write(self._format(event, level, timestamp) + '\n')
+
+    def flush(self):
+        (sys.stdout if self.stream is None else self.stream).flush()
+
+
+_STOP = object()
+
+
+class FileSink(EventSink):
+    def __init__(self, path, level=INFO, format='jsonl', batch_size=1024, flush_interval=0.5):
+        """
+        Writes events to a file from a background thread. The trading thread only puts the
+        event on a queue; the writer takes whatever accumulated (up to `batch_size` events),
+        formats it, writes it in one call and flushes the file at least every `flush_interval`
+        seconds. `close` (or leaving the `with` block) writes everything left.
+
+        Parameters
+        ----------
+        path            str
+                        File the events are written to (overwritten)
+
+        level           int/str
+                        Minimum level of the events written
+
+        format          str
+                        'jsonl' (default) or 'text'
+
+        batch_size      int
+                        Maximum events written per call
+
+        flush_interval  float
+                        Seconds the writer waits for new events before flushing
+        """
+        EventSink.__init__(self, level, format)
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self._file = open(path, 'w')
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name='rikiddo-events', daemon=True)
+        self._thread.start()
+
+    def _write(self, event, level, timestamp):
+        self._queue.put((event, level, timestamp))
+
+    def _run(self):
+        while True:
+            try:
+                items = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            stop = False
+            for item in items:
+                if item is _STOP:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    #a flush request: everything queued before it is in `lines`
+                    self._write_lines(lines)
+                    lines = []
+                    item.set()
+                else:
+                    lines.append(self._format(*item))
+            self._write_lines(lines)
+            if stop:
+                return
+
+    def _write_lines(self, lines):
+        if lines:
+            self._file.write('\n'.join(lines) + '\n')
+            self.written += len(lines)
+        self._file.flush()
+
+    def flush(self):
+        '''
+        Blocks until every event emitted so far is written
+        '''
+        if self._thread.is_alive():
+            done = threading.Event()
+            self._queue.put(done)
+            done.wait()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._file.close()
+
+
+_default_sink = StreamSink()
+
+
+def default_sink():
+    '''
+    Sink used by the markets created without one: text lines on stdout at INFO level
+    '''
+    return _default_sink
+
+
+def set_default_sink(sink):
+    global _default_sink
+    _default_sink = sink
@@ -0,0 +1,299 @@
+from rikiddo_kernel import cost_and_prices, ls_cost_and_prices
+import argparse
+import math
+import time
+import numpy as np
+
+
+_MASK32 = np.uint64(0xFFFFFFFF)
+
+
+class FixedPoint(object):
+    def __init__(self, frac_bits=32):
+        """
+        Fixed-point engine for the LMSR / LS-LMSR cost and prices, in the integer arithmetic
+        the chain uses instead of float64. Values are int64 arrays holding round(value*2^F)
+        for F = `frac_bits`, every operation works element-wise on whole batches and
+        products and quotients are formed exactly in 128 bits (as pairs of uint64) before
+        being truncated toward zero, so no intermediate goes through floats or Python ints.
+
+        exp and ln are approximated with range reduction and polynomials whose degree is
+        picked from `frac_bits`:
+
+        exp(x) = 2^k*exp(r), r in [0, ln 2), with exp(r) a degree d Taylor polynomial where d is
+        the smallest degree with 2*ln(2)^(d+1)/(d+1)! < 2^-F. For x <= 0 (the only case the
+        shifted cost function needs) the absolute error is below (d + 3)*2^-F.
+
+        ln(y) = e*ln 2 + ln(m), m in [1, 2), with ln(m) = 2*atanh(s), s = (m-1)/(m+1) < 1/3,
+        summed up to the smallest odd power 2j+1 with 2*(1/3)^(2j+3)/((2j+3)(8/9)) < 2^-F. The
+        absolute error is below (j + 4)*2^-F.
+
+        The bounds are checked empirically by `cross_check`.
+
+        Parameters
+        ----------
+        frac_bits       int
+                        Fractional bits F. Values need to stay below 2^(63-F) in magnitude
+        """
+        if not 1 <= frac_bits <= 48:
+            raise ValueError('frac_bits needs to be between 1 and 48')
+        self.frac_bits = frac_bits
+        self.one = 1 << frac_bits
+
+        #ln 2 with G guard bits, so that k*ln 2 is exact to half an ulp for every k used
+        self._guard = 56 - frac_bits
+        self._ln2_guard = round(math.log(2)*2**(frac_bits + self._guard))
+        self._ln2 = round(math.log(2)*self.one)
+
+        self.exp_degree = 1
+        while 2*math.log(2)**(self.exp_degree + 1)/math.factorial(self.exp_degree + 1) >= 2.0**-frac_bits:
+            self.exp_degree += 1
+        self._exp_coefficients = [round(self.one/math.factorial(i)) for i in range(self.exp_degree + 1)]
+
+        self.ln_terms = 0
+        while 2*(1/3)**(2*self.ln_terms + 3)/((2*self.ln_terms + 3)*(8/9)) >= 2.0**-frac_bits:
+            self.ln_terms += 1
+        self._ln_coefficients = [round(self.one/(2*j + 1)) for j in range(self.ln_terms + 1)]
+
+        #exp(x) for x below this is smaller than half an ulp and is returned as 0
+        self._exp_floor = -(frac_bits + 2)*self._ln2
+        #exp(x) for x above this doesn't fit in int64
+        self._exp_ceiling = (62 - frac_bits)*self._ln2
+
+    def __repr__(self):
+        return 'FixedPoint(frac_bits=%d)' % self.frac_bits
+
+    def to_fixed(self, x):
+        '''
+        Rounds floats to the nearest fixed-point value
+        '''
+        x = np.asarray(x, dtype=np.float64)
+        scaled = np.rint(x*self.one)
+        if np.any(np.abs(scaled) >= 2.0**63):
+            raise OverflowError('Values out of the range of Q%d.%d' % (63 - self.frac_bits, self.frac_bits))
+        return scaled.astype(np.int64)
+
+    def to_float(self, v):
+        return np.asarray(v, dtype=np.int64)/self.one
+
+    def _mul_shift(self, a, b, shift):
+        '''
+        (a*b) >> shift with the product formed in 128 bits, truncated toward zero
+        '''
+        a, b = np.broadcast_arrays(np.asarray(a, dtype=np.int64), np.asarray(b, dtype=np.int64))
+        negative = (a < 0) != (b < 0)
+        a = np.abs(a).astype(np.uint64)
+        b = np.abs(b).astype(np.uint64)
+        a_hi, a_lo = a >> np.uint64(32), a & _MASK32
+        b_hi, b_lo = b >> np.uint64(32), b & _MASK32
+
+        low = a_lo*b_lo
+        middle_1 = a_hi*b_lo
+        middle_2 = a_lo*b_hi
+        high = a_hi*b_hi
+        partial = low + ((middle_1 & _MASK32) << np.uint64(32))
+        carry_1 = (partial < low).astype(np.uint64)
+        low = partial + ((middle_2 & _MASK32) << np.uint64(32))
+        carry_2 = (low < partial).astype(np.uint64)
+        high = high + (middle_1 >> np.uint64(32)) + (middle_2 >> np.uint64(32)) + carry_1 + carry_2
+
+        if shift == 0:
+            overflow = (high != 0) | (low >= np.uint64(1 << 63))
+            result = low
+        else:
+            shift = np.uint64(shift)
+            result = (high << (np.uint64(64) - shift)) | (low >> shift)
+            overflow = ((high >> shift) != 0) | (result >= np.uint64(1 << 63))
+        if np.any(overflow):
+            raise OverflowError('Fixed-point product out of range')
+        result = result.astype(np.int64)
+        return np.where(negative, -result, result)
+
+    def mul(self, a, b):
+        return self._mul_shift(a, b, self.frac_bits)
+
+    def div(self, a, b):
+        '''
+        a/b in fixed point, (a << F)//b formed by restoring long division, truncated toward zero
+        '''
+        a, b = np.broadcast_arrays(np.asarray(a, dtype=np.int64), np.asarray(b, dtype=np.int64))
+        if np.any(b == 0):
+            raise ZeroDivisionError('Fixed-point division by zero')
+        negative = (a < 0) != (b < 0)
+        a = np.abs(a).astype(np.uint64)
+        b = np.abs(b).astype(np.uint64)
+        quotient = a//b
+        if np.any(quotient >= np.uint64(1 << (63 - self.frac_bits))):
+            raise OverflowError('Fixed-point quotient out of range')
+        remainder = a - quotient*b
+        one = np.uint64(1)
+        for _ in range(self.frac_bits):
+            #remainder < b < 2^63, so the shift never overflows
+            remainder = remainder << one
+            bit = remainder >= b
+            remainder = remainder - np.where(bit, b, np.uint64(0))
+            quotient = (quotient << one) | bit.astype(np.uint64)
+        quotient = quotient.astype(np.int64)
+        return np.where(negative, -quotient, quotient)
+
+    def exp(self, x):
+        '''
+        exp of fixed-point values (see the class docstring for the error bound)
+        '''
+        x = np.asarray(x, dtype=np.int64)
+        if np.any(x > self._exp_ceiling):
+            raise OverflowError('exp out of the fixed-point range')
+        underflow = x < self._exp_floor
+        x = np.maximum(x, self._exp_floor)
+
+        #k = floor(x/ln 2) and r = x - k*ln 2 in [0, ln 2)
+        k = np.floor_divide(x, self._ln2)
+        r = x - ((k*self._ln2_guard) >> self._guard)
+        #the rounding of ln 2 can leave r a few ulps out of [0, ln 2)
+        low = r < 0
+        k = k - low
+        r = np.where(low, r + self._ln2, r)
+
+        result = np.full(x.shape, self._exp_coefficients[-1], dtype=np.int64)
+        for coefficient in self._exp_coefficients[-2::-1]:
+            result = self.mul(result, r) + coefficient
+
+        result = np.where(k >= 0, result << np.maximum(k, 0), result >> np.maximum(-k, 0))
+        return np.where(underflow, 0, result)
+
+    def _bit_length(self, y):
+        length = np.zeros(y.shape, dtype=np.int64)
+        y = y.copy()
+        for step in (32, 16, 8, 4, 2, 1):
+            above = y >= (1 << step)
+            y = np.where(above, y >> step, y)
+            length += above*step
+        return length + (y > 0)
+
+    def ln(self, y):
+        '''
+        Natural log of positive fixed-point values (see the class docstring for the error bound)
+        '''
+        y = np.asarray(y, dtype=np.int64)
+        if np.any(y <= 0):
+            raise ValueError('ln needs positive values')
+        #y = m*2^e with m in [1, 2)
+        e = self._bit_length(y) - 1 - self.frac_bits
+        m = np.where(e >= 0, y >> np.maximum(e, 0), y << np.maximum(-e, 0))
+
+        s = self.div(m - self.one, m + self.one)
+        s2 = self.mul(s, s)
+        series = np.full(y.shape, self._ln_coefficients[-1], dtype=np.int64)
+        for coefficient in self._ln_coefficients[-2::-1]:
+            series = self.mul(series, s2) + coefficient
+        return 2*self.mul(s, series) + ((e*self._ln2_guard) >> self._guard)
+
+    def _exp_terms(self, z):
+        '''
+        (shift, terms, total, lse) of z along its last axis, as in rikiddo_kernel.exp_terms
+        '''
+        shift = z.max(axis=-1)
+        terms = self.exp(z - shift[..., None])
+        total = terms.sum(axis=-1)
+        return shift, terms, total, shift + self.ln(total)
+
+    def cost_and_prices(self, x, b):
+        '''
+        Fixed-point version of rikiddo_kernel.cost_and_prices: LMSR cost and prices of the
+        fixed-point states `x` (batched along the leading axes) with liquidity `b`.
+        Returns (cost, prices) as fixed-point arrays
+        '''
+        x = np.asarray(x, dtype=np.int64)
+        b = np.asarray(b, dtype=np.int64)
+        _, terms, total, lse = self._exp_terms(self.div(x, b[..., None]))
+        return self.mul(b, lse), self.div(terms, total[..., None])
+
+    def ls_cost_and_prices(self, q, fee):
+        '''
+        Fixed-point version of rikiddo_kernel.ls_cost_and_prices: liquidity-sensitive cost and
+        prices with b = fee*sum(q). Returns (cost, prices) as fixed-point arrays
+        '''
+        q = np.asarray(q, dtype=np.int64)
+        fee = np.asarray(fee, dtype=np.int64)
+        volume = q.sum(axis=-1)
+        b = self.mul(fee, volume)
+        _, terms, total, lse = self._exp_terms(self.div(q, b[..., None]))
+        weighted = self.mul(q, terms).sum(axis=-1)
+        numerator = self.mul(terms, volume[..., None]) - weighted[..., None]
+        prices = self.mul(fee, lse)[..., None] + self.div(numerator, self.mul(volume, total)[..., None])
+        return self.mul(b, lse), prices
+
+
+def _errors(errors, name, fixed, exact):
+    error = np.abs(fixed - exact)
+    #relative to max(|value|, 1), so values that underflow toward 0 don't dominate
+    relative = error/np.maximum(np.abs(exact), 1.0)
+    current = errors.setdefault(name, {'max_abs': 0.0, 'max_rel': 0.0})
+    current['max_abs'] = max(current['max_abs'], float(error.max()))
+    current['max_rel'] = max(current['max_rel'], float(relative.max()))
+
+
+def cross_check(states=1000000, outcomes=2, frac_bits=32, seed=0, chunk_size=100000,
+                balances=(1.0, 1000.0), fees=(0.005, 0.2)):
+    '''
+    Measures the deviation of the fixed-point engine from the float64 one over `states`
+    random states, drawn in chunks of `chunk_size`: exp on [-(F+2)*ln 2, 0], ln on
+    [2^-F, 2^(62-F)), and the LMSR (b = fee*sum(x) held fixed) and LS-LMSR cost and prices
+    of states with balances and fees drawn uniformly from the given ranges.
+
+    Returns a dict with the maximum absolute error and relative error (against
+    max(|value|, 1)) of every quantity and the absolute error bounds of exp and ln
+    '''
+    engine = FixedPoint(frac_bits)
+    rng = np.random.default_rng(seed)
+    ulp = 1.0/engine.one
+    errors = {}
+    started = time.perf_counter()
+    done = 0
+    while done < states:
+        size = min(chunk_size, states - done)
+
+        x = engine.to_fixed(rng.uniform(-(frac_bits + 2)*math.log(2), 0, size))
+        _errors(errors, 'exp', engine.to_float(engine.exp(x)), np.exp(engine.to_float(x)))
+        y = np.maximum(engine.to_fixed(np.exp2(rng.uniform(-frac_bits, 61 - frac_bits, size))), 1)
+        _errors(errors, 'ln', engine.to_float(engine.ln(y)), np.log(engine.to_float(y)))
+
+        q = engine.to_fixed(rng.uniform(balances[0], balances[1], (size, outcomes)))
+        fee = engine.to_fixed(rng.uniform(fees[0], fees[1], size))
+        q_float, fee_float = engine.to_float(q), engine.to_float(fee)
+
+        b = engine.mul(fee, q.sum(axis=-1))
+        cost, prices = engine.cost_and_prices(q, b)
+        exact_cost, exact_prices, _ = cost_and_prices(q_float, engine.to_float(b))
+        _errors(errors, 'lmsr_cost', engine.to_float(cost), exact_cost)
+        _errors(errors, 'lmsr_prices', engine.to_float(prices), exact_prices)
+
+        cost, prices = engine.ls_cost_and_prices(q, fee)
+        exact_cost, exact_prices, _ = ls_cost_and_prices(q_float, fee_float)
+        _errors(errors, 'ls_cost', engine.to_float(cost), exact_cost)
+        _errors(errors, 'ls_prices', engine.to_float(prices), exact_prices)
+        done += size
+
+    return {'states': states,
+            'outcomes': outcomes,
+            'frac_bits': frac_bits,
+            'seconds': time.perf_counter() - started,
+            'exp_bound': (engine.exp_degree + 3)*ulp,
+            'ln_bound': (engine.ln_terms + 4)*ulp,
+            'errors': errors}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cross-check of the fixed-point engine against float64')
+    parser.add_argument('--states', type=int, default=1000000)
+    parser.add_argument('--outcomes', type=int, default=2)
+    parser.add_argument('--frac-bits', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    report = cross_check(args.states, args.outcomes, args.frac_bits, args.seed)
+    print(f"{report['states']} states, {report['outcomes']} outcomes, Q{63 - report['frac_bits']}.{report['frac_bits']}"
+          f" in {report['seconds']:.1f}s")
+    print(f"exp bound {report['exp_bound']:.3e}, ln bound {report['ln_bound']:.3e}")
+    for name, error in report['errors'].items():
+        print(f"{name:12s} max abs {error['max_abs']:.3e}  max rel {error['max_rel']:.3e}")
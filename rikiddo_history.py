@@ -0,0 +1,154 @@
+import numpy as np
+import bisect
+from rikiddo_book import TradeBook
+
+
+class StateHistory(object):
+    def __init__(self, initial, probabilities, snapshot_every=64, capacity=1024):
+        """
+        History of a market state kept as a log of (outcome, delta, b) entries plus a full
+        snapshot of the state every `snapshot_every` entries, instead of a copy of the state
+        and of its probabilities per trade. Memory grows with the number of entries, not
+        with entries x outcomes, and any past state is rebuilt by replaying at most
+        `snapshot_every` deltas from the snapshot before it.
+
+        The current state is updated in place with `apply` (or swapped with `replace`) and
+        `record` closes one entry of the history with the liquidity parameter of that moment.
+
+        Parameters
+        ----------
+        initial         array/SparseState
+                        State before the first entry
+
+        probabilities   callable
+                        (state, b) -> probabilities of the state, used to rebuild `p_at`
+
+        snapshot_every  int
+                        Entries between two full snapshots (K)
+
+        capacity        int
+                        Entries preallocated in the log
+        """
+        if snapshot_every < 1:
+            raise ValueError('snapshot_every needs to be at least 1')
+        self.current = initial.copy()
+        self.snapshot_every = snapshot_every
+        self._probabilities = probabilities
+        self._initial = initial.copy()
+        self._log = TradeBook({'outcome': np.int64, 'delta': np.float64, 'b': np.float64}, capacity=capacity)
+        #entry index -> state after that entry, with the indexes kept sorted for bisect
+        self._snapshots = {}
+        self._snapshot_entries = []
+        self._pending = []
+        self._replaced = False
+
+    def __len__(self):
+        return len(self._log)
+
+    @property
+    def snapshots(self):
+        return len(self._snapshot_entries)
+
+    @staticmethod
+    def _add(state, outcome, delta):
+        if isinstance(state, np.ndarray):
+            state[outcome] += delta
+        else:
+            state.add(outcome, delta)
+
+    def apply(self, outcome, delta):
+        '''
+        Adds `delta` to `outcome` in the current state
+        '''
+        self._add(self.current, outcome, delta)
+        self._pending.append((outcome, delta))
+
+    def replace(self, state):
+        '''
+        Swaps the current state for an arbitrary one. The next entry gets a full snapshot
+        '''
+        self.current = state
+        self._replaced = True
+
+    def record(self, b):
+        '''
+        Closes one entry with the changes applied since the previous one and the liquidity
+        parameter `b` the probabilities of the entry are computed with
+        '''
+        entry = len(self._log)
+        if self._replaced or len(self._pending) > 1:
+            #the change doesn't fit in a single delta, the entry is a snapshot
+            outcome, delta, snapshot = -1, 0.0, True
+        elif self._pending:
+            (outcome, delta), = self._pending
+            snapshot = (entry + 1) % self.snapshot_every == 0
+        else:
+            outcome, delta = -1, 0.0
+            snapshot = (entry + 1) % self.snapshot_every == 0
+        self._log.append({'outcome': outcome, 'delta': delta, 'b': b})
+        if snapshot:
+            self._snapshots[entry] = self.current.copy()
+            self._snapshot_entries.append(entry)
+        self._pending = []
+        self._replaced = False
+
+    def _index(self, t):
+        if t < 0:
+            t += len(self._log)
+        if not 0 <= t < len(self._log):
+            raise IndexError('History entry %d out of range' % t)
+        return t
+
+    def _replay(self, start, end):
+        '''
+        Yields the states after the entries start..end-1, replaying from the last snapshot
+        before `start`. The yielded state is reused, copy it to keep it
+        '''
+        i = bisect.bisect_left(self._snapshot_entries, start) - 1
+        if i < 0:
+            entry, state = -1, self._initial.copy()
+        else:
+            entry = self._snapshot_entries[i]
+            state = self._snapshots[entry].copy()
+        outcomes = self._log['outcome']
+        deltas = self._log['delta']
+        for t in range(entry + 1, end):
+            if t in self._snapshots:
+                state = self._snapshots[t].copy()
+            elif outcomes[t] >= 0:
+                self._add(state, int(outcomes[t]), deltas[t])
+            if t >= start:
+                yield state
+
+    def x_at(self, t):
+        '''
+        State after entry `t` (negative indexes count from the end)
+        '''
+        t = self._index(t)
+        if t in self._snapshots:
+            return self._snapshots[t].copy()
+        for state in self._replay(t, t + 1):
+            pass
+        return state
+
+    def p_at(self, t):
+        '''
+        Probabilities recorded at entry `t`
+        '''
+        t = self._index(t)
+        return self._probabilities(self.x_at(t), self._log['b'][t])
+
+    def chunks(self, chunk_size=1024, dense=None):
+        '''
+        Lazily yields the probabilities of every entry as 2-D arrays of up to `chunk_size`
+        rows, with a single forward replay per chunk. `dense` turns the output of
+        `probabilities` into a row (e.g. SparseState.to_dense)
+        '''
+        b = self._log['b']
+        for start in range(0, len(self._log), chunk_size):
+            end = min(start + chunk_size, len(self._log))
+            rows = []
+            for t, state in zip(range(start, end), self._replay(start, end)):
+                p = self._probabilities(state, b[t])
+                rows.append(dense(p) if dense is not None else p)
+            yield np.array(rows)
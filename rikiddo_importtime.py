@@ -0,0 +1,72 @@
+import subprocess
+import argparse
+import json
+import sys
+import os
+
+
+#modules of the NumPy-only path: cost, price, fee, ratio math and the scoring rules
+CORE_MODULES = ['rikiddo_core_functions', 'rikiddo_kernel', 'rikiddo_solver', 'rikiddo_volume',
+                'rikiddo_cpmm_compare.rikiddo', 'rikiddo_cpmm_compare.cpmm', 'rikiddo_combo']
+#optional extras, only imported for export (pandas), the cobyla solver (scipy) and plotting
+HEAVY_MODULES = ['pandas', 'scipy', 'matplotlib']
+
+_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import numpy
+numpy_done = time.perf_counter()
+import {module}
+done = time.perf_counter()
+print(json.dumps({{'numpy': numpy_done - start, 'module': done - numpy_done,
+                  'heavy': [name for name in {heavy!r} if name in sys.modules]}}))
+'''
+
+
+def measure(module, repeat=5):
+    '''
+    Import time of `module` on top of numpy (best of `repeat` fresh interpreters, in seconds)
+    and the heavy modules it pulled in
+    '''
+    here = os.path.dirname(os.path.abspath(__file__))
+    best = None
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                                cwd=here, capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        if best is None or result['module'] < best['module']:
+            best = result
+    return best
+
+
+def check(modules=CORE_MODULES, budget=0.05, repeat=5):
+    '''
+    Measures every module and returns (report, failures): a module fails if it imports
+    pandas, scipy or matplotlib, or takes longer than `budget` seconds on top of numpy
+    '''
+    report = {}
+    failures = []
+    for module in modules:
+        result = measure(module, repeat)
+        report[module] = result
+        if result['heavy']:
+            failures.append('%s imports %s' % (module, ', '.join(result['heavy'])))
+        if result['module'] > budget:
+            failures.append('%s takes %.1f ms to import (budget %.1f ms)' % (module, 1e3*result['module'], 1e3*budget))
+    return report, failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Guards the import time of the NumPy-only core modules')
+    parser.add_argument('modules', nargs='*', default=CORE_MODULES)
+    parser.add_argument('--budget-ms', type=float, default=50.0, help='maximum import time on top of numpy')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    report, failures = check(args.modules, args.budget_ms/1e3, args.repeat)
+    for module, result in report.items():
+        print(f"{module:32s} {1e3*result['module']:7.1f} ms (numpy {1e3*result['numpy']:.1f} ms)"
+              f"{'  heavy: ' + ', '.join(result['heavy']) if result['heavy'] else ''}")
+    for failure in failures:
+        print('FAIL', failure)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,139 @@
+from time import perf_counter_ns
+import functools
+
+
+class Instrumentation(object):
+    def __init__(self, enabled=True):
+        """
+        Opt-in counters and timers for the hot path of the scoring rules. Every timed name
+        keeps its call count, total and maximum time (monotonic clock, in nanoseconds) and a
+        histogram with power-of-two buckets. Plain counters count events without timing them.
+
+        Attach it to a market (`market.instrumentation = Instrumentation()`, or the
+        `instrumentation` argument of the constructor) to time `cost`, `b`, `ratio_function`,
+        `calculate_shares`, `buy_shares` and `sell_shares`. Without one, or with `enabled`
+        False, the instrumented methods only pay an attribute check.
+
+        Parameters
+        ----------
+        enabled         bool
+                        Whether timings and counts are recorded
+        """
+        self.enabled = enabled
+        self._timers = {}
+        self._counters = {}
+
+    def record(self, name, nanoseconds):
+        timer = self._timers.get(name)
+        if timer is None:
+            #count, total, max and the histogram: bucket i holds times in [2^(i-1), 2^i) ns
+            timer = self._timers[name] = [0, 0, 0, [0]*64]
+        timer[0] += 1
+        timer[1] += nanoseconds
+        if nanoseconds > timer[2]:
+            timer[2] = nanoseconds
+        timer[3][min(nanoseconds.bit_length(), 63)] += 1
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def section(self, name):
+        '''
+        Context manager that times the code inside it under `name`
+        '''
+        if not self.enabled:
+            return _NULL_SECTION
+        return _Section(self, name)
+
+    def reset(self):
+        self._timers = {}
+        self._counters = {}
+
+    @staticmethod
+    def _percentile(buckets, count, q):
+        '''
+        Upper edge (ns) of the histogram bucket holding the q-th percentile
+        '''
+        target = q/100*count
+        cumulative = 0
+        for i, n in enumerate(buckets):
+            cumulative += n
+            if n and cumulative >= target:
+                return 1 << i
+        return 0
+
+    def snapshot(self):
+        '''
+        In-process copy of everything recorded so far: for every timer its count, total and
+        mean/max time, approximate percentiles and the non-empty histogram buckets as
+        [upper edge in ns, count] pairs, and the plain counters
+        '''
+        timers = {}
+        for name, (count, total, maximum, buckets) in self._timers.items():
+            timers[name] = {'count': count,
+                            'total_seconds': total/1e9,
+                            'mean_us': total/count/1e3,
+                            'max_us': maximum/1e3,
+                            'p50_us': self._percentile(buckets, count, 50)/1e3,
+                            'p99_us': self._percentile(buckets, count, 99)/1e3,
+                            'buckets': [[1 << i, n] for i, n in enumerate(buckets) if n]}
+        return {'timers': timers, 'counters': dict(self._counters)}
+
+
+class _Section(object):
+    __slots__ = ('_probe', '_name', '_start')
+
+    def __init__(self, probe, name):
+        self._probe = probe
+        self._name = name
+
+    def __enter__(self):
+        self._start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self._probe.record(self._name, perf_counter_ns() - self._start)
+        return False
+
+
+class _NullSection(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SECTION = _NullSection()
+
+
+def section(probe, name):
+    '''
+    `probe.section(name)`, or a no-op context manager when there is no probe
+    '''
+    if probe is None:
+        return _NULL_SECTION
+    return probe.section(name)
+
+
+def instrumented(name):
+    '''
+    Decorator for methods of objects with an `instrumentation` attribute: times every call
+    under `name` when an enabled Instrumentation is attached, and only checks for it otherwise
+    '''
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            probe = self.instrumentation
+            if probe is None or not probe.enabled:
+                return method(self, *args, **kwargs)
+            start = perf_counter_ns()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                probe.record(name, perf_counter_ns() - start)
+        return wrapper
+    return decorate
@@ -0,0 +1,73 @@
+import numpy as np
+from collections import namedtuple
+
+
+#intermediates of one shifted log-sum-exp pass over the last axis of z: shift = max(z),
+#terms = exp(z - shift), total = sum(terms) and lse = shift + log(total), so that
+#sum(exp(z)) = exp(shift)*total never has to be formed
+ExpTerms = namedtuple('ExpTerms', ['shift', 'terms', 'total', 'lse'])
+
+
+def exp_terms(z):
+    '''
+    Shifted exponentials of `z` along its last axis (leading axes are batches of states)
+    '''
+    z = np.asarray(z, dtype=np.float64)
+    shift = z.max(axis=-1)
+    shift = np.where(np.isfinite(shift), shift, 0.0)
+    terms = np.exp(z - shift[..., None])
+    total = terms.sum(axis=-1)
+    return ExpTerms(shift, terms, total, shift + np.log(total))
+
+
+def logsumexp(z):
+    return exp_terms(z).lse
+
+
+def cost_and_prices(x, b):
+    '''
+    LMSR cost C(x) = b*log(sum(exp(x/b))) and instantaneous prices exp(x_i/b)/sum(exp(x/b))
+    for a fixed liquidity parameter `b`, computed from the same exponentials.
+
+    Parameters
+    ----------
+    x               array
+                    State vector, or a batch of state vectors along the leading axes
+
+    b               float/array
+                    Liquidity parameter (one per state when `x` is a batch)
+
+    -------
+    Returns         tuple
+                    (cost, prices, ExpTerms of x/b)
+    '''
+    b = np.asarray(b, dtype=np.float64)
+    terms = exp_terms(np.asarray(x, dtype=np.float64)/b[..., None])
+    return b*terms.lse, terms.terms/terms.total[..., None], terms
+
+
+def ls_cost_and_prices(q, fee):
+    '''
+    Liquidity-sensitive cost C(q) = b(q)*log(sum(exp(q/b(q)))) with b(q) = fee*sum(q), and its
+    prices p_i = fee*log(sum(exp(q/b))) + (exp(q_i/b)*sum(q) - sum(q_j*exp(q_j/b)))/(sum(q)*sum(exp(q/b)))
+
+    Parameters
+    ----------
+    q               array
+                    State vector, or a batch of state vectors along the leading axes
+
+    fee             float/array
+                    Total fee (one per state when `q` is a batch)
+
+    -------
+    Returns         tuple
+                    (cost, prices, ExpTerms of q/b)
+    '''
+    q = np.asarray(q, dtype=np.float64)
+    fee = np.asarray(fee, dtype=np.float64)
+    volume = q.sum(axis=-1)
+    b = fee*volume
+    terms = exp_terms(q/b[..., None])
+    weighted = (q*terms.terms).sum(axis=-1)
+    prices = fee[..., None]*terms.lse[..., None] + (terms.terms*volume[..., None] - weighted[..., None])/(volume*terms.total)[..., None]
+    return b*terms.lse, prices, terms
@@ -0,0 +1,433 @@
+from rikiddo_kernel import cost_and_prices
+from rikiddo_solver import solve_shares_terms
+from multiprocessing import shared_memory
+import multiprocessing
+import math
+import os
+import numpy as np
+
+
+def _layout(markets, slots, long_window):
+    '''
+    (name, dtype, shape) of every array of a MarketManager, in storage order
+    '''
+    return [('header', np.int64, (2,)),             #markets used, outcome slots used
+            ('x', np.float64, (slots,)),            #state of every market, one after the other
+            ('offsets', np.int64, (markets + 1,)),  #market i owns x[offsets[i]:offsets[i+1]]
+            ('alpha', np.float64, (markets,)),
+            ('params', np.float64, (markets, 3)),   #param_1, param_2, param_3
+            ('mrc', np.float64, (markets,)),
+            ('fee_level', np.float64, (markets,)),  #b/sum(x), refreshed after every trade
+            ('market_value', np.float64, (markets,)),
+            ('trades', np.int64, (markets,)),       #book entries, also the volume count
+            ('version', np.int64, (markets,)),      #odd while the market is being written
+            ('volume', np.float64, (markets, long_window)),
+            ('short_sum', np.float64, (markets,)),
+            ('long_sum', np.float64, (markets,))]
+
+
+class MarketManager(object):
+    def __init__(self, markets=1024, slots=None, short_window=25, long_window=45, warmup=5, fee_after=45,
+                 shared=False):
+        """
+        Many RikiddoScoringRule markets stored as struct-of-arrays: the state vectors of all
+        markets are concatenated in one array (ragged, through `offsets`), and alpha, n_params,
+        mrc, the rolling-volume ring buffers and their running sums are columns with one row
+        per market. Markets are addressed by any hashable id.
+
+        Buys, sells, b and the prices follow RikiddoScoringRule with its default 25 vs 45
+        trades volume tracker, including `sell_shares` leaving the state unchanged, and give
+        the same numbers. `quote_many` prices requests on many markets in one ragged pass.
+
+        With shared=True every array lives in one multiprocessing shared memory block, which
+        other processes open with `attach(descriptor())` to read the markets (see QuoteShards).
+        Every market has a version counter, odd while a trade writes it, so readers can retry
+        the markets that changed under them. The capacity is fixed at creation.
+
+        Parameters
+        ----------
+        markets         int
+                        Maximum number of markets
+
+        slots           int
+                        Maximum number of outcomes over all markets. Default: 4 per market
+
+        short_window    int
+                        Trades averaged by the short window of the volume ratio
+
+        long_window     int
+                        Trades averaged by the long window of the volume ratio
+
+        warmup          int
+                        Trades during which the ratio uses the warm-up rule of VolumeRatioTracker
+
+        fee_after       int
+                        Book entries before the dynamic fee is added to b
+
+        shared          bool
+                        Allocate the arrays in shared memory
+        """
+        if slots is None:
+            slots = 4*markets
+        self.capacity = markets
+        self.slots = slots
+        self.short_window = short_window
+        self.long_window = long_window
+        self.warmup = warmup
+        self.fee_after = fee_after
+        self._ids = {}
+        self._shm = None
+        self._owner = True
+        fields = _layout(markets, slots, long_window)
+        if shared:
+            size = sum(np.dtype(dtype).itemsize*int(np.prod(shape)) for _, dtype, shape in fields)
+            self._shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+            self._map(fields, self._shm.buf)
+            for name, _, _ in fields:
+                getattr(self, '_' + name)[...] = 0
+        else:
+            for name, dtype, shape in fields:
+                setattr(self, '_' + name, np.zeros(shape, dtype=dtype))
+
+    def _map(self, fields, buffer):
+        offset = 0
+        for name, dtype, shape in fields:
+            array = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+            setattr(self, '_' + name, array)
+            offset += array.nbytes
+
+    def descriptor(self):
+        '''
+        What `attach` needs to open the shared arrays from another process
+        '''
+        if self._shm is None:
+            raise ValueError('The manager was not created with shared=True')
+        return {'name': self._shm.name, 'markets': self.capacity, 'slots': self.slots,
+                'short_window': self.short_window, 'long_window': self.long_window,
+                'warmup': self.warmup, 'fee_after': self.fee_after}
+
+    @classmethod
+    def attach(cls, descriptor):
+        '''
+        Manager over the shared arrays of another one. Markets are addressed by their index
+        (market ids are only known to the creator)
+        '''
+        manager = cls.__new__(cls)
+        manager.capacity = descriptor['markets']
+        manager.slots = descriptor['slots']
+        manager.short_window = descriptor['short_window']
+        manager.long_window = descriptor['long_window']
+        manager.warmup = descriptor['warmup']
+        manager.fee_after = descriptor['fee_after']
+        manager._ids = None
+        manager._owner = False
+        manager._shm = shared_memory.SharedMemory(name=descriptor['name'])
+        manager._map(_layout(manager.capacity, manager.slots, manager.long_window), manager._shm.buf)
+        return manager
+
+    def close(self):
+        '''
+        Releases the shared memory (and frees it, in the creating process)
+        '''
+        if self._shm is None:
+            return
+        for name, _, _ in _layout(self.capacity, self.slots, self.long_window):
+            setattr(self, '_' + name, None)
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return int(self._header[0])
+
+    def __contains__(self, market):
+        return market in self._ids
+
+    def index(self, market):
+        '''
+        Row of a market id (or an array of rows for a list of ids)
+        '''
+        if self._ids is None:
+            return market
+        try:
+            if isinstance(market, (list, tuple, np.ndarray)):
+                return np.array([self._ids[m] for m in market], dtype=np.int64)
+            return self._ids[market]
+        except KeyError as error:
+            raise KeyError('Unknown market %s' % (error.args[0],)) from None
+
+    def add_market(self, market, outcomes, n_params, vig=0.1, init=1.0, mrc=0.4):
+        '''
+        New market with the same arguments as RikiddoScoringRule (`outcomes` is their number)
+        '''
+        if self._ids is None:
+            raise ValueError('Markets are added by the process that created the manager')
+        if market in self._ids:
+            raise ValueError('Market %s already exists' % (market,))
+        i, used = int(self._header[0]), int(self._header[1])
+        if i >= self.capacity or used + outcomes > self.slots:
+            raise ValueError('The manager is full (%d markets, %d outcome slots)' % (self.capacity, self.slots))
+        if outcomes < 2:
+            raise ValueError('A market needs at least 2 outcomes')
+        self._version[i] += 1
+        self._x[used:used + outcomes] = init/outcomes
+        self._offsets[i + 1] = used + outcomes
+        self._alpha[i] = vig*outcomes/np.log(outcomes)
+        self._params[i] = n_params[:3]
+        self._mrc[i] = mrc
+        self._market_value[i] = init
+        self._fee_level[i] = self._alpha[i]
+        self._version[i] += 1
+        self._header[1] = used + outcomes
+        self._header[0] = i + 1
+        self._ids[market] = i
+        return i
+
+    def x(self, market):
+        i = self.index(market)
+        return self._x[self._offsets[i]:self._offsets[i + 1]].copy()
+
+    def _segment(self, i):
+        return self._x[self._offsets[i]:self._offsets[i + 1]]
+
+    def market_value(self, market):
+        return float(self._market_value[self.index(market)])
+
+    def _ratio(self, i):
+        '''
+        VolumeRatioTracker.ratio of market i
+        '''
+        count = int(self._trades[i])
+        if count == 0:
+            return 0
+        if count <= self.warmup:
+            if count == 1:
+                level = math.ceil(self._volume[i, 0])
+            else:
+                level = self._long_sum[i]/count
+            return 0 if level == 0 else 1
+        long_mean = math.ceil(self._long_sum[i]/min(self.long_window, count))
+        if long_mean == 0:
+            return 0
+        return math.ceil(self._short_sum[i]/min(self.short_window, count))/long_mean
+
+    def ratio_function(self, market):
+        return self._ratio(self.index(market))
+
+    def _update_volume(self, i, volume):
+        '''
+        VolumeRatioTracker.update of market i, and one more book entry
+        '''
+        count = int(self._trades[i])
+        ring = self._volume[i]
+        head = count % self.long_window
+        if count >= self.long_window:
+            self._long_sum[i] -= ring[head]
+        if count >= self.short_window:
+            self._short_sum[i] -= ring[(count - self.short_window) % self.long_window]
+        ring[head] = volume
+        self._short_sum[i] += volume
+        self._long_sum[i] += volume
+        count += 1
+        self._trades[i] = count
+        if count % self.long_window == 0:
+            back = [(count - 1 - k) % self.long_window for k in range(self.short_window)]
+            self._short_sum[i] = math.fsum(ring[back].tolist())
+            self._long_sum[i] = math.fsum(ring.tolist())
+
+    def _refresh_fee(self, i):
+        alpha = self._alpha[i]
+        if self._trades[i] < self.fee_after:
+            self._fee_level[i] = alpha
+            return
+        param_1, param_2, param_3 = self._params[i].tolist()
+        ratio = self._ratio(i)
+        total_fee = alpha + (param_1*ratio/math.sqrt(param_2 + ratio**param_3))
+        self._fee_level[i] = max(total_fee, alpha*self._mrc[i])
+
+    def b(self, market):
+        i = self.index(market)
+        return self._fee_level[i]*self._segment(i).sum()
+
+    def _cost_state(self, i):
+        x = self._segment(i)
+        b = self._fee_level[i]*x.sum()
+        cost, prices, terms = cost_and_prices(x, b)
+        return x, b, float(cost), prices, terms
+
+    def probabilities(self, market):
+        return self._cost_state(self.index(market))[3]
+
+    def price(self, market, shares, outcome):
+        '''
+        Cost of `shares` of `outcome`, as RikiddoScoringRule.price
+        '''
+        x, b, cost, _, _ = self._cost_state(self.index(market))
+        new_x = x.copy()
+        new_x[outcome] += shares
+        return float(cost_and_prices(new_x, b)[0]) - cost
+
+    def calculate_shares(self, market, paid, outcome):
+        x, b, _, _, terms = self._cost_state(self.index(market))
+        paid, outcome = np.broadcast_arrays(np.asarray(paid, dtype=np.float64), np.asarray(outcome))
+        shares = solve_shares_terms(x[outcome], b, paid, terms.shift, terms.total, terms.terms[outcome])
+        if np.any(np.isnan(shares)):
+            raise ValueError('The market cannot pay out %s for outcome %s' % (paid, outcome))
+        return shares
+
+    def buy_shares(self, market, paid, outcome):
+        i = self.index(market)
+        shares = self.calculate_shares(market, paid, outcome)
+        self._version[i] += 1
+        self._segment(i)[outcome] += shares
+        self._update_volume(i, float(shares))
+        self._refresh_fee(i)
+        self._market_value[i] += paid
+        self._version[i] += 1
+        return shares
+
+    def sell_shares(self, market, shares, outcome):
+        '''
+        As RikiddoScoringRule.sell_shares: the sale is priced and booked, the state is kept
+        '''
+        price = self.price(market, -shares, outcome)
+        i = self.index(market)
+        self._version[i] += 1
+        self._update_volume(i, -float(shares))
+        self._refresh_fee(i)
+        self._market_value[i] -= price
+        self._version[i] += 1
+        return price
+
+    def _quote_rows(self, rows, shares, outcomes):
+        '''
+        Costs of (shares, outcome) requests on the markets in `rows`, in one ragged pass over
+        the concatenated states. Markets written during the read are read again
+        '''
+        rows = np.asarray(rows, dtype=np.int64).ravel()
+        shares, outcomes = np.broadcast_arrays(np.asarray(shares, dtype=np.float64).ravel(), np.asarray(outcomes).ravel())
+        if rows.size != shares.size:
+            raise ValueError('markets, shares and outcomes need the same length')
+        if rows.size and (rows.min() < 0 or rows.max() >= len(self)):
+            raise IndexError('Unknown market row')
+        costs = np.empty(rows.size)
+        todo = np.arange(rows.size)
+        while todo.size:
+            before = self._version[rows[todo]].copy()
+            costs[todo] = self._ragged_quotes(rows[todo], shares[todo], outcomes[todo])
+            after = self._version[rows[todo]]
+            todo = todo[(before != after) | (before % 2 == 1)]
+        return costs
+
+    def _ragged_quotes(self, rows, shares, outcomes):
+        starts = self._offsets[rows]
+        lengths = self._offsets[rows + 1] - starts
+        if np.any((outcomes < 0) | (outcomes >= lengths)):
+            raise IndexError('Outcome out of range')
+        firsts = np.cumsum(lengths) - lengths
+        positions = np.repeat(starts - firsts, lengths) + np.arange(lengths.sum())
+        x = self._x[positions]
+        b = self._fee_level[rows]*np.add.reduceat(x, firsts)
+        z = x/np.repeat(b, lengths)
+
+        def lse(z):
+            shift = np.maximum.reduceat(z, firsts)
+            return shift + np.log(np.add.reduceat(np.exp(z - np.repeat(shift, lengths)), firsts))
+
+        base = lse(z)
+        z[firsts + outcomes] += shares/b
+        return b*(lse(z) - base)
+
+    def quote_many(self, markets, shares, outcomes):
+        '''
+        Cost of `shares[k]` of `outcomes[k]` in `markets[k]` for every request, all markets
+        at once
+        '''
+        return self._quote_rows(self.index(list(markets)) if self._ids is not None else markets, shares, outcomes)
+
+
+def _shard_worker(descriptor, connection):
+    manager = MarketManager.attach(descriptor)
+    try:
+        while True:
+            request = connection.recv()
+            if request is None:
+                break
+            try:
+                connection.send(('ok', manager._quote_rows(*request)))
+            except (ValueError, IndexError) as error:
+                connection.send(('error', error))
+    finally:
+        manager.close()
+
+
+class QuoteShards(object):
+    def __init__(self, manager, workers=None):
+        """
+        Worker processes answering `quote_many` for a shared MarketManager. Market row i is
+        served by worker i % workers, every worker reading the shared arrays directly, so
+        the quotes of a batch are computed on all cores while the creating process keeps
+        trading.
+
+        Parameters
+        ----------
+        manager         MarketManager
+                        Manager created with shared=True
+
+        workers         int
+                        Number of worker processes. Default: os.cpu_count()
+        """
+        self.manager = manager
+        self.workers = workers or os.cpu_count()
+        descriptor = manager.descriptor()
+        self._connections = []
+        self._processes = []
+        for _ in range(self.workers):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_shard_worker, args=(descriptor, child), daemon=True)
+            process.start()
+            self._connections.append(parent)
+            self._processes.append(process)
+
+    def quote_many(self, markets, shares, outcomes):
+        rows = self.manager.index(list(markets))
+        shares, outcomes = np.broadcast_arrays(np.asarray(shares, dtype=np.float64).ravel(), np.asarray(outcomes).ravel())
+        shards = rows % self.workers
+        requests = []
+        for worker, connection in enumerate(self._connections):
+            selected = np.flatnonzero(shards == worker)
+            if selected.size:
+                connection.send((rows[selected], shares[selected], outcomes[selected]))
+                requests.append((selected, connection))
+        costs = np.empty(rows.size)
+        error = None
+        for selected, connection in requests:
+            status, result = connection.recv()
+            if status == 'ok':
+                costs[selected] = result
+            else:
+                error = result
+        if error is not None:
+            raise error
+        return costs
+
+    def close(self):
+        for connection in self._connections:
+            connection.send(None)
+        for process in self._processes:
+            process.join()
+        self._connections = []
+        self._processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,80 @@
+from collections import namedtuple
+import itertools
+import math
+import numpy as np
+
+
+#one batch of orders: outcome ids (int64), sides (True for sells) and amounts
+OrderBatch = namedtuple('OrderBatch', ['outcome', 'sell', 'amount'])
+
+
+def draw_orders(model, size, outcomes, rng, max_amount=10.0, signal_period=500):
+    '''
+    `size` orders as arrays, drawn at once from `rng`.
+
+    model='uniform': outcome and side uniformly at random.
+    model='signal': a market signal (Dirichlet weights over the outcomes) is drawn every
+    `signal_period` orders. It weights the outcome of the orders, and, as in the original
+    rikiddo.py loop (buysellSignals = [1 - signal, signal]), every order is a sell with
+    probability the weight of the first outcome, whatever its own outcome.
+    '''
+    amount = rng.uniform(0, max_amount, size)
+    if model == 'uniform':
+        return OrderBatch(rng.integers(0, outcomes, size), rng.random(size) < 0.5, amount)
+    if model == 'signal':
+        blocks = math.ceil(size/signal_period)
+        weights = rng.dirichlet(np.ones(outcomes), blocks)
+        weights = np.repeat(weights, signal_period, axis=0)[:size]
+        outcome = (rng.random((size, 1)) > np.cumsum(weights, axis=1)).sum(axis=1)
+        outcome = np.minimum(outcome, outcomes - 1)
+        sell = rng.random(size) < weights[:, 0]
+        return OrderBatch(outcome, sell, amount)
+    raise ValueError('Unknown order flow model %s' % model)
+
+
+def order_stream(outcomes, model='signal', seed=None, rng=None, orders=None, batch_size=4096,
+                 max_amount=10.0, signal_period=500):
+    '''
+    Generator of OrderBatch blocks drawn with `draw_orders`, so consumers pay for one
+    vectorized draw per signal period instead of several RNG calls per order.
+
+    The batch size is rounded up to whole signal periods and every period is drawn on its
+    own, so the market signal is regenerated every `signal_period` orders and the stream
+    doesn't depend on the batching. For the same seed (or generator state) the stream is
+    always the same.
+
+    Parameters
+    ----------
+    outcomes        int
+                    Number of outcomes the orders are spread over
+
+    model           str
+                    'signal' or 'uniform' (see `draw_orders`)
+
+    seed            int
+                    Seed of the numpy.random.Generator, when `rng` isn't given
+
+    rng             numpy.random.Generator
+                    Optional. Generator to draw from
+
+    orders          int
+                    Total orders, or None for an endless stream
+
+    batch_size      int
+                    Orders per batch (rounded up to whole signal periods)
+
+    max_amount      float
+                    Amounts are drawn uniformly from [0, max_amount]
+
+    signal_period   int
+                    Orders during which a market signal remains the same
+    '''
+    if rng is None:
+        rng = np.random.default_rng(seed)
+    batch_size = math.ceil(max(batch_size, 1)/signal_period)*signal_period
+    starts = itertools.count(0, batch_size) if orders is None else range(0, orders, batch_size)
+    for start in starts:
+        size = batch_size if orders is None else min(batch_size, orders - start)
+        periods = [draw_orders(model, min(signal_period, size - i), outcomes, rng, max_amount=max_amount,
+                               signal_period=signal_period) for i in range(0, size, signal_period)]
+        yield OrderBatch(*(np.concatenate(column) for column in zip(*periods)))
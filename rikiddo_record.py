@@ -0,0 +1,160 @@
+import numpy as np
+import json
+import math
+import csv
+import os
+
+
+class RecordWriter(object):
+    def __init__(self, path, columns, chunk_size=4096, cumsum=None, binary=True):
+        """
+        Chunked, buffered sink for simulation records. Rows are kept in fixed-size column
+        buffers and every `chunk_size` rows they are appended to a CSV file and to a binary
+        columnar directory, so memory stays flat however long the run is and everything up to
+        the last flushed chunk is on disk if the process dies.
+
+        Parameters
+        ----------
+        path            str
+                        CSV file the records are written to
+
+        columns         dict
+                        Column name -> dtype, in output order. Use `str` for text columns,
+                        which are stored as codes in the binary output
+
+        chunk_size      int
+                        Rows buffered before they are flushed
+
+        cumsum          dict
+                        Optional. Running sums, target column -> source column. A NaN in the
+                        source is skipped and gives NaN in the target (like pandas cumsum)
+
+        binary          bool
+                        Also write the columns in binary form to `<path without extension>_columns/`
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self.cumsum = dict(cumsum or {})
+        self._dtypes = {}
+        self._buffers = {}
+        self._labels = {}
+        for column, dtype in columns.items():
+            if dtype is str:
+                self._labels[column] = {}
+                dtype = np.int32
+            self._dtypes[column] = np.dtype(dtype)
+            self._buffers[column] = np.zeros(chunk_size, dtype=self._dtypes[column])
+        self._totals = {column: 0.0 for column in self.cumsum}
+        self._pending = 0
+        self.rows = 0
+
+        self._csv = open(path, 'w', newline='')
+        self._writer = csv.writer(self._csv)
+        self._writer.writerow(list(self._buffers))
+        self.binary_path = None
+        if binary:
+            self.binary_path = os.path.splitext(path)[0] + '_columns'
+            os.makedirs(self.binary_path, exist_ok=True)
+            for column in self._buffers:
+                open(os.path.join(self.binary_path, column + '.bin'), 'wb').close()
+            self._write_schema()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _code(self, column, label):
+        labels = self._labels[column]
+        code = labels.get(label)
+        if code is None:
+            code = len(labels)
+            labels[label] = code
+        return code
+
+    def append(self, row):
+        '''
+        Buffers one record (dict column -> value). Running sums are filled in from their source
+        '''
+        for target, source in self.cumsum.items():
+            value = row[source]
+            if math.isnan(value):
+                row[target] = math.nan
+            else:
+                self._totals[target] += value
+                row[target] = self._totals[target]
+
+        i = self._pending
+        for column, values in self._buffers.items():
+            value = row[column]
+            if column in self._labels:
+                value = self._code(column, str(value))
+            values[i] = value
+        self._pending += 1
+        self.rows += 1
+        if self._pending == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        n = self._pending
+        if n == 0:
+            return
+        columns = []
+        for column, values in self._buffers.items():
+            if column in self._labels:
+                labels = list(self._labels[column])
+                columns.append([labels[code] for code in values[:n].tolist()])
+            else:
+                columns.append(values[:n].tolist())
+        self._writer.writerows(zip(*columns))
+        self._csv.flush()
+
+        if self.binary_path is not None:
+            for column, values in self._buffers.items():
+                with open(os.path.join(self.binary_path, column + '.bin'), 'ab') as f:
+                    values[:n].tofile(f)
+        self._pending = 0
+        if self.binary_path is not None:
+            self._write_schema()
+
+    def _write_schema(self):
+        '''
+        The schema is replaced atomically after the column data, so it never claims more rows
+        than the column files hold
+        '''
+        schema = {'rows': self.rows - self._pending,
+                  'columns': {column: dtype.str for column, dtype in self._dtypes.items()},
+                  'labels': {column: list(labels) for column, labels in self._labels.items()}}
+        temp = os.path.join(self.binary_path, 'schema.json.tmp')
+        with open(temp, 'w') as f:
+            json.dump(schema, f)
+        os.replace(temp, os.path.join(self.binary_path, 'schema.json'))
+
+    def close(self):
+        if self._csv.closed:
+            return
+        self.flush()
+        self._csv.close()
+
+
+def read_columns(path, mmap=True):
+    '''
+    Reads the binary output of a RecordWriter (the `_columns` directory) as a dict of arrays.
+    Numeric columns are memory-mapped, text columns are decoded. Rows written after the last
+    complete flush are ignored
+    '''
+    with open(os.path.join(path, 'schema.json')) as f:
+        schema = json.load(f)
+    rows = schema['rows']
+    columns = {}
+    for column, dtype in schema['columns'].items():
+        file = os.path.join(path, column + '.bin')
+        if mmap and rows:
+            values = np.memmap(file, dtype=np.dtype(dtype), mode='r', shape=(rows,))
+        else:
+            values = np.fromfile(file, dtype=np.dtype(dtype), count=rows)
+        if column in schema['labels']:
+            values = np.array(schema['labels'][column], dtype=object)[values]
+        columns[column] = values
+    return columns
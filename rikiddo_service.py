@@ -0,0 +1,299 @@
+from rikiddo_cpmm_compare.rikiddo import RikiddoScoringRule
+from rikiddo_instrument import Instrumentation
+from rikiddo_events import NullSink
+from time import perf_counter_ns
+import argparse
+import asyncio
+import json
+import math
+import numpy as np
+
+
+def _finite(value):
+    '''
+    `value`, or None when it is NaN or infinite: JSON has no such numbers
+    '''
+    return value if math.isfinite(value) else None
+
+
+class MarketService(object):
+    def __init__(self, tick=0.002, queue_size=1024, max_inflight=256, events=None):
+        """
+        Asyncio host of many RikiddoScoringRule markets, spoken to with JSON lines over a
+        local socket (`serve`) or directly (`handle`).
+
+        Quotes that arrive within one tick are coalesced: at the end of the tick every market
+        answers all its pending quotes with one `quote_many` (share quotes) and one
+        `calculate_shares` (paid quotes) call, against the state left by the trades executed
+        so far. Trades are serialized per market through a bounded queue consumed by one task;
+        when the queue is full the trade is refused with a 'busy' error instead of waiting, so
+        clients see the backpressure. Every connection has at most `max_inflight` requests in
+        progress, after which it stops being read.
+
+        Requests are objects with an `op` and an optional `id` echoed in the response:
+            {"op": "create", "market": m, "outcomes": n, "n_params": [...], "vig", "init", "mrc"}
+            {"op": "quote", "market": m, "outcome": o, "shares": s}   (cost of s shares)
+            {"op": "quote", "market": m, "outcome": o, "paid": a}     (shares bought with a)
+            {"op": "buy", "market": m, "outcome": o, "paid": a, "name": trader}
+            {"op": "sell", "market": m, "outcome": o, "shares": s, "name": trader}
+            {"op": "price", "market": m}
+            {"op": "metrics"}
+        Responses are {"id", "ok": true, "result"} or {"id", "ok": false, "error"}. Numbers
+        that aren't finite (e.g. the average price of a 0 shares quote) are returned as null.
+
+        Parameters
+        ----------
+        tick            float
+                        Seconds during which quotes are collected before being evaluated
+
+        queue_size      int
+                        Maximum trades waiting per market
+
+        max_inflight    int
+                        Maximum requests in progress per connection
+
+        events          EventSink
+                        Sink of the trade events of the hosted markets. Default: NullSink()
+        """
+        self.tick = tick
+        self.queue_size = queue_size
+        self.max_inflight = max_inflight
+        self.events = NullSink() if events is None else events
+        self.metrics = Instrumentation()
+        self._markets = {}
+        self._queues = {}
+        self._workers = {}
+        #market -> list of (kind, outcome, value, future) waiting for the end of the tick
+        self._pending = {}
+        self._flush_handle = None
+        self._max_depth = {}
+        self._max_batch = 0
+
+    def create_market(self, market, outcomes, n_params=(0.01, 6, 2), vig=0.1, init=1000.0, mrc=0.4):
+        if market in self._markets:
+            raise ValueError('Market %s already exists' % (market,))
+        if int(outcomes) < 2:
+            raise ValueError('A market needs at least 2 outcomes, got %s' % (outcomes,))
+        self._markets[market] = RikiddoScoringRule(list(range(int(outcomes))), list(n_params), vig=vig, init=init,
+                                                   mrc=mrc, events=self.events)
+        self._queues[market] = asyncio.Queue(self.queue_size)
+        self._workers[market] = asyncio.get_running_loop().create_task(self._trade_worker(market))
+        self._max_depth[market] = 0
+        return self._markets[market]
+
+    def _market(self, market):
+        try:
+            return self._markets[market]
+        except KeyError:
+            raise KeyError('Unknown market %s' % (market,)) from None
+
+    def _outcome(self, market, outcome):
+        '''
+        `outcome` as an index of `market`, refusing the negative indices numpy would accept
+        '''
+        index = int(outcome)
+        if index != outcome or not 0 <= index < self._market(market).n:
+            raise ValueError('Market %s has no outcome %s' % (market, outcome))
+        return index
+
+    def quote(self, market, outcome, shares=None, paid=None):
+        '''
+        Future of the quote, evaluated with the other quotes of the tick
+        '''
+        outcome = self._outcome(market, outcome)
+        if (shares is None) == (paid is None):
+            raise ValueError('A quote needs either shares or paid')
+        future = asyncio.get_running_loop().create_future()
+        kind, value = ('shares', shares) if paid is None else ('paid', paid)
+        self._pending.setdefault(market, []).append((kind, outcome, float(value), future))
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.tick, self._flush_quotes)
+        return future
+
+    def _flush_quotes(self):
+        self._flush_handle = None
+        pending, self._pending = self._pending, {}
+        for market, requests in pending.items():
+            start = perf_counter_ns()
+            self._evaluate_quotes(self._markets[market], requests)
+            self.metrics.record('quote_batch', perf_counter_ns() - start)
+            self.metrics.count('quotes', len(requests))
+            self._max_batch = max(self._max_batch, len(requests))
+
+    def _evaluate_quotes(self, market, requests):
+        for kind in ('shares', 'paid'):
+            batch = [request for request in requests if request[0] == kind]
+            if not batch:
+                continue
+            outcomes = np.array([request[1] for request in batch])
+            values = np.array([request[2] for request in batch])
+            try:
+                if kind == 'shares':
+                    costs, average, _ = market.quote_many(values, outcomes)
+                    results = [{'cost': _finite(c), 'average_price': _finite(a)}
+                               for c, a in zip(costs.tolist(), average.tolist())]
+                else:
+                    shares = np.atleast_1d(market.calculate_shares(values, outcomes))
+                    results = [{'shares': _finite(s)} for s in shares.tolist()]
+            except (ValueError, IndexError) as error:
+                #one bad request fails its batch: answer them one by one
+                if len(batch) > 1:
+                    for request in batch:
+                        self._evaluate_quotes(market, [request])
+                    continue
+                results = [error]
+            for request, result in zip(batch, results):
+                future = request[3]
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def trade(self, market, side, outcome, amount, name='trader'):
+        '''
+        Future of the trade, executed in order by the market's worker. Raises a RuntimeError
+        ('busy') right away when the market's queue is full
+        '''
+        outcome = self._outcome(market, outcome)
+        if side not in ('buy', 'sell'):
+            raise ValueError('Unknown side %s' % side)
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues[market]
+        try:
+            queue.put_nowait((side, outcome, float(amount), name, future, perf_counter_ns()))
+        except asyncio.QueueFull:
+            self.metrics.count('busy')
+            raise RuntimeError('busy: market %s has %d trades waiting' % (market, queue.qsize())) from None
+        self._max_depth[market] = max(self._max_depth[market], queue.qsize())
+        return future
+
+    async def _trade_worker(self, market):
+        queue = self._queues[market]
+        rule = self._markets[market]
+        while True:
+            side, outcome, amount, name, future, queued = await queue.get()
+            start = perf_counter_ns()
+            self.metrics.record('trade_wait', start - queued)
+            try:
+                if side == 'buy':
+                    result = {'shares': _finite(float(rule.buy_shares(name, amount, outcome)))}
+                else:
+                    result = {'paid': _finite(float(rule.sell_shares(name, amount, outcome)))}
+                if not future.done():
+                    future.set_result(result)
+            except Exception as error:
+                #whatever the rule raises fails this trade only: the worker keeps serving the queue
+                if not future.done():
+                    future.set_exception(error)
+            self.metrics.record('trade', perf_counter_ns() - start)
+            queue.task_done()
+
+    def snapshot(self):
+        '''
+        Latency histograms (per request type, quote batch, trade execution and time waited in
+        the trade queues), counters and the current and maximum depth of every trade queue
+        '''
+        snapshot = self.metrics.snapshot()
+        snapshot['queues'] = {str(market): {'depth': queue.qsize(), 'max_depth': self._max_depth[market]}
+                              for market, queue in self._queues.items()}
+        snapshot['max_quote_batch'] = self._max_batch
+        snapshot['markets'] = len(self._markets)
+        return snapshot
+
+    async def handle(self, request):
+        '''
+        Answers one request (a dict) and returns the response dict
+        '''
+        start = perf_counter_ns()
+        op = request.get('op')
+        try:
+            if op == 'quote':
+                result = await self.quote(request['market'], request['outcome'], request.get('shares'),
+                                          request.get('paid'))
+            elif op in ('buy', 'sell'):
+                amount = request['paid'] if op == 'buy' else request['shares']
+                result = await self.trade(request['market'], op, request['outcome'], amount,
+                                          request.get('name', 'trader'))
+            elif op == 'price':
+                result = [_finite(p) for p in self._market(request['market']).p.tolist()]
+            elif op == 'create':
+                self.create_market(request['market'], request['outcomes'],
+                                   **{key: request[key] for key in ('n_params', 'vig', 'init', 'mrc') if key in request})
+                result = None
+            elif op == 'metrics':
+                result = self.snapshot()
+            else:
+                raise ValueError('Unknown op %s' % (op,))
+            response = {'id': request.get('id'), 'ok': True, 'result': result}
+        except Exception as error:
+            self.metrics.count('errors')
+            response = {'id': request.get('id'), 'ok': False, 'error': str(error)}
+        self.metrics.record(str(op), perf_counter_ns() - start)
+        return response
+
+    async def _connection(self, reader, writer):
+        inflight = asyncio.Semaphore(self.max_inflight)
+
+        async def answer(request):
+            try:
+                response = await self.handle(request)
+                writer.write((json.dumps(response) + '\n').encode())
+            finally:
+                inflight.release()
+
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                await inflight.acquire()
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError('A request is a JSON object')
+                except ValueError as error:
+                    writer.write((json.dumps({'id': None, 'ok': False, 'error': str(error)}) + '\n').encode())
+                    inflight.release()
+                    continue
+                task = asyncio.get_running_loop().create_task(answer(request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                if writer.transport.get_write_buffer_size() > 65536:
+                    await writer.drain()
+            if tasks:
+                await asyncio.wait(tasks)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8765, path=None):
+        '''
+        Serves JSON lines on TCP `host:port`, or on the Unix socket `path` if given
+        '''
+        if path is not None:
+            server = await asyncio.start_unix_server(self._connection, path)
+        else:
+            server = await asyncio.start_server(self._connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='JSON lines service hosting Rikiddo markets')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', default=None, help='serve on this Unix socket instead of TCP')
+    parser.add_argument('--tick', type=float, default=0.002, help='seconds during which quotes are coalesced')
+    parser.add_argument('--queue-size', type=int, default=1024)
+    args = parser.parse_args()
+
+    service = MarketService(tick=args.tick, queue_size=args.queue_size)
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,179 @@
+from rikiddo_core_functions import fixFee, z_r, minRevenue
+from rikiddo_kernel import logsumexp
+from rikiddo_volume import BatchVolumeRatioTracker
+import numpy as np
+
+
+class MarketSimulation(object):
+    def __init__(self, markets, fee=None, b=0.7, trader_max_fee=0.1, initial_volume=1000000,
+                 max_delta=3000, signal_period=500, hold_signal=True, warning_volume=15000, warning_fee=0.15,
+                 seed=None):
+        """
+        Vectorized version of the `rikiddo.py` simulation: `markets` independent two-outcome
+        pools are kept as struct-of-arrays state and every call to `step` advances all of them
+        by one loop iteration with the same rules (buy/sell bounds, liquidity warning fee,
+        minRevenue floor, trader max fee and the 'no liquidity' stop).
+
+        Parameters
+        ----------
+        markets             int
+                            Number of independent markets simulated
+
+        fee                 float/array
+                            Initial fee of every market. Default: fixFee(0.04, 2) as in rikiddo.py
+
+        b                   float
+                            Proportion of the initial fee guaranteed to the liquidity providers
+                            (minRevenue)
+
+        trader_max_fee      float
+                            Maximum fee that a trader accepts
+
+        initial_volume      float
+                            Volume available in each account at the start (q_1 and q_2)
+
+        max_delta           float
+                            Trades are drawn uniformly from [0, max_delta]
+
+        signal_period       int
+                            Number of transactions during which a market signal remains the same
+
+        hold_signal         bool
+                            Keep the signal for the whole period, as the pre-drawn order flow
+                            of rikiddo.py does. Orders follow the rule of that flow (the first
+                            asset and sells both with probability signal), but they are drawn
+                            from the generator in another order, so a run reproduces the
+                            script's rules, not its trades. With False the signal is drawn on
+                            the iterations at a multiple of `signal_period` transactions and is
+                            0.5/0.5 on every other iteration, like the loop of rikiddo.py before
+                            the pre-drawn order flow
+
+        warning_volume      float
+                            Below this account volume the liquidity warning fee is applied
+
+        warning_fee         float
+                            Fee applied while the pool has liquidity problems
+
+        seed                int
+                            Seed of the numpy.random.Generator driving the whole simulation
+        """
+        if fee is None:
+            fee = fixFee(0.04, 2)
+        self.markets = markets
+        self.fee = np.broadcast_to(np.asarray(fee, dtype=np.float64), (markets,)).copy()
+        self.min_revenue = minRevenue(b, self.fee)
+        self.trader_max_fee = trader_max_fee
+        self.initial_volume = initial_volume
+        self.max_delta = max_delta
+        self.signal_period = signal_period
+        self.hold_signal = hold_signal
+        self.warning_volume = warning_volume
+        self.warning_fee = warning_fee
+        self.rng = np.random.default_rng(seed)
+
+        #accounts (q_1, q_2) and pool inventories (q_1_pool, q_2_pool), one column per asset
+        self.accounts = np.full((markets, 2), float(initial_volume))
+        self.pool = np.zeros((markets, 2))
+        self.volume = BatchVolumeRatioTracker(markets, 1, 6, warmup=3)
+        self.volume.update(0.0)
+
+        self.active = np.ones(markets, dtype=bool)
+        self.transactions = np.zeros(markets, dtype=np.int64)
+        self.previous_cost = np.zeros(markets)
+        self.profit = np.zeros(markets)
+        self.total_fee = self.fee.copy()
+        self.signal = np.full(markets, 0.5)
+        self._signal_block = np.full(markets, -1, dtype=np.int64)
+
+        self.steps = 0
+        self.rejected = np.zeros(markets, dtype=np.int64)
+        self.liquidity_warnings = np.zeros(markets, dtype=np.int64)
+        self.min_revenue_bounds = np.zeros(markets, dtype=np.int64)
+
+    def step(self):
+        '''
+        Advances every active market one iteration. Returns the mask of markets that traded
+        '''
+        m = self.markets
+        active = self.active
+
+        if self.hold_signal:
+            #a new market signal at the start of every block of `signal_period` transactions
+            block = self.transactions//self.signal_period
+            renew = block != self._signal_block
+            if renew.any():
+                self.signal = np.where(renew, self.rng.random(m), self.signal)
+                self._signal_block = block
+        else:
+            #the signal only applies on the iterations at a multiple of `signal_period`
+            self.signal = np.where(self.transactions % self.signal_period == 0, self.rng.random(m), 0.5)
+
+        asset = (self.rng.random(m) >= self.signal).astype(np.int64)
+        sell = self.rng.random(m) < self.signal
+        delta = self.rng.uniform(0, self.max_delta, m)
+
+        q_1, q_2 = self.accounts[:, 0], self.accounts[:, 1]
+        pool_1, pool_2 = self.pool[:, 0], self.pool[:, 1]
+        #same operator precedence as rikiddo.py: only the last condition is tied to 'sell'
+        forced_buy = (q_1 >= self.initial_volume) | (q_2 >= self.initial_volume) | (pool_1 <= 0) | ((pool_2 <= 0) & sell)
+        sell = sell & ~forced_buy
+
+        r = self.volume.ratio
+        total_fee = self.fee + z_r(r)
+        bounded = total_fee < self.min_revenue
+        total_fee = np.where(bounded, self.min_revenue, total_fee)
+        warning = (q_1 < self.warning_volume) | (q_2 < self.warning_volume)
+        total_fee = np.where(warning, self.warning_fee, total_fee)
+
+        trade = active & (total_fee <= self.trader_max_fee)
+        self.rejected += active & ~trade
+        self.liquidity_warnings += active & warning
+        self.min_revenue_bounds += active & bounded
+
+        dynamic_fee = total_fee*self.pool.sum(axis=1)
+        signed = np.where(sell, -delta, delta)*trade
+        rows = np.arange(m)
+        accounts = self.accounts.copy()
+        accounts[rows, asset] -= signed
+
+        #a buy that empties an account stops that market, like the 'no liquidity' break
+        empty = trade & ~sell & (accounts < 0).any(axis=1)
+        self.active = active & ~empty
+        trade = trade & ~empty
+        signed = signed*trade
+
+        self.accounts[rows, asset] -= signed
+        self.pool[rows, asset] += signed
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cost = dynamic_fee*logsumexp(self.pool/dynamic_fee[:, None])
+        transact_cost = cost - self.previous_cost
+        self.profit += np.where(trade & np.isfinite(transact_cost), transact_cost, 0.0)
+        self.previous_cost = np.where(trade, cost, self.previous_cost)
+        self.total_fee = np.where(trade, total_fee, self.total_fee)
+
+        self.volume.update(self.pool.sum(axis=1), trade)
+        self.transactions += trade
+        self.steps += 1
+        return trade
+
+    def run(self, steps):
+        '''
+        Runs `steps` iterations (or until every market stopped) and returns the summary
+        '''
+        for _ in range(steps):
+            if not self.active.any():
+                break
+            self.step()
+        return self.summary()
+
+    def summary(self):
+        return {'transactions': self.transactions.copy(),
+                'profit': self.profit.copy(),
+                'total_fee': self.total_fee.copy(),
+                'pool': self.pool.copy(),
+                'accounts': self.accounts.copy(),
+                'rejected': self.rejected.copy(),
+                'liquidity_warnings': self.liquidity_warnings.copy(),
+                'min_revenue_bounds': self.min_revenue_bounds.copy(),
+                'active': self.active.copy()}
@@ -0,0 +1,413 @@
+from rikiddo_cpmm_compare.rikiddo import RikiddoScoringRule
+from rikiddo_cpmm_compare.cpmm import CPMM
+from rikiddo_combo import RikiddoComboScoringRule
+from rikiddo_volume import VolumeRatioTracker, EMAVolumeRatioTracker
+from rikiddo_history import StateHistory
+from rikiddo_sparse import SparseState
+from collections.abc import Mapping
+import struct
+import json
+import zlib
+import os
+import numpy as np
+
+
+MAGIC = b'RKSNAP01'
+#magic, header length, header crc32
+_PREAMBLE = struct.Struct('<8sQI4x')
+_ALIGN = 64
+
+
+def _tracker_state(tracker):
+    '''
+    (meta, values) of a volume tracker
+    '''
+    if isinstance(tracker, VolumeRatioTracker):
+        meta = {'kind': 'window', 'short_window': tracker.short_window, 'long_window': tracker.long_window,
+                'warmup': tracker.warmup, 'round_up': tracker.round_up}
+        return meta, np.array([tracker._short_sum, tracker._long_sum, tracker._count] + list(tracker._buffer))
+    if isinstance(tracker, EMAVolumeRatioTracker):
+        meta = {'kind': 'ema', 'short_span': tracker.short_span, 'long_span': tracker.long_span,
+                'warmup': tracker.warmup}
+        return meta, np.array([tracker._short_ema, tracker._long_ema, tracker._count])
+    raise TypeError('Cannot snapshot a %s volume tracker' % type(tracker).__name__)
+
+
+def _restore_tracker(meta, values):
+    values = values.tolist()
+    if meta['kind'] == 'window':
+        tracker = VolumeRatioTracker(meta['short_window'], meta['long_window'], warmup=meta['warmup'],
+                                     round_up=meta['round_up'])
+        tracker._short_sum, tracker._long_sum = values[0], values[1]
+        tracker._count = int(values[2])
+        tracker._buffer = values[3:]
+    else:
+        tracker = EMAVolumeRatioTracker(meta['short_span'], meta['long_span'], warmup=meta['warmup'])
+        tracker._short_ema, tracker._long_ema = values[0], values[1]
+        tracker._count = int(values[2])
+    return tracker
+
+
+def _book_tail(book, tail):
+    '''
+    Last `tail` rows of a TradeBook: numeric columns as arrays, text columns as lists
+    '''
+    start = max(len(book) - tail, 0)
+    numeric, text = {}, {}
+    for column in book.columns:
+        values = book._columns[column][start:len(book)]
+        if column in book._labels:
+            labels = book._labels[column]
+            text[column] = [labels[code] for code in values.tolist()]
+        else:
+            numeric[column] = values.copy()
+    return start, numeric, text
+
+
+def _extend_book(book, numeric, text):
+    entries = dict(numeric)
+    entries.update(text)
+    if len(next(iter(numeric.values()))):
+        book.extend(entries)
+
+
+#every kind of market is exported as scalars (one float per market), ragged arrays (any
+#length per market) and a JSON document (labels, configuration)
+
+def _export_rikiddo(market, tail):
+    tracker, volume = _tracker_state(market._volume)
+    dropped, numeric, text = _book_tail(market._book, tail)
+    scalars = {'alpha': market.alpha, 'param_1': market.param_1, 'param_2': market.param_2,
+               'param_3': market.param_3, 'mrc': market.mrc, 'market_value': market.market_value,
+               'book_base': market._book_base + dropped,
+               'snapshot_every': market._states.snapshot_every}
+    ragged = {'x': market._states.current, 'volume': volume}
+    ragged.update(('book_' + column, values) for column, values in numeric.items())
+    meta = {'outcomes': list(market.possible_outcomes), 'tracker': tracker, 'book_text': text}
+    return scalars, ragged, meta
+
+
+def _import_rikiddo(scalars, ragged, meta, events):
+    x = ragged['x'].copy()
+    market = RikiddoScoringRule(meta['outcomes'], [scalars['param_1'], scalars['param_2'], scalars['param_3']],
+                                init=float(x.sum()), mrc=scalars['mrc'],
+                                volume_tracker=_restore_tracker(meta['tracker'], ragged['volume']),
+                                snapshot_every=int(scalars['snapshot_every']), events=events)
+    market.alpha = scalars['alpha']
+    market.market_value = scalars['market_value']
+    market._states = StateHistory(x, market._states._probabilities, snapshot_every=market._states.snapshot_every)
+    _extend_book(market._book, {column[5:]: values for column, values in ragged.items() if column.startswith('book_')},
+                 meta['book_text'])
+    market._book_base = int(scalars['book_base'])
+    market._cache.invalidate()
+    return market
+
+
+def _export_combo(market, tail):
+    tracker, volume = _tracker_state(market._volume)
+    dropped, numeric, text = _book_tail(market._book, tail)
+    state = market._states.current
+    scalars = {'alpha': market.alpha, 'param_1': market.param_1, 'param_2': market.param_2,
+               'param_3': market.param_3, 'market_value': market.market_value, 'init': market.init,
+               'initial_liquidity': market.initial_liquidity, 'baseline': state.baseline, 'sum': state.sum(),
+               'book_base': market._book_base + dropped,
+               'snapshot_every': market._states.snapshot_every}
+    ragged = {'ids': state.ids, 'values': state.values, 'volume': volume}
+    ragged.update(('book_' + column, values) for column, values in numeric.items())
+    meta = {'outcomes': market.possible_outcomes.outcomes, 'tracker': tracker, 'book_text': text}
+    return scalars, ragged, meta
+
+
+def _import_combo(scalars, ragged, meta, events):
+    market = RikiddoComboScoringRule(meta['outcomes'], [scalars['param_1'], scalars['param_2'], scalars['param_3']],
+                                     scalars['initial_liquidity'], init=scalars['init'],
+                                     volume_tracker=_restore_tracker(meta['tracker'], ragged['volume']),
+                                     snapshot_every=int(scalars['snapshot_every']), events=events)
+    market.alpha = scalars['alpha']
+    market.market_value = scalars['market_value']
+    state = SparseState(market.n, scalars['baseline'], capacity=len(ragged['ids']))
+    for id, value in zip(ragged['ids'].tolist(), ragged['values'].tolist()):
+        state[id] = value
+    #the running sum as it was, not re-added in another order
+    state._sum = scalars['sum']
+    market._states = StateHistory(state, market._states._probabilities, snapshot_every=market._states.snapshot_every)
+    _extend_book(market._book, {column[5:]: values for column, values in ragged.items() if column.startswith('book_')},
+                 meta['book_text'])
+    market._book_base = int(scalars['book_base'])
+    market._cache.invalidate()
+    return market
+
+
+def _export_cpmm(market, tail):
+    _, numeric, text = _book_tail(market._book, tail)
+    fees = np.array(market._fee_sum[-tail:] if tail else [])
+    scalars = {'fee': market._fee, 'fees_dropped': float(np.sum(market._fee_sum)) - float(fees.sum())}
+    ragged = {'reserves': market._reserves, 'fees': fees}
+    ragged.update(('book_' + column, values) for column, values in numeric.items())
+    meta = {'assets': market._assets, 'liquidity': market._liquidity, 'book_text': text}
+    return scalars, ragged, meta
+
+
+def _import_cpmm(scalars, ragged, meta, events):
+    market = CPMM(dict(zip(meta['assets'], ragged['reserves'].tolist())), scalars['fee'])
+    #fees of the trades left out of the snapshot are kept as a single entry, so totals match
+    market._fee_sum = ([scalars['fees_dropped']] if scalars['fees_dropped'] else []) + ragged['fees'].tolist()
+    market._liquidity = {(int(id) if id.lstrip('-').isdigit() else id): position
+                         for id, position in meta['liquidity'].items()}
+    _extend_book(market._book, {column[5:]: values for column, values in ragged.items() if column.startswith('book_')},
+                 meta['book_text'])
+    return market
+
+
+_KINDS = {'rikiddo': (RikiddoScoringRule, _export_rikiddo, _import_rikiddo),
+          'combo': (RikiddoComboScoringRule, _export_combo, _import_combo),
+          'cpmm': (CPMM, _export_cpmm, _import_cpmm)}
+
+
+def _kind(market):
+    for kind, (cls, _, _) in _KINDS.items():
+        if isinstance(market, cls):
+            return kind
+    raise TypeError('Cannot snapshot a %s' % type(market).__name__)
+
+
+def _version(market):
+    '''
+    Changes whenever the market does: the state version of the scoring rules, the book length
+    of the CPMM (every CPMM operation writes to its book)
+    '''
+    if isinstance(market, CPMM):
+        return len(market._book)
+    return market.state_version
+
+
+def _columnar(exports):
+    '''
+    Arrays of one group of markets from their (scalars, ragged, meta) exports
+    '''
+    arrays = {}
+    for name in exports[0][0]:
+        arrays['scalar.' + name] = np.array([scalars[name] for scalars, _, _ in exports], dtype=np.float64)
+    for name in exports[0][1]:
+        values = [np.asarray(ragged[name]) for _, ragged, _ in exports]
+        lengths = [value.size for value in values]
+        arrays['ragged.' + name] = np.concatenate(values) if values else np.zeros(0)
+        arrays['offsets.' + name] = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    documents = [json.dumps(meta).encode() for _, _, meta in exports]
+    arrays['meta'] = np.frombuffer(b''.join(documents), dtype=np.uint8)
+    arrays['offsets.meta'] = np.concatenate([[0], np.cumsum([len(d) for d in documents])]).astype(np.int64)
+    return arrays
+
+
+def write_segment(path, groups, deleted=(), full=True):
+    '''
+    Writes one snapshot file: a preamble, a JSON header (groups, array layout and crc32
+    checksums) and every array aligned to 64 bytes, so `np.memmap` can map them in place.
+    `groups` maps a kind to (keys, arrays)
+    '''
+    layout = {}
+    blobs = []
+    offset = 0
+    for kind, (keys, arrays) in groups.items():
+        entry = {'keys': keys, 'arrays': {}}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            entry['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset,
+                                     'crc32': zlib.crc32(array.data)}
+            blobs.append((offset, array))
+            offset += -(-array.nbytes//_ALIGN)*_ALIGN
+        layout[kind] = entry
+    header = json.dumps({'full': full, 'deleted': list(deleted), 'groups': layout}).encode()
+    data_start = -(-(_PREAMBLE.size + len(header))//_ALIGN)*_ALIGN
+
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(_PREAMBLE.pack(MAGIC, len(header), zlib.crc32(header)))
+        f.write(header)
+        for position, array in blobs:
+            f.seek(data_start + position)
+            f.write(array.data)
+        f.truncate(data_start + offset)
+    os.replace(temporary, path)
+    return path
+
+
+def read_segment(path, verify=True):
+    '''
+    (header, arrays) of a snapshot file. The arrays are views of one read-only np.memmap, so
+    nothing is read before it is used. verify=True checks every crc32 (reading every page)
+    '''
+    with open(path, 'rb') as f:
+        magic, length, checksum = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError('%s is not a snapshot file' % path)
+        header = f.read(length)
+    if len(header) != length or zlib.crc32(header) != checksum:
+        raise ValueError('Corrupted snapshot header in %s' % path)
+    header = json.loads(header)
+    data_start = -(-(_PREAMBLE.size + length)//_ALIGN)*_ALIGN
+    size = os.path.getsize(path)
+    mapped = np.memmap(path, dtype=np.uint8, mode='r') if size > data_start else np.zeros(0, dtype=np.uint8)
+    groups = {}
+    for kind, entry in header['groups'].items():
+        arrays = {}
+        for name, spec in entry['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            count = int(np.prod(spec['shape']))
+            start = data_start + spec['offset']
+            if start + count*dtype.itemsize > max(size, data_start):
+                raise ValueError('Truncated snapshot %s' % path)
+            array = mapped[start:start + count*dtype.itemsize].view(dtype).reshape(spec['shape'])
+            if verify and zlib.crc32(array.data) != spec['crc32']:
+                raise ValueError('Checksum mismatch on %s/%s in %s' % (kind, name, path))
+            arrays[name] = array
+        groups[kind] = (entry['keys'], arrays)
+    return header, groups
+
+
+class SnapshotWriter(object):
+    def __init__(self, path, book_tail=16):
+        """
+        Writes snapshots of a set of markets (RikiddoScoringRule, RikiddoComboScoringRule and
+        CPMM, keyed by str or int ids) to the directory `path`, read back by `Snapshot`.
+
+        The first `save` writes every market. The following ones are incremental: only the
+        markets that changed since the previous save (or were added) are written, with the
+        markets that disappeared listed as deleted. `save(full=True)` writes everything again
+        and removes the older files.
+
+        Every market keeps its state vector, parameters, volume tracker, market value, LP
+        positions (CPMM) and the last `book_tail` rows of its book. The state history isn't
+        kept: a restored market's history starts at the restored state.
+
+        Parameters
+        ----------
+        path            str
+                        Directory of the snapshot files
+
+        book_tail       int
+                        Book rows kept per market
+        """
+        self.path = path
+        self.book_tail = book_tail
+        os.makedirs(path, exist_ok=True)
+        self._segments = _segments(path)
+        #key -> (market object, version) at the last save
+        self._saved = {}
+
+    def save(self, markets, full=False):
+        '''
+        Writes the markets (dict key -> market) that changed since the last save, or all of
+        them. Returns the path of the file written
+        '''
+        full = full or not self._saved
+        groups = {}
+        saved = {}
+        for key, market in markets.items():
+            if not isinstance(key, (str, int)) or isinstance(key, bool):
+                raise TypeError('Snapshot keys need to be str or int, got %r' % (key,))
+            version = (market, _version(market))
+            saved[key] = version
+            previous = self._saved.get(key)
+            if not full and previous is not None and previous[0] is market and previous[1] == version[1]:
+                continue
+            kind = _kind(market)
+            groups.setdefault(kind, ([], []))
+            groups[kind][0].append(key)
+            groups[kind][1].append(_KINDS[kind][1](market, self.book_tail))
+        deleted = [] if full else [key for key in self._saved if key not in markets]
+
+        number = self._segments[-1][0] + 1 if self._segments else 0
+        path = os.path.join(self.path, 'snapshot-%06d.rks' % number)
+        write_segment(path, {kind: (keys, _columnar(exports)) for kind, (keys, exports) in groups.items()},
+                      deleted, full)
+        if full:
+            for _, old in self._segments:
+                os.remove(old)
+            self._segments = []
+        self._segments.append((number, path))
+        self._saved = saved
+        return path
+
+
+def _segments(path):
+    segments = []
+    for name in os.listdir(path):
+        if name.startswith('snapshot-') and name.endswith('.rks'):
+            segments.append((int(name[9:-4]), os.path.join(path, name)))
+    return sorted(segments)
+
+
+class Snapshot(Mapping):
+    def __init__(self, path, verify=True, events=None):
+        """
+        Markets of a snapshot directory, as a read-only mapping key -> market. Opening it maps
+        the files from the last full snapshot on and indexes the keys; a market object is only
+        built (from the mapped arrays) the first time it is accessed, and then kept.
+
+        Parameters
+        ----------
+        path            str
+                        Directory written by SnapshotWriter
+
+        verify          bool
+                        Check the crc32 of every array when opening (reads the whole files).
+                        Headers are always checked
+
+        events          EventSink
+                        Optional. Event sink of the restored scoring rules
+        """
+        self.path = path
+        self.events = events
+        segments = _segments(path)
+        if not segments:
+            raise ValueError('No snapshot in %s' % path)
+        self._groups = []
+        self._where = {}
+        self._markets = {}
+        opened = []
+        for number, segment in reversed(segments):
+            header, groups = read_segment(segment, verify)
+            opened.append((header, groups))
+            if header['full']:
+                break
+        else:
+            raise ValueError('No full snapshot in %s' % path)
+        for header, groups in reversed(opened):
+            for key in header['deleted']:
+                self._where.pop(key, None)
+            for kind, (keys, arrays) in groups.items():
+                group = len(self._groups)
+                self._groups.append((kind, arrays))
+                self._where.update(zip(keys, zip([group]*len(keys), range(len(keys)))))
+
+    def __len__(self):
+        return len(self._where)
+
+    def __iter__(self):
+        return iter(self._where)
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def kind(self, key):
+        group, _ = self._where[key]
+        return self._groups[group][0]
+
+    def __getitem__(self, key):
+        market = self._markets.get(key)
+        if market is None:
+            group, row = self._where[key]
+            kind, arrays = self._groups[group]
+            scalars, ragged = {}, {}
+            for name, array in arrays.items():
+                if name.startswith('scalar.'):
+                    scalars[name[7:]] = float(array[row])
+                elif name.startswith('ragged.'):
+                    offsets = arrays['offsets.' + name[7:]]
+                    ragged[name[7:]] = np.array(array[offsets[row]:offsets[row + 1]])
+            offsets = arrays['offsets.meta']
+            meta = json.loads(arrays['meta'][offsets[row]:offsets[row + 1]].tobytes())
+            market = _KINDS[kind][2](scalars, ragged, meta, self.events)
+            self._markets[key] = market
+        return market
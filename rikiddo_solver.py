@@ -0,0 +1,52 @@
+import numpy as np
+
+
+def solve_shares_terms(x_outcome, b, paid, shift, total, term):
+    '''
+    Shares of the traded outcome that cost exactly `paid` with the liquidity parameter `b`
+    fixed, i.e. the s that solves b*log(sum(exp((x + s*e_outcome)/b))) - b*log(sum(exp(x/b))) = paid.
+
+    The cost function is strictly increasing in s, so the solution is unique and has the
+    closed form s = C(x) + paid + b*log(1 - exp((L_rest - C(x) - paid)/b)) - x_outcome, where
+    L_rest is the log-sum-exp of the other outcomes. It is evaluated from the shifted
+    exponentials of the state (see rikiddo_kernel.exp_terms), so large balances don't
+    overflow and states that aren't stored as dense vectors (see rikiddo_sparse) can reuse it.
+
+    Parameters
+    ----------
+    x_outcome       float/array
+                    Outstanding shares of the traded outcome
+
+    b               float
+                    Liquidity parameter, kept constant during the trade
+
+    paid            float/array
+                    Amount paid (negative for an amount received when selling)
+
+    shift           float
+                    Shift of the exponentials of the state
+
+    total           float
+                    Sum of the shifted exponentials
+
+    term            float/array
+                    Shifted exponential of the traded outcome, exp(x_outcome/b - shift)
+
+    -------
+    Returns         float/array
+                    Shares for every request. Sells asking for more than the market can
+                    pay out have no solution and are returned as NaN
+    '''
+    paid = np.asarray(paid, dtype=np.float64)
+    rest = np.maximum(total - term, 0.0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        #log of the target sum of exponentials, relative to the shift
+        target = np.log(total) + paid/b
+        gap = np.log1p(-rest/np.exp(target))
+        shares = b*(shift + target + gap) - x_outcome
+    shares = np.where(np.isfinite(shares), shares, np.nan)
+    if shares.ndim == 0:
+        return float(shares)
+    return shares
+
@@ -0,0 +1,132 @@
+import numpy as np
+import math
+
+
+class SparseState(object):
+    def __init__(self, n, baseline, capacity=16):
+        """
+        State vector of `n` entries where every entry equals `baseline` except the ones that
+        were touched, stored in a hash map (id -> slot) over growable value arrays. Sums,
+        costs and probabilities are computed in closed form as
+        (untouched count)*(baseline term) + sum over the touched entries, so they scale with
+        the number of touched entries instead of `n`.
+
+        Parameters
+        ----------
+        n               int
+                        Length of the (virtual) dense vector
+
+        baseline        float
+                        Value of every untouched entry
+
+        capacity        int
+                        Touched entries preallocated
+        """
+        self.n = n
+        self.baseline = float(baseline)
+        self._slots = {}
+        self._ids = np.zeros(max(capacity, 1), dtype=np.int64)
+        self._values = np.zeros(max(capacity, 1))
+        self._count = 0
+        self._sum = n*self.baseline
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def touched(self):
+        return self._count
+
+    @property
+    def ids(self):
+        return self._ids[:self._count]
+
+    @property
+    def values(self):
+        return self._values[:self._count]
+
+    def copy(self):
+        state = SparseState(self.n, self.baseline, capacity=self._ids.size)
+        state._slots = self._slots.copy()
+        state._ids[:self._count] = self.ids
+        state._values[:self._count] = self.values
+        state._count = self._count
+        state._sum = self._sum
+        return state
+
+    def __getitem__(self, id):
+        if np.ndim(id):
+            return np.array([self[i] for i in np.ravel(id).tolist()]).reshape(np.shape(id))
+        slot = self._slots.get(int(id))
+        if slot is None:
+            if not 0 <= id < self.n:
+                raise IndexError('Index %d out of range' % id)
+            return self.baseline
+        return self._values[slot]
+
+    def _slot(self, id):
+        slot = self._slots.get(id)
+        if slot is None:
+            if not 0 <= id < self.n:
+                raise IndexError('Index %d out of range' % id)
+            if self._count == self._ids.size:
+                self._ids = np.concatenate([self._ids, np.zeros_like(self._ids)])
+                self._values = np.concatenate([self._values, np.zeros_like(self._values)])
+            slot = self._count
+            self._slots[id] = slot
+            self._ids[slot] = id
+            self._values[slot] = self.baseline
+            self._count += 1
+        return slot
+
+    def add(self, id, amount):
+        slot = self._slot(int(id))
+        self._values[slot] += amount
+        self._sum += amount
+
+    def __setitem__(self, id, value):
+        slot = self._slot(int(id))
+        self._sum += value - self._values[slot]
+        self._values[slot] = value
+
+    def sum(self):
+        return self._sum
+
+    def to_dense(self):
+        dense = np.full(self.n, self.baseline)
+        dense[self.ids] = self.values
+        return dense
+
+    def exp_terms(self, b):
+        '''
+        Shifted exponentials of state/b: (shift, baseline term, touched terms, total), with
+        total = (untouched count)*(baseline term) + sum(touched terms)
+        '''
+        z = self.values/b
+        shift = self.baseline/b
+        if self._count:
+            shift = max(shift, z.max())
+        base_term = math.exp(self.baseline/b - shift)
+        terms = np.exp(z - shift)
+        total = (self.n - self._count)*base_term + terms.sum()
+        return shift, base_term, terms, total
+
+    def cost(self, b):
+        '''
+        b*log(sum(exp(state/b)))
+        '''
+        shift, _, _, total = self.exp_terms(b)
+        return b*(shift + math.log(total))
+
+    def probabilities(self, b):
+        '''
+        exp(state/b)/sum(exp(state/b)) as a SparseState over the same touched entries
+        '''
+        shift, base_term, terms, total = self.exp_terms(b)
+        state = SparseState(self.n, base_term/total, capacity=self._ids.size)
+        state._slots = self._slots.copy()
+        state._ids[:self._count] = self.ids
+        state._values[:self._count] = terms/total
+        state._count = self._count
+        state._sum = 1.0
+        return state
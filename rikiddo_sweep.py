@@ -0,0 +1,184 @@
+from rikiddo_cpmm_compare.rikiddo import RikiddoScoringRule
+from rikiddo_orders import order_stream
+from rikiddo_events import NullSink
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import itertools
+import argparse
+import json
+import os
+import numpy as np
+
+
+def grid(n_params, vig, mrc, initial_liquidity, flow=('signal',), outcomes=(2,)):
+    '''
+    Every combination of the given values, as a list of cells (dicts)
+    '''
+    cells = []
+    for values in itertools.product(n_params, vig, mrc, initial_liquidity, flow, outcomes):
+        cells.append(dict(zip(['n_params', 'vig', 'mrc', 'initial_liquidity', 'flow', 'outcomes'], values)))
+    for i, cell in enumerate(cells):
+        cell['n_params'] = list(cell['n_params'])
+        cell['cell'] = i
+    return cells
+
+
+def sample(size, n_params, vig, mrc, initial_liquidity, flow=('signal',), outcomes=(2,), seed=0):
+    '''
+    `size` random cells. Every argument is either a (low, high) tuple sampled uniformly or a
+    list of values sampled with equal probability; n_params takes three of them
+    '''
+    rng = np.random.default_rng(seed)
+
+    def draw(spec):
+        if isinstance(spec, tuple):
+            return float(rng.uniform(spec[0], spec[1]))
+        return spec[rng.integers(len(spec))]
+
+    cells = []
+    for i in range(size):
+        cells.append({'n_params': [draw(spec) for spec in n_params],
+                      'vig': draw(vig),
+                      'mrc': draw(mrc),
+                      'initial_liquidity': draw(initial_liquidity),
+                      'flow': draw(list(flow)),
+                      'outcomes': int(draw(list(outcomes))),
+                      'cell': i})
+    return cells
+
+
+def run_cell(cell, orders=1000, seed=0):
+    '''
+    Runs one sweep cell and returns its summary metrics.
+
+    lp_revenue is the value collected by the market minus its worst-case payout, fee_paid sums
+    the dynamic fee rate times the amount of every trade, slippage is the mean absolute
+    relative difference between the average price paid and the pre-trade probability (as in
+    rikiddo_benchmark: buys pay above the probability and sells get less, so signed values
+    would cancel out), and solves counts the share solves (one closed-form solve per buy,
+    there are no solver iterations)
+    '''
+    rng = np.random.default_rng([seed, cell['cell']])
+    outcomes = cell['outcomes']
+    market = RikiddoScoringRule(list(range(outcomes)), cell['n_params'], vig=cell['vig'],
+                                init=cell['initial_liquidity'], mrc=cell['mrc'], events=NullSink())
+    #the whole order flow of the cell in one batch (see rikiddo_orders)
+    outcome, sell, amount = next(order_stream(outcomes, cell['flow'], rng=rng, orders=orders, batch_size=orders))
+
+    fee_paid = 0.0
+    slippage = []
+    solves = 0
+    for o, s, a in zip(outcome.tolist(), sell.tolist(), amount.tolist()):
+        probability = market.p[o]
+        if s:
+            shares = a/probability
+            paid = market.sell_shares('trader', shares, o)
+            paid = -paid
+        else:
+            paid = a
+            shares = market.buy_shares('trader', paid, o)
+            solves += 1
+        fee_paid += market.last_dynamic_fee*abs(paid)
+        slippage.append((paid/shares)/probability - 1)
+
+    return {'cell': cell['cell'],
+            'params': cell,
+            'orders': orders,
+            'lp_revenue': float(market.market_value - market.x.max()),
+            'fee_paid': float(fee_paid),
+            'slippage': float(np.mean(np.abs(slippage))),
+            'max_slippage': float(np.max(np.abs(slippage))),
+            'solves': solves,
+            'final_b': float(market.b)}
+
+
+def completed_cells(path):
+    '''
+    Cells already written to a results file (including the ones that failed, which would
+    fail the same way again), so an interrupted sweep can resume
+    '''
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as results:
+        for line in results:
+            try:
+                done.add(json.loads(line)['cell'])
+            except (ValueError, KeyError):
+                #a line cut by the interruption, the cell will run again
+                continue
+    return done
+
+
+def _drop_partial_line(path):
+    '''
+    Truncates `path` after its last newline, removing the line an interruption cut short so
+    the next result isn't appended to it
+    '''
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as results:
+        end = results.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - 65536)
+            results.seek(start)
+            block = results.read(position - start)
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                position = start + newline + 1
+                break
+            position = start
+        if position < end:
+            results.truncate(position)
+
+
+def sweep(cells, path, orders=1000, seed=0, workers=None):
+    '''
+    Runs every cell not yet present in `path` over a ProcessPoolExecutor and appends one
+    JSON line per finished cell. Each cell gets its own generator seeded with (seed, cell id),
+    so results don't depend on scheduling or on how many times the sweep was resumed. A cell
+    that raises is written as an error record instead of stopping the sweep.
+    '''
+    _drop_partial_line(path)
+    done = completed_cells(path)
+    pending = [cell for cell in cells if cell['cell'] not in done]
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as executor, open(path, 'a') as results:
+        queue = iter(pending)
+        running = {}
+        while True:
+            #keep a bounded number of cells in flight instead of submitting the whole grid
+            for cell in itertools.islice(queue, 4*workers - len(running)):
+                running[executor.submit(run_cell, cell, orders, seed)] = cell
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                cell = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as error:
+                    result = {'cell': cell['cell'], 'params': cell, 'orders': orders,
+                              'error': '%s: %s' % (type(error).__name__, error)}
+                results.write(json.dumps(result) + '\n')
+            results.flush()
+    return len(pending)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parameter sweep of the Rikiddo scoring rule')
+    parser.add_argument('--out', default='sweepResults.jsonl')
+    parser.add_argument('--orders', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--sample', type=int, default=0, help='random cells instead of the grid')
+    args = parser.parse_args()
+
+    if args.sample:
+        cells = sample(args.sample, [(0.001, 0.1), (1, 10), (1, 3)], (0.01, 0.2), (0.2, 0.8),
+                       (10, 1000), flow=('uniform', 'signal'), seed=args.seed)
+    else:
+        cells = grid([[0.01, 6, 2], [0.05, 6, 2], [0.01, 2, 2]], [0.05, 0.1], [0.2, 0.4, 0.6],
+                     [10, 100, 1000], flow=('uniform', 'signal'))
+    ran = sweep(cells, args.out, orders=args.orders, seed=args.seed, workers=args.workers)
+    print(f'{ran} cells written to {args.out}')
@@ -0,0 +1,292 @@
+import numpy as np
+import math
+
+
+class VolumeRatioTracker(object):
+    def __init__(self, short_window, long_window, warmup=0, round_up=True):
+        """
+        Streaming short/long volume ratio. Keeps the last `long_window` volumes in a
+        ring buffer together with running sums of both windows, so every update and
+        every read of `ratio` is O(1) no matter how long the market has been running.
+
+        Parameters
+        ----------
+        short_window        int
+                            Number of trades averaged by the short window
+
+        long_window         int
+                            Number of trades averaged by the long window (>= short_window)
+
+        warmup              int
+                            While `count` is not above this value the ratio falls back to the
+                            full-history mean on both sides (r = 1, or 0 if there is no volume)
+
+        round_up            bool
+                            Round both window means up with `math.ceil`, as the original
+                            pandas implementation does
+        """
+        if short_window < 1 or long_window < short_window:
+            raise ValueError('Windows need to satisfy 1 <= short_window <= long_window')
+        self.short_window = short_window
+        self.long_window = long_window
+        self.warmup = warmup
+        self.round_up = round_up
+        self._buffer = [0.0]*long_window
+        self._short_sum = 0.0
+        self._long_sum = 0.0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def last(self):
+        return self._buffer[(self._count - 1) % self.long_window]
+
+    def update(self, volume):
+        '''
+        Register the volume of a new trade
+        '''
+        volume = float(volume)
+        head = self._count % self.long_window
+        if self._count >= self.long_window:
+            self._long_sum -= self._buffer[head]
+        if self._count >= self.short_window:
+            self._short_sum -= self._buffer[(self._count - self.short_window) % self.long_window]
+        self._buffer[head] = volume
+        self._short_sum += volume
+        self._long_sum += volume
+        self._count += 1
+
+        #resync the running sums once per lap of the ring so rounding errors can't drift
+        if self._count % self.long_window == 0:
+            self._resync()
+        return self.ratio
+
+    def _window(self, length):
+        length = min(length, self._count)
+        return [self._buffer[(self._count - 1 - i) % self.long_window] for i in range(length)]
+
+    def _resync(self):
+        self._short_sum = math.fsum(self._window(self.short_window))
+        self._long_sum = math.fsum(self._window(self.long_window))
+
+    def _mean(self, total, window):
+        mean = total/min(window, self._count)
+        if self.round_up:
+            return math.ceil(mean)
+        return mean
+
+    @property
+    def short_mean(self):
+        return self._mean(self._short_sum, self.short_window)
+
+    @property
+    def long_mean(self):
+        return self._mean(self._long_sum, self.long_window)
+
+    @property
+    def ratio(self):
+        if self._count == 0:
+            return 0
+        if self._count <= self.warmup:
+            if self._count == 1:
+                level = math.ceil(self.last)
+            else:
+                level = self._long_sum/self._count
+            return 0 if level == 0 else 1
+
+        longWindow = self.long_mean
+        if longWindow == 0:
+            return 0
+        return self.short_mean/longWindow
+
+
+class EMAVolumeRatioTracker(object):
+    def __init__(self, short_span, long_span, warmup=0):
+        """
+        Exponential moving average flavour of `VolumeRatioTracker`. Both averages use
+        alpha = 2/(span + 1) and are seeded with the first volume, like
+        `pandas.Series.ewm(span=span, adjust=False)`.
+
+        Parameters
+        ----------
+        short_span          int
+                            Span of the short EMA
+
+        long_span           int
+                            Span of the long EMA
+
+        warmup              int
+                            While `count` is not above this value the ratio is reported as 1
+                            (or 0 if there is no volume)
+        """
+        self.short_span = short_span
+        self.long_span = long_span
+        self.warmup = warmup
+        self._short_alpha = 2.0/(short_span + 1)
+        self._long_alpha = 2.0/(long_span + 1)
+        self._short_ema = 0.0
+        self._long_ema = 0.0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def count(self):
+        return self._count
+
+    def update(self, volume):
+        '''
+        Register the volume of a new trade
+        '''
+        volume = float(volume)
+        if self._count == 0:
+            self._short_ema = volume
+            self._long_ema = volume
+        else:
+            self._short_ema += self._short_alpha*(volume - self._short_ema)
+            self._long_ema += self._long_alpha*(volume - self._long_ema)
+        self._count += 1
+        return self.ratio
+
+    @property
+    def short_mean(self):
+        return self._short_ema
+
+    @property
+    def long_mean(self):
+        return self._long_ema
+
+    @property
+    def ratio(self):
+        if self._count == 0 or self._long_ema == 0:
+            return 0
+        if self._count <= self.warmup:
+            return 1
+        return self._short_ema/self._long_ema
+
+
+def volume_ratio_series(volumes, short_window, long_window, warmup=0, round_up=True):
+    '''
+    `VolumeRatioTracker.ratio` after every volume of a recorded series, in one vectorized
+    pass: the window sums are taken over a sliding window view instead of being updated one
+    trade at a time.
+
+    -------
+    Returns         array
+                    ratio[t] is the ratio once volumes[0..t] have been registered
+    '''
+    if short_window < 1 or long_window < short_window:
+        raise ValueError('Windows need to satisfy 1 <= short_window <= long_window')
+    volumes = np.asarray(volumes, dtype=np.float64).ravel()
+    if not volumes.size:
+        return np.zeros(0)
+    padded = np.concatenate([np.zeros(long_window - 1), volumes])
+    windows = np.lib.stride_tricks.sliding_window_view(padded, long_window)
+    long_sum = windows.sum(axis=1)
+    short_sum = windows[:, long_window - short_window:].sum(axis=1)
+    count = np.arange(1, volumes.size + 1)
+
+    short_mean = short_sum/np.minimum(short_window, count)
+    long_mean = long_sum/np.minimum(long_window, count)
+    if round_up:
+        short_mean = np.ceil(short_mean)
+        long_mean = np.ceil(long_mean)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.where(long_mean == 0, 0.0, short_mean/long_mean)
+    level = np.where(count == 1, np.ceil(volumes[0]), long_sum/count)
+    return np.where(count <= warmup, np.where(level == 0, 0.0, 1.0), r)
+
+
+class BatchVolumeRatioTracker(object):
+    def __init__(self, markets, short_window, long_window, warmup=0, round_up=True):
+        """
+        `VolumeRatioTracker` for many independent markets at once. The ring buffers and
+        running sums are stored as arrays (one row per market) and every update is a
+        handful of vectorized operations over the markets that traded.
+
+        Parameters
+        ----------
+        markets             int
+                            Number of markets tracked
+
+        short_window        int
+                            Number of trades averaged by the short window
+
+        long_window         int
+                            Number of trades averaged by the long window (>= short_window)
+
+        warmup              int
+                            Same warm-up rule as `VolumeRatioTracker`
+
+        round_up            bool
+                            Round both window means up with `np.ceil`
+        """
+        if short_window < 1 or long_window < short_window:
+            raise ValueError('Windows need to satisfy 1 <= short_window <= long_window')
+        self.short_window = short_window
+        self.long_window = long_window
+        self.warmup = warmup
+        self.round_up = round_up
+        self._buffer = np.zeros((markets, long_window))
+        self._short_sum = np.zeros(markets)
+        self._long_sum = np.zeros(markets)
+        self.count = np.zeros(markets, dtype=np.int64)
+
+    def __len__(self):
+        return self.count.size
+
+    @property
+    def last(self):
+        rows = np.arange(self.count.size)
+        return self._buffer[rows, (self.count - 1) % self.long_window]
+
+    def update(self, volumes, mask=None):
+        '''
+        Register one trade volume for every market (or only for the markets where `mask` is True)
+        '''
+        volumes = np.broadcast_to(np.asarray(volumes, dtype=np.float64), self.count.shape)
+        if mask is None:
+            rows = np.arange(self.count.size)
+        else:
+            rows = np.flatnonzero(mask)
+        volumes = volumes[rows]
+        count = self.count[rows]
+        head = count % self.long_window
+        leaving_long = np.where(count >= self.long_window, self._buffer[rows, head], 0.0)
+        leaving_short = np.where(count >= self.short_window,
+                                 self._buffer[rows, (count - self.short_window) % self.long_window], 0.0)
+        self._buffer[rows, head] = volumes
+        self._short_sum[rows] += volumes - leaving_short
+        self._long_sum[rows] += volumes - leaving_long
+        self.count[rows] = count + 1
+
+        #resync the running sums of the markets that completed a lap of their ring
+        lap = rows[self.count[rows] % self.long_window == 0]
+        if lap.size:
+            self._long_sum[lap] = self._buffer[lap].sum(axis=1)
+            back = (self.count[lap, None] - 1 - np.arange(self.short_window)[None, :]) % self.long_window
+            self._short_sum[lap] = self._buffer[lap[:, None], back].sum(axis=1)
+
+    def _mean(self, total, window):
+        mean = total/np.maximum(np.minimum(window, self.count), 1)
+        if self.round_up:
+            return np.ceil(mean)
+        return mean
+
+    @property
+    def ratio(self):
+        short_mean = self._mean(self._short_sum, self.short_window)
+        long_mean = self._mean(self._long_sum, self.long_window)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = np.where(long_mean == 0, 0.0, short_mean/long_mean)
+        level = np.where(self.count == 1, np.ceil(self.last), self._long_sum/np.maximum(self.count, 1))
+        warm = np.where(level == 0, 0.0, 1.0)
+        r = np.where(self.count <= self.warmup, warm, r)
+        return np.where(self.count == 0, 0.0, r)
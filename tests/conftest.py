@@ -0,0 +1,24 @@
+from rikiddo_cpmm_compare.rikiddo import RikiddoScoringRule
+from rikiddo_events import NullSink
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def traded_market():
+    '''
+    Factory of markets with some trading behind them: `make(market=None, trades=50, seed=0,
+    max_paid=20.0, **kwargs)` buys `trades` times, paying uniformly in [1, max_paid] for a
+    uniformly drawn outcome of `market`. Without a market it trades a new
+    RikiddoScoringRule([0, 1, 2], [0.01, 6, 2], init=1000.0, events=NullSink(), **kwargs).
+    The same arguments always give the same market
+    '''
+    def make(market=None, trades=50, seed=0, max_paid=20.0, **kwargs):
+        if market is None:
+            kwargs = dict({'init': 1000.0, 'events': NullSink()}, **kwargs)
+            market = RikiddoScoringRule([0, 1, 2], [0.01, 6, 2], **kwargs)
+        rng = np.random.default_rng(seed)
+        for _ in range(trades):
+            market.buy_shares('trader', float(rng.uniform(1, max_paid)), int(rng.integers(market.n)))
+        return market
+    return make
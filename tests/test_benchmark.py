@@ -0,0 +1,34 @@
+from rikiddo_benchmark import replay
+from rikiddo_orders import order_stream
+import numpy as np
+
+
+def _sell_heavy(orders, outcomes, seed):
+    rng = np.random.default_rng(seed)
+    #a few buys first so there is something to sell, then 90% sells
+    sell = rng.random(orders) < 0.9
+    sell[:20] = False
+    yield rng.integers(0, outcomes, orders), sell, rng.uniform(0, 10, orders)
+
+
+def _check(report):
+    assert all(reserve > 0 for reserve in report['cpmm_reserves'].values())
+    assert 0 <= report['divergence']['mean'] <= report['divergence']['max'] <= 1
+    #swap_many over the CPMM orders that traded ends where the sequential calls did. Sells
+    #close to draining an asset multiply it by 2 - R/(R - n) near 0, which amplifies the
+    #rounding differences between the two, hence the looser tolerance
+    batch = report['cpmm_batch']
+    assert batch['orders'] == report['cpmm']['orders'] - report['cpmm']['rejected']
+    for asset, reserve in report['cpmm_reserves'].items():
+        assert np.isclose(batch['reserves'][asset], reserve, rtol=1e-6, atol=0)
+
+
+def test_sell_heavy_stream_keeps_cpmm_reserves_positive():
+    report = replay(_sell_heavy(3000, 3, seed=1), 3)
+    _check(report)
+    assert report['cpmm']['rejected'] > 0
+
+
+def test_signal_stream_keeps_divergence_bounded():
+    #seed 0 over 3 outcomes used to drive the o0 reserve negative and the divergence to 182
+    _check(replay(order_stream(3, 'signal', seed=0, orders=20000, batch_size=100000), 3))
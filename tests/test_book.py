@@ -0,0 +1,76 @@
+from rikiddo_book import TradeBook
+from rikiddo_cpmm_compare.rikiddo import RikiddoScoringRule
+from rikiddo_cpmm_compare.cpmm import CPMM
+from rikiddo_events import NullSink
+import math
+import numpy as np
+import pytest
+
+
+def _book(capacity=2):
+    return TradeBook({'name': str, 'shares': np.float64, 'outcome': np.int64}, capacity=capacity)
+
+
+def test_append_grows_and_fills_defaults():
+    book = _book()
+    for i in range(10):
+        book.append({'name': 'ab'[i % 2], 'shares': float(i), 'outcome': i})
+    book.append({'outcome': 99})
+    assert len(book) == 11
+    assert book['shares'][:10].tolist() == [float(i) for i in range(10)]
+    assert math.isnan(book.last('shares')) and book.last('name') == ''
+    assert book['name'][:4].tolist() == ['a', 'b', 'a', 'b']
+    #every distinct name is stored once
+    assert book._labels['name'] == ['a', 'b', '']
+    with pytest.raises(ValueError):
+        book['shares'][0] = 1.0
+    with pytest.raises(KeyError):
+        book.append({'price': 1.0})
+
+
+def test_extend_matches_append():
+    rng = np.random.default_rng(0)
+    names = rng.choice(['x', 'y', 'z'], 50)
+    shares = rng.uniform(-5, 5, 50)
+    one, many = _book(), _book()
+    for name, share in zip(names.tolist(), shares.tolist()):
+        one.append({'name': name, 'shares': share, 'outcome': 3})
+    many.extend({'name': names, 'shares': shares, 'outcome': 3})
+    for column in one.columns:
+        assert one[column].tolist() == many[column].tolist()
+    with pytest.raises(IndexError):
+        _book().last('shares')
+
+
+def test_frames_of_the_markets():
+    pytest.importorskip('pandas')
+    market = RikiddoScoringRule([0, 1], [0.01, 6, 2], init=100.0, events=NullSink())
+    market.buy_shares('alice', 5.0, 0)
+    market.sell_shares('bob', 1.0, 1)
+    market.liquidity_providing('carol', 10.0)
+    frame = market.book
+    assert list(frame.columns) == ['name', 'shares', 'outcome', 'paid', 'cost_function', 'dynamic_fee', 'lp']
+    assert frame['name'].tolist() == ['alice', 'bob', 'carol', 'carol']
+    assert frame['outcome'].tolist() == [0, 1, 0, 1]
+    assert frame['lp'].tolist() == [0, 0, 1, 1]
+
+    cpmm = CPMM({'ZTG': 100.0, 'A': 50.0, 'B': 50.0}, 0.02)
+    cpmm.buy_shares(10.0, 'A')
+    assert cpmm.book['operation'].tolist() == ['buy'] and cpmm.book['outcome'].tolist() == ['A']
+
+
+def test_book_frames_are_independent_copies():
+    market = RikiddoScoringRule([0, 1], [0.01, 6, 2], init=100.0, events=NullSink())
+    for i in range(10):
+        market.buy_shares('trader', 2.0 + i, i % 2)
+    shares = market._book['shares'].copy()
+    names = market._book['name'].copy()
+    ratio = market.ratio_function()
+    frame = market.book
+    frame.loc[0, 'shares'] = 99.0
+    frame.loc[1, 'name'] = 'trader'
+    frame['paid'] *= 2
+    np.testing.assert_array_equal(market._book['shares'], shares)
+    np.testing.assert_array_equal(market._book['name'], names)
+    assert market.ratio_function() == ratio
+    assert market.book.loc[0, 'shares'] == shares[0]
@@ -0,0 +1,53 @@
+from rikiddo_combo import RikiddoComboScoringRule
+from rikiddo_kernel import cost_and_prices
+from rikiddo_cache import VersionedCache
+from rikiddo_events import NullSink
+import numpy as np
+
+
+def test_tokens_and_invalidation():
+    cache = VersionedCache()
+    calls = []
+    value = lambda: calls.append(1) or len(calls)
+    assert cache.get('b', value, 1.0) == 1
+    cache.advance()
+    assert cache.get('b', value, 1.0) == 1
+    assert cache.get('b', value, 2.0) == 2
+    cache.invalidate()
+    assert cache.get('b', value, 2.0) == 3
+    assert cache.version == 2
+    assert cache.info()['keys']['b'] == {'hits': 1, 'misses': 3}
+
+
+def test_trades_hit_more_than_they_miss(traded_market):
+    market = traded_market(trades=100)
+    info = market.cache_info()
+    assert info['hits'] > info['misses']
+    assert info['keys']['b']['hits'] > info['keys']['b']['misses']
+
+
+def test_cached_values_match_a_fresh_computation(traded_market):
+    rng = np.random.default_rng(1)
+    market = traded_market(trades=0)
+    for i in range(120):
+        outcome = int(rng.integers(3))
+        version = market.state_version
+        if rng.random() < 0.3:
+            market.sell_shares('trader', float(rng.uniform(1, 5)), outcome)
+        else:
+            market.buy_shares('trader', float(rng.uniform(1, 50)), outcome)
+        assert market.state_version > version
+        if i == 60:
+            market.param_1 = 0.05
+        assert market.b == market._compute_b()
+        cost, prices, _ = cost_and_prices(market.x, market._compute_b())
+        assert market._current_cost() == cost
+        np.testing.assert_array_equal(market.p, prices)
+
+
+def test_combo_cache_matches_a_fresh_computation():
+    market = RikiddoComboScoringRule(['a', 'b', 'c', 'd'], [0.01, 6, 2], 100, events=NullSink())
+    for i in range(80):
+        market.buy_shares('trader', 3.0 + i % 5, i % market.n)
+        assert market.b == market._compute_b()
+        assert market._state()[0] == market.cost(market.x)
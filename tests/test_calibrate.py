@@ -0,0 +1,75 @@
+from rikiddo_calibrate import load_series, ratio_before_trades, candidate_grid, evaluate, calibrate
+from rikiddo_core_functions import z_r
+from rikiddo_record import RecordWriter
+from rikiddo_volume import VolumeRatioTracker
+import shutil
+import numpy as np
+import pytest
+
+
+def _series(size=400, seed=0):
+    rng = np.random.default_rng(seed)
+    volumes = np.cumsum(rng.uniform(0, 50, size))
+    amounts = rng.uniform(-20, 20, size)
+    return volumes, amounts
+
+
+def test_ratio_before_trades_matches_the_tracker():
+    volumes, _ = _series()
+    tracker = VolumeRatioTracker(1, 6, warmup=3)
+    expected = []
+    for volume in volumes:
+        expected.append(tracker.ratio)
+        tracker.update(volume)
+    np.testing.assert_array_equal(ratio_before_trades(volumes, 1, 6, warmup=3), expected)
+
+
+def test_fit_recovers_the_fee_curve_of_z():
+    volumes, amounts = _series()
+    r = ratio_before_trades(volumes, 1, 6, warmup=3)
+    candidates = candidate_grid([0.005, 0.01, 0.02], [2, 4, 6, 8], [1, 2, 3])
+    result = calibrate(r, amounts, candidates, alpha=0.01, mrc=0.7, objective='fit', target=z_r(r))
+    assert result['best'] == {'param_1': 0.01, 'param_2': 6.0, 'param_3': 2.0}
+    assert result['best_metrics']['squared_error'] == pytest.approx(0.0, abs=1e-20)
+    with pytest.raises(ValueError):
+        calibrate(r, amounts, candidates, 0.01, 0.7, objective='fit')
+    with pytest.raises(ValueError):
+        calibrate(r, amounts, candidates, 0.01, 0.7, objective='loss')
+
+
+def test_blocks_match_a_direct_evaluation():
+    volumes, amounts = _series()
+    r = ratio_before_trades(volumes, 1, 6, warmup=3)
+    candidates = candidate_grid(np.linspace(0.001, 0.1, 7), [1, 6], [1, 2, 3])
+    alpha, mrc, max_fee = 0.02, 0.7, 0.05
+    #a few candidates per block against the whole grid at once
+    blocked = evaluate(r, amounts, candidates, alpha, mrc, max_fee=max_fee, chunk_elements=3*r.size)
+    for k, (param_1, param_2, param_3) in enumerate(candidates.tolist()):
+        total = np.maximum(alpha + param_1*r/np.sqrt(param_2 + r**param_3), alpha*mrc)
+        accepted = total <= max_fee
+        assert blocked['lp_revenue'][k] == pytest.approx((total*np.abs(amounts))[accepted].sum(), rel=1e-12)
+        assert blocked['accepted'][k] == pytest.approx(accepted.mean())
+        assert blocked['max_fee'][k] == pytest.approx(total.max())
+    best = calibrate(r, amounts, candidates, alpha, mrc, max_fee=max_fee)
+    assert best['best_metrics']['lp_revenue'] == pytest.approx(blocked['lp_revenue'].max(), rel=1e-12)
+
+
+def test_load_series_csv_and_columns(tmp_path):
+    volumes, amounts = _series(50)
+    path = str(tmp_path/'record.csv')
+    columns = {'totalPoolVolume': np.float64, 'whoBuy': str, 'transactCost': np.float64}
+    with RecordWriter(path, columns, chunk_size=16) as writer:
+        for volume, amount in zip(volumes.tolist(), amounts.tolist()):
+            writer.append({'totalPoolVolume': volume, 'whoBuy': 'Will', 'transactCost': amount})
+    names = ['totalPoolVolume', 'transactCost']
+    binary = load_series(writer.binary_path, names)
+    #the CSV path picks the _columns directory next to it, remove it to read the CSV itself
+    from_csv_path = load_series(path, names)
+    shutil.rmtree(writer.binary_path)
+    text = load_series(path, names)
+    for name, expected in zip(names, (volumes, amounts)):
+        np.testing.assert_array_equal(binary[name], expected)
+        np.testing.assert_array_equal(from_csv_path[name], expected)
+        np.testing.assert_allclose(text[name], expected, rtol=1e-15)
+    with pytest.raises(KeyError):
+        load_series(path, ['missing'])
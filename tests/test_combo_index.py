@@ -0,0 +1,46 @@
+from rikiddo_combo_index import ComboIndex
+from itertools import permutations
+import random
+import pytest
+
+
+def test_ids_follow_itertools_permutations():
+    index = ComboIndex('abcde')
+    expected = [combo for k in range(1, 6) for combo in permutations('abcde', k)]
+    assert list(index) == expected
+    assert len(index) == index.size == len(expected)
+    assert [index.unrank(i) for i in range(len(index))] == expected
+    assert [index.rank(combo) for combo in expected] == list(range(len(expected)))
+    assert [combo for _, block in index.chunks(7, start=100) for combo in block] == expected[100:]
+
+
+def test_max_size_and_size_ranges():
+    index = ComboIndex(range(6), max_size=3)
+    assert index.size == 6 + 30 + 120
+    start, end = index.size_range(3)
+    assert index.unrank(start) == (0, 1, 2) and index.unrank(end - 1) == (5, 4, 3)
+    with pytest.raises(ValueError):
+        index.rank((0, 1, 2, 3))
+
+
+def test_round_trip_beyond_sys_maxsize():
+    #200 outcomes: far more combos than len() can report
+    index = ComboIndex(range(200))
+    rng = random.Random(0)
+    for _ in range(200):
+        id = rng.randrange(index.size)
+        assert index.rank(index.unrank(id)) == id
+    last = tuple(range(199, -1, -1))
+    assert index.unrank(index.size - 1) == last and index.rank(last) == index.size - 1
+
+
+def test_invalid_combos():
+    index = ComboIndex('abc')
+    with pytest.raises(ValueError):
+        index.rank(('a', 'a'))
+    with pytest.raises(KeyError):
+        index.rank(('z',))
+    with pytest.raises(IndexError):
+        index.unrank(index.size)
+    with pytest.raises(ValueError):
+        ComboIndex('aab')
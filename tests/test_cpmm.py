@@ -0,0 +1,77 @@
+from rikiddo_cpmm_compare.cpmm import CPMM
+import numpy as np
+import pytest
+
+
+INITIAL = {'ZTG': 1000.0, 'A': 500.0, 'B': 300.0, 'C': 200.0}
+
+
+def test_prices_match_the_dict_formula():
+    cpmm = CPMM(INITIAL, 0.01)
+    total = sum(value for asset, value in INITIAL.items() if asset != 'ZTG')
+    expected = {asset: (total - value)/total for asset, value in INITIAL.items() if asset != 'ZTG'}
+    assert cpmm.get_prices() == pytest.approx(expected)
+    assert cpmm.get_prices('B') == pytest.approx(expected['B'])
+    assert cpmm.get_prices('A', 'ZTG') == pytest.approx(1000.0/500.0)
+    with pytest.raises(KeyError):
+        cpmm.get_prices('D')
+
+
+def test_swap_many_matches_sequential_swaps():
+    rng = np.random.default_rng(0)
+    assets = rng.choice(['A', 'B', 'C'], 200).tolist()
+    amounts = rng.uniform(0.1, 20, 200)
+    sell = rng.random(200) < 0.3
+    sequential, batched = CPMM(INITIAL, 0.02), CPMM(INITIAL, 0.02)
+    expected = [sequential.sell_shares(a, asset) if s else sequential.buy_shares(a, asset)
+                for a, asset, s in zip(amounts.tolist(), assets, sell.tolist())]
+    shares = batched.swap_many(amounts, assets, sell)
+    np.testing.assert_allclose(shares, expected, rtol=1e-9)
+    for asset, value in sequential.state.items():
+        assert batched.state[asset] == pytest.approx(value, rel=1e-9)
+    np.testing.assert_allclose(batched._history, sequential._history, rtol=1e-9)
+    np.testing.assert_allclose(batched._fee_sum, sequential._fee_sum)
+    assert len(batched.book) == len(sequential.book) == 200
+    np.testing.assert_allclose(batched.prices(), sequential.prices(), rtol=1e-9)
+
+
+def test_swap_many_errors():
+    cpmm = CPMM(INITIAL, 0.0)
+    with pytest.raises(ValueError):
+        cpmm.swap_many([1.0, 2.0], ['A'])
+    with pytest.raises(ValueError):
+        cpmm.swap_many([1.0], ['ZTG'])
+    with pytest.raises(ValueError):
+        cpmm.swap_many([2000.0], ['A'], sell=True)
+    assert cpmm.state == INITIAL
+    with pytest.raises(ValueError):
+        CPMM(INITIAL, 1.5)
+
+
+def test_provide_liquidity():
+    cpmm = CPMM(INITIAL, 0.01)
+    before = cpmm.prices()
+    provided = cpmm.provide_liquidity(1, 100.0)
+    assert provided['total_provided'] == 100.0
+    assert sum(provided[asset] for asset in cpmm.outcomes) == pytest.approx(200.0)
+    #every outcome gets its price times the amount
+    np.testing.assert_allclose([provided[asset] for asset in cpmm.outcomes], 100.0*before)
+    assert len(cpmm._history) == 1
+
+
+def test_prices_after_draining_the_reserves():
+    #every buy puts in ten times the ZTG reserve, so the outcome reserves shrink by about 11x
+    #per buy, far below the rounding error of their initial sum
+    cpmm = CPMM(INITIAL, 0.01)
+    for i in range(90):
+        cpmm.buy_shares(10*cpmm.state['ZTG'], 'ABC'[i % 3])
+    state = cpmm.state
+    assert max(state['A'], state['B'], state['C']) < 1e-20
+    total = state['A'] + state['B'] + state['C']
+    expected = {asset: (total - state[asset])/total for asset in 'ABC'}
+    assert cpmm.get_prices() == pytest.approx(expected, rel=1e-12)
+    assert cpmm.get_prices('C') == pytest.approx(expected['C'], rel=1e-12)
+    assert cpmm.prices().sum() == pytest.approx(2.0, rel=1e-12)
+    batched = CPMM(INITIAL, 0.01)
+    batched.swap_many([10*1000.0*11**i for i in range(20)], ['A', 'B', 'C', 'A']*5)
+    np.testing.assert_allclose(batched._history[-1], batched.prices(), rtol=1e-12)
@@ -0,0 +1,58 @@
+from rikiddo_events import (EventSink, NullSink, StreamSink, FileSink, TradeEvent, DEBUG, INFO, WARNING,
+                            parse_level)
+from rikiddo_cpmm_compare.rikiddo import RikiddoScoringRule
+import io
+import json
+import pytest
+
+
+def test_event_sink_is_abstract():
+    with pytest.raises(TypeError):
+        EventSink()
+
+    class ListSink(EventSink):
+        def __init__(self):
+            EventSink.__init__(self, level=INFO)
+            self.events = []
+
+        def _write(self, event, level, timestamp):
+            self.events.append((event, level))
+
+    sink = ListSink()
+    sink.warn('low', 'below the level', level=DEBUG)
+    sink.emit(TradeEvent('buy', 'a', 0, 1.0, 2.0))
+    assert sink.events == [(TradeEvent('buy', 'a', 0, 1.0, 2.0), INFO)]
+
+
+def test_stream_sink_filters_and_formats():
+    stream = io.StringIO()
+    sink = StreamSink(stream, level='warning')
+    sink.emit(TradeEvent('buy', 'alice', 1, 2.0, 3.0))
+    sink.warn('fee', 'Fee is too high', 0.2)
+    assert stream.getvalue() == 'Fee is too high (0.2)\n'
+    assert parse_level('debug') == DEBUG
+    with pytest.raises(ValueError):
+        parse_level('loud')
+
+
+def test_file_sink_writes_every_event(tmp_path):
+    path = tmp_path/'events.jsonl'
+    with FileSink(str(path), level=DEBUG, batch_size=7) as sink:
+        for i in range(100):
+            sink.emit(TradeEvent('sell', 'bob', i % 2, float(i), -float(i)))
+        sink.flush()
+        assert sink.written == 100
+        sink.warn('stuck', 'stopped', level=WARNING)
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(records) == 101
+    assert records[5]['type'] == 'trade' and records[5]['shares'] == 5.0
+    assert records[-1]['level'] == 'WARNING' and records[-1]['code'] == 'stuck'
+
+
+def test_markets_report_trades_to_their_sink():
+    stream = io.StringIO()
+    market = RikiddoScoringRule([0, 1], [0.01, 6, 2], init=100.0, events=StreamSink(stream))
+    market.buy_shares('carol', 5.0, 1)
+    assert stream.getvalue().startswith('carol BOUGHT')
+    quiet = RikiddoScoringRule([0, 1], [0.01, 6, 2], init=100.0, events=NullSink())
+    quiet.buy_shares('carol', 5.0, 1)
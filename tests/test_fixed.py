@@ -0,0 +1,47 @@
+from rikiddo_fixed import FixedPoint, cross_check
+from rikiddo_kernel import cost_and_prices, ls_cost_and_prices
+import numpy as np
+import pytest
+
+
+def test_arithmetic():
+    engine = FixedPoint(32)
+    a = engine.to_fixed([1.5, -2.25, 1000.0])
+    b = engine.to_fixed([2.0, 3.0, -0.001])
+    np.testing.assert_allclose(engine.to_float(engine.mul(a, b)), [3.0, -6.75, -1.0], atol=2**-31)
+    #0.001 isn't exact in fixed point: compare with the quotient of the rounded inputs
+    np.testing.assert_allclose(engine.to_float(engine.div(a, b)), engine.to_float(a)/engine.to_float(b),
+                               rtol=1e-9)
+    with pytest.raises(ZeroDivisionError):
+        engine.div(a, 0)
+    with pytest.raises(OverflowError):
+        engine.to_fixed(2.0**40)
+    with pytest.raises(ValueError):
+        engine.ln(0)
+    with pytest.raises(ValueError):
+        FixedPoint(60)
+
+
+@pytest.mark.parametrize('frac_bits', [16, 32, 40])
+def test_cross_check_within_bounds(frac_bits):
+    report = cross_check(20000, outcomes=3, frac_bits=frac_bits, chunk_size=5000)
+    errors = report['errors']
+    assert errors['exp']['max_abs'] <= report['exp_bound']
+    assert errors['ln']['max_abs'] <= report['ln_bound']
+    for name in ('lmsr_cost', 'lmsr_prices', 'ls_cost', 'ls_prices'):
+        assert errors[name]['max_rel'] < 2**(16 - frac_bits)
+
+
+def test_batched_cost_and_prices():
+    engine = FixedPoint(32)
+    q = np.array([[10.0, 20.0], [500.0, 100.0], [3.0, 3.0]])
+    fee = np.array([0.05, 0.1, 0.2])
+    cost, prices = engine.ls_cost_and_prices(engine.to_fixed(q), engine.to_fixed(fee))
+    exact_cost, exact_prices, _ = ls_cost_and_prices(q, fee)
+    np.testing.assert_allclose(engine.to_float(cost), exact_cost, rtol=1e-7)
+    np.testing.assert_allclose(engine.to_float(prices), exact_prices, atol=1e-8)
+    b = fee*q.sum(axis=1)
+    cost, prices = engine.cost_and_prices(engine.to_fixed(q), engine.to_fixed(b))
+    exact_cost, exact_prices, _ = cost_and_prices(q, b)
+    np.testing.assert_allclose(engine.to_float(cost), exact_cost, rtol=1e-7)
+    np.testing.assert_allclose(engine.to_float(prices), exact_prices, atol=1e-8)
@@ -0,0 +1,56 @@
+from rikiddo_history import StateHistory
+from rikiddo_sparse import SparseState
+import numpy as np
+import pytest
+
+
+def _softmax(x, b):
+    e = np.exp(x/b)
+    return e/e.sum()
+
+
+@pytest.mark.parametrize('snapshot_every', [1, 5, 64])
+def test_replay_matches_a_dense_history(snapshot_every):
+    rng = np.random.default_rng(snapshot_every)
+    history = StateHistory(np.ones(4), _softmax, snapshot_every=snapshot_every)
+    states, bs = [], []
+    for t in range(100):
+        if t == 40:
+            history.replace(rng.uniform(0, 3, 4))
+        elif t % 17 == 3:
+            #several changes in one entry (a liquidity provision)
+            history.apply(0, 1.0)
+            history.apply(2, 0.5)
+        elif t % 11 != 0:
+            history.apply(int(rng.integers(4)), float(rng.uniform(-1, 2)))
+        b = float(rng.uniform(1, 3))
+        history.record(b)
+        states.append(history.current.copy())
+        bs.append(b)
+    assert len(history) == 100
+    assert history.snapshots >= 100//snapshot_every
+    for t in range(100):
+        np.testing.assert_allclose(history.x_at(t), states[t], rtol=1e-12)
+        np.testing.assert_allclose(history.p_at(t), _softmax(states[t], bs[t]), rtol=1e-12)
+    np.testing.assert_allclose(history.x_at(-1), states[-1])
+    rows = np.concatenate(list(history.chunks(chunk_size=7)))
+    np.testing.assert_allclose(rows, [_softmax(x, b) for x, b in zip(states, bs)], rtol=1e-12)
+    with pytest.raises(IndexError):
+        history.x_at(100)
+
+
+def test_sparse_states():
+    history = StateHistory(SparseState(50, 0.5), lambda x, b: x.probabilities(b), snapshot_every=3)
+    dense = np.full(50, 0.5)
+    for t in range(10):
+        history.apply(3*t, 1.0 + t)
+        dense[3*t] += 1.0 + t
+        history.record(2.0)
+    np.testing.assert_array_equal(history.x_at(9).to_dense(), dense)
+    rows = next(history.chunks(dense=SparseState.to_dense))
+    np.testing.assert_allclose(rows[-1], _softmax(dense, 2.0), rtol=1e-12)
+
+
+def test_snapshot_every_is_validated():
+    with pytest.raises(ValueError):
+        StateHistory(np.ones(2), _softmax, snapshot_every=0)
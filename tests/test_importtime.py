@@ -0,0 +1,15 @@
+from rikiddo_importtime import CORE_MODULES, check, measure
+import pytest
+
+
+def test_core_modules_import_numpy_only():
+    #the time budget is left generous: shared test machines are noisy, the import-time
+    #script keeps the tight one
+    report, failures = check(CORE_MODULES, budget=1.0, repeat=1)
+    assert failures == []
+    assert set(report) == set(CORE_MODULES)
+
+
+def test_probe_sees_heavy_modules():
+    pytest.importorskip('pandas')
+    assert measure('pandas', repeat=1)['heavy'][:1] == ['pandas']
@@ -0,0 +1,37 @@
+from rikiddo_cpmm_compare.rikiddo import RikiddoScoringRule
+from rikiddo_combo import RikiddoComboScoringRule
+from rikiddo_instrument import Instrumentation, section
+from rikiddo_events import NullSink
+
+
+def test_trading_path_is_timed():
+    probe = Instrumentation()
+    market = RikiddoScoringRule([0, 1], [0.01, 6, 2], init=100.0, events=NullSink(), instrumentation=probe)
+    for i in range(60):
+        market.buy_shares('trader', 2.0, i % 2)
+    market.sell_shares('trader', 1.0, 0)
+    market.calculate_shares(1.0, 0, method='cobyla')
+    timers = probe.snapshot()['timers']
+    assert timers['buy_shares']['count'] == 60
+    assert timers['sell_shares']['count'] == 1
+    assert timers['fmin_cobyla']['count'] == 1
+    assert {'b', 'cost', 'ratio_function', 'calculate_shares'} <= set(timers)
+    buy = timers['buy_shares']
+    assert sum(n for _, n in buy['buckets']) == 60
+    assert 0 < buy['p50_us'] <= buy['p99_us'] and buy['mean_us'] <= buy['max_us']
+
+
+def test_disabled_and_detached_probes_record_nothing():
+    probe = Instrumentation(enabled=False)
+    market = RikiddoComboScoringRule(['a', 'b', 'c'], [0.01, 6, 2], 100, events=NullSink(), instrumentation=probe)
+    market.buy_shares('trader', 2.0, 1)
+    probe.count('orders')
+    with section(probe, 'block'):
+        pass
+    with section(None, 'block'):
+        pass
+    assert probe.snapshot() == {'timers': {}, 'counters': {}}
+
+    market.instrumentation = probe = Instrumentation()
+    market.buy_shares('trader', 2.0, 1)
+    assert probe.snapshot()['timers']['buy_shares']['count'] == 1
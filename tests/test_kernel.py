@@ -0,0 +1,70 @@
+from rikiddo_kernel import exp_terms, cost_and_prices, ls_cost_and_prices
+from rikiddo_core_functions import eValue, lsdCostFunction, lsdPriceFunction_i
+import math
+import numpy as np
+
+
+def _naive_e_value(q, total_fee):
+    #eValue before the kernel: one math.exp per element
+    dynamic_fee = total_fee*sum(q)
+    return sum(math.exp(q_i/(dynamic_fee if dynamic_fee != 0 else 0.005)) for q_i in q), dynamic_fee
+
+
+def _naive_price(total_fee, q_i, q_j):
+    #as before the kernel, the exponentials of q_j use the fee of q_i
+    e_j, _ = _naive_e_value(q_j, total_fee)
+    e_i, dynamic_fee = _naive_e_value(q_i, total_fee)
+    exps = [math.exp(q/dynamic_fee) for q in q_j]
+    qxe = sum(q*e for q, e in zip(q_j, exps))
+    return total_fee*math.log(e_j) + (e_i*sum(q_j) - qxe)/(sum(q_j)*sum(exps))
+
+
+def test_cost_and_prices_match_the_naive_formulas():
+    rng = np.random.default_rng(0)
+    x = rng.uniform(0, 50, (20, 4))
+    b = rng.uniform(5, 50, 20)
+    cost, prices, terms = cost_and_prices(x, b)
+    naive = np.exp(x/b[:, None])
+    np.testing.assert_allclose(cost, b*np.log(naive.sum(axis=1)), rtol=1e-14)
+    np.testing.assert_allclose(prices, naive/naive.sum(axis=1, keepdims=True), rtol=1e-14)
+    np.testing.assert_allclose(terms.lse, np.log(naive.sum(axis=1)), rtol=1e-14)
+    single = cost_and_prices(x[3], b[3])
+    assert single[0] == cost[3]
+
+
+def test_large_states_stay_finite():
+    x = np.array([1e6, 1e6 + 1.0, 2e6])
+    cost, prices, _ = cost_and_prices(x, 1.0)
+    assert np.isfinite(cost) and cost == 2e6 + math.log(1 + 2*math.exp(-1e6))
+    assert prices.tolist() == [0.0, 0.0, 1.0]
+    assert np.isfinite(lsdCostFunction([1e5, 3e5], 10.0))
+    assert np.isfinite(exp_terms(np.array([-np.inf, 0.0])).lse)
+
+
+def test_liquidity_sensitive_prices_are_the_gradient():
+    rng = np.random.default_rng(1)
+    q = rng.uniform(10, 100, 3)
+    fee = 0.05
+    cost, prices, _ = ls_cost_and_prices(q, fee)
+    step = 1e-5
+    for i in range(3):
+        up, down = q.copy(), q.copy()
+        up[i] += step
+        down[i] -= step
+        gradient = (ls_cost_and_prices(up, fee)[0] - ls_cost_and_prices(down, fee)[0])/(2*step)
+        assert abs(gradient - prices[i]) < 1e-7
+    assert abs(cost - fee*q.sum()*math.log(np.exp(q/(fee*q.sum())).sum())) < 1e-10
+
+
+def test_core_functions_match_their_loops():
+    rng = np.random.default_rng(2)
+    for _ in range(50):
+        q = rng.uniform(1, 1000, 2).tolist()
+        fee = float(rng.uniform(0.01, 0.1))
+        e_value, dynamic_fee = eValue(q, fee)
+        naive, naive_fee = _naive_e_value(q, fee)
+        assert dynamic_fee == naive_fee and math.isclose(e_value, naive, rel_tol=1e-13)
+        assert math.isclose(lsdCostFunction(q, dynamic_fee), dynamic_fee*math.log(naive), rel_tol=1e-13)
+        previous = (np.array(q) + rng.uniform(0, 10, 2)).tolist()
+        price = lsdPriceFunction_i(None, fee, previous, q)
+        assert abs(price - _naive_price(fee, previous, q)) < 1e-12
@@ -0,0 +1,85 @@
+from rikiddo_cpmm_compare.rikiddo import RikiddoScoringRule
+from rikiddo_markets import MarketManager, QuoteShards
+from rikiddo_events import NullSink
+import numpy as np
+import pytest
+
+
+def _trade(market, manager, id, rng, trades):
+    n = len(manager.x(id))
+    for _ in range(trades):
+        outcome = int(rng.integers(n))
+        if rng.random() < 0.25:
+            shares = float(rng.uniform(1, 5))
+            assert manager.sell_shares(id, shares, outcome) == pytest.approx(
+                market.sell_shares('trader', shares, outcome), rel=1e-9)
+        else:
+            paid = float(rng.uniform(1, 10))
+            assert manager.buy_shares(id, paid, outcome) == pytest.approx(
+                market.buy_shares('trader', paid, outcome), rel=1e-9)
+
+
+def test_markets_match_rikiddo_scoring_rule():
+    rng = np.random.default_rng(0)
+    manager = MarketManager(markets=3)
+    markets = {}
+    for id, outcomes, n_params in (('a', 2, [0.01, 6, 2]), ('b', 3, [0.05, 6, 2]), ('c', 5, [0.01, 2, 2])):
+        manager.add_market(id, outcomes, n_params, vig=0.1, init=500.0, mrc=0.4)
+        markets[id] = RikiddoScoringRule(list(range(outcomes)), n_params, vig=0.1, init=500.0, mrc=0.4,
+                                         events=NullSink())
+    #past the 45 trades after which the dynamic fee enters b
+    for id, market in markets.items():
+        _trade(market, manager, id, rng, 80)
+        np.testing.assert_allclose(manager.x(id), market.x, rtol=1e-9)
+        assert manager.b(id) == pytest.approx(market.b, rel=1e-9)
+        assert manager.ratio_function(id) == market.ratio_function()
+        np.testing.assert_allclose(manager.probabilities(id), market.p, rtol=1e-9)
+        assert manager.market_value(id) == pytest.approx(market.market_value, rel=1e-9)
+        assert manager.price(id, 3.0, 1) == pytest.approx(market.price(3.0, 1), rel=1e-9)
+
+    ids = ['c', 'a', 'b', 'c', 'a']
+    shares = [1.0, -2.0, 4.0, 10.0, 0.5]
+    outcomes = [4, 0, 2, 0, 1]
+    expected = [markets[id].price(s, o) for id, s, o in zip(ids, shares, outcomes)]
+    np.testing.assert_allclose(manager.quote_many(ids, shares, outcomes), expected, rtol=1e-9)
+
+
+def test_errors():
+    manager = MarketManager(markets=1, slots=3)
+    with pytest.raises(ValueError):
+        manager.add_market('a', 1, [0.01, 6, 2])
+    with pytest.raises(ValueError):
+        manager.add_market('a', 4, [0.01, 6, 2])
+    manager.add_market('a', 2, [0.01, 6, 2])
+    with pytest.raises(ValueError):
+        manager.add_market('a', 2, [0.01, 6, 2])
+    with pytest.raises(IndexError):
+        manager.quote_many(['a'], [1.0], [2])
+    with pytest.raises(ValueError):
+        manager.descriptor()
+
+
+def test_shared_memory_readers():
+    rng = np.random.default_rng(1)
+    with MarketManager(markets=4, shared=True) as manager:
+        for id in range(4):
+            manager.add_market(id, 2 + id % 2, [0.01, 6, 2], init=100.0)
+            for _ in range(10):
+                manager.buy_shares(id, float(rng.uniform(1, 5)), 0)
+        ids = [0, 1, 2, 3, 1, 2]
+        shares = [1.0, 2.0, 3.0, -1.0, 5.0, 0.5]
+        outcomes = [0, 2, 1, 1, 0, 0]
+
+        reader = MarketManager.attach(manager.descriptor())
+        try:
+            np.testing.assert_array_equal(reader.x(3), manager.x(3))
+            #a write through the creator is seen by the reader
+            manager.buy_shares(3, 2.0, 1)
+            np.testing.assert_array_equal(reader.x(3), manager.x(3))
+            expected = manager.quote_many(ids, shares, outcomes)
+            np.testing.assert_allclose(reader.quote_many(manager.index(ids), shares, outcomes), expected)
+        finally:
+            reader.close()
+
+        with QuoteShards(manager, workers=2) as shards:
+            np.testing.assert_allclose(shards.quote_many(ids, shares, outcomes), expected)
@@ -0,0 +1,43 @@
+from rikiddo_orders import order_stream, draw_orders
+import numpy as np
+import pytest
+
+
+def _collect(stream):
+    return [np.concatenate(column) for column in zip(*stream)]
+
+
+@pytest.mark.parametrize('model', ['signal', 'uniform'])
+def test_stream_doesnt_depend_on_batching(model):
+    reference = _collect(order_stream(3, model, seed=1, orders=3000, batch_size=500))
+    for batch_size in (1, 1000, 1500, 4096):
+        columns = _collect(order_stream(3, model, seed=1, orders=3000, batch_size=batch_size))
+        for column, expected in zip(columns, reference):
+            np.testing.assert_array_equal(column, expected)
+    endless = order_stream(3, model, seed=1, batch_size=2000)
+    columns = _collect([next(endless), next(endless)])
+    for column, expected in zip(columns, reference):
+        np.testing.assert_array_equal(column[:3000], expected)
+
+
+def test_batches():
+    batches = list(order_stream(4, seed=2, orders=2300, batch_size=700, max_amount=3.0))
+    #700 is rounded up to 1000, two signal periods
+    assert [len(batch.outcome) for batch in batches] == [1000, 1000, 300]
+    outcome, sell, amount = _collect(batches)
+    assert outcome.dtype == np.int64 and sell.dtype == bool
+    assert outcome.min() >= 0 and outcome.max() <= 3
+    assert 0 <= amount.min() and amount.max() <= 3.0
+    with pytest.raises(ValueError):
+        draw_orders('random', 10, 2, np.random.default_rng(0))
+
+
+def test_signal_sets_the_sell_probability():
+    #as in the original loop, the signal s is the weight of the first outcome, which is
+    #traded with probability s, and every order is a sell with probability s
+    for seed in range(5):
+        outcome, sell, _ = next(order_stream(2, seed=seed, orders=20000, batch_size=20000, signal_period=20000))
+        first = (outcome == 0).mean()
+        assert abs(sell.mean() - first) < 0.03
+        if 0.1 < first < 0.9:
+            assert abs(sell[outcome == 0].mean() - sell[outcome == 1].mean()) < 0.04
@@ -0,0 +1,33 @@
+from rikiddo_combo import RikiddoComboScoringRule
+from rikiddo_events import NullSink
+import numpy as np
+
+
+def test_quotes_match_price(traded_market):
+    market = traded_market(trades=60, init=100.0)
+    rng = np.random.default_rng(1)
+    shares = rng.uniform(-5, 30, 40)
+    outcomes = rng.integers(0, 3, 40)
+    costs, average, probabilities = market.quote_many(shares, outcomes)
+    for i in range(40):
+        assert abs(costs[i] - market.price(shares[i], outcomes[i])) < 1e-9
+        state = market.x
+        state[outcomes[i]] += shares[i]
+        expected = np.exp(state/market.b)
+        np.testing.assert_allclose(probabilities[i], expected/expected.sum(), rtol=1e-12)
+    np.testing.assert_allclose(average, costs/shares)
+    #quoting doesn't trade
+    before = market.x
+    market.quote_many(shares, outcomes)
+    np.testing.assert_array_equal(market.x, before)
+
+
+def test_combo_quotes_match_price(traded_market):
+    market = traded_market(RikiddoComboScoringRule(['a', 'b', 'c'], [0.01, 6, 2], 100, events=NullSink()), trades=60)
+    outcomes = np.arange(market.n)
+    shares = np.linspace(-2, 10, market.n)
+    costs, _, probabilities = market.quote_many(shares, outcomes)
+    for i in outcomes.tolist():
+        assert abs(costs[i] - market.price(shares[i], i)) < 1e-9
+        moved = market._new_x(shares[i], i)
+        assert abs(probabilities[i] - moved.probabilities(market.b)[i]) < 1e-12
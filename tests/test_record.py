@@ -0,0 +1,45 @@
+from rikiddo_record import RecordWriter, read_columns
+import csv
+import math
+import numpy as np
+import pytest
+
+
+COLUMNS = {'n': np.int64, 'side': str, 'cost': np.float64, 'profit': np.float64}
+
+
+def _rows(count):
+    rng = np.random.default_rng(0)
+    for i in range(count):
+        cost = math.nan if i % 13 == 5 else float(rng.uniform(-1, 1))
+        yield {'n': i, 'side': 'buy' if i % 3 else 'sell', 'cost': cost}
+
+
+def test_csv_and_binary_columns_agree(tmp_path):
+    path = str(tmp_path/'record.csv')
+    with RecordWriter(path, COLUMNS, chunk_size=16, cumsum={'profit': 'cost'}) as writer:
+        for row in _rows(100):
+            writer.append(row)
+    columns = read_columns(writer.binary_path)
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == len(columns['n']) == 100
+    assert [row['side'] for row in rows] == columns['side'].tolist()
+    np.testing.assert_array_equal([float(row['cost']) for row in rows], columns['cost'])
+
+    #running sum skipping NaN, like pandas cumsum
+    costs = np.array([row['cost'] for row in _rows(100)])
+    expected = np.where(np.isnan(costs), np.nan, np.cumsum(np.nan_to_num(costs)))
+    np.testing.assert_allclose(columns['profit'], expected, rtol=1e-12)
+    pd = pytest.importorskip('pandas')
+    np.testing.assert_allclose(columns['profit'], pd.Series(costs).cumsum().to_numpy(), rtol=1e-12)
+
+
+def test_only_flushed_chunks_are_visible(tmp_path):
+    writer = RecordWriter(str(tmp_path/'record.csv'), COLUMNS, chunk_size=16, cumsum={'profit': 'cost'})
+    for row in _rows(40):
+        writer.append(row)
+    #two chunks flushed, 8 rows still buffered
+    assert len(read_columns(writer.binary_path)['n']) == 32
+    writer.close()
+    assert read_columns(writer.binary_path, mmap=False)['n'].tolist() == list(range(40))
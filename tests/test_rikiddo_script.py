@@ -0,0 +1,36 @@
+import subprocess
+import sys
+import os
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'rikiddo.py')
+
+
+def _run(tmp_path, transactions=None, blocks=None):
+    bound = ['--transactions', str(transactions)] if blocks is None else ['--blocks', str(blocks)]
+    return subprocess.run([sys.executable, SCRIPT, *bound, '--quiet'],
+                          cwd=tmp_path, capture_output=True, text=True, timeout=120)
+
+
+def test_transactions_mode_completes(tmp_path):
+    result = _run(tmp_path, 500)
+    assert result.returncode == 0
+    assert 'We made 500 transactions' in result.stdout
+
+
+def test_transactions_mode_reports_short_runs(tmp_path):
+    #the fee passes the trader max fee before 20000 transactions: the run must stop and say so
+    result = _run(tmp_path, 20000)
+    assert result.returncode == 1
+    assert 'stopped early: fee 0.15 above the trader max fee' in result.stdout
+    assert 'of the 20000 requested transactions ran' in result.stdout
+
+
+def test_blocks_mode_reports_short_runs(tmp_path):
+    result = _run(tmp_path, blocks=5)
+    assert result.returncode == 0
+    assert 'stopped early' not in result.stdout
+    #10000 iterations, but the pool gets stuck before
+    result = _run(tmp_path, blocks=100)
+    assert result.returncode == 1
+    assert 'stopped early: fee 0.15 above the trader max fee' in result.stdout
+    assert 'of the 10000 requested iterations (100 blocks) ran' in result.stdout
@@ -0,0 +1,105 @@
+from rikiddo_service import MarketService
+import asyncio
+import json
+import pytest
+
+
+def _run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_worker_survives_unexpected_errors():
+    async def scenario():
+        service = MarketService(tick=0.001)
+        rule = service.create_market('m', 2)
+        buy = rule.buy_shares
+        calls = []
+
+        def flaky(name, paid, outcome):
+            calls.append(paid)
+            if len(calls) == 1:
+                raise OverflowError('boom')
+            return buy(name, paid, outcome)
+
+        rule.buy_shares = flaky
+        first = await service.handle({'op': 'buy', 'market': 'm', 'outcome': 0, 'paid': 1.0})
+        second = await asyncio.wait_for(service.handle({'op': 'buy', 'market': 'm', 'outcome': 0, 'paid': 1.0}), 1)
+        return first, second
+
+    first, second = _run(scenario())
+    assert not first['ok'] and 'boom' in first['error']
+    assert second['ok'] and second['result']['shares'] > 0
+
+
+def test_rejects_invalid_outcomes_and_markets():
+    async def scenario():
+        service = MarketService(tick=0.001)
+        service.create_market('m', 3)
+        with pytest.raises(ValueError):
+            service.create_market('single', 1)
+        for outcome in (-1, 3, 0.5):
+            with pytest.raises(ValueError):
+                service.trade('m', 'buy', outcome, 1.0)
+            with pytest.raises(ValueError):
+                service.quote('m', outcome, shares=1.0)
+        response = await service.handle({'op': 'quote', 'market': 'm', 'outcome': 2, 'shares': 1.0})
+        assert response['ok'] and response['result']['cost'] > 0
+        assert service._markets['m'].p.size == 3
+
+    _run(scenario())
+
+
+def test_quotes_of_a_tick_share_one_batch():
+    async def scenario():
+        service = MarketService(tick=0.01)
+        rule = service.create_market('m', 3)
+        quote_many = rule.quote_many
+        calls = []
+
+        def counted(shares, outcomes):
+            calls.append(len(shares))
+            return quote_many(shares, outcomes)
+
+        rule.quote_many = counted
+        requests = [{'op': 'quote', 'market': 'm', 'outcome': i % 3, 'shares': 1.0 + i, 'id': i} for i in range(20)]
+        responses = await asyncio.gather(*(service.handle(request) for request in requests))
+        expected = [rule.price(1.0 + i, i % 3) for i in range(20)]
+        return responses, expected, calls, service.snapshot()
+
+    responses, expected, calls, snapshot = _run(scenario())
+    assert calls == [20]
+    assert snapshot['max_quote_batch'] == 20
+    assert snapshot['timers']['quote_batch']['count'] == 1
+    assert snapshot['counters']['quotes'] == 20
+    assert [response['id'] for response in responses] == list(range(20))
+    assert [response['result']['cost'] for response in responses] == pytest.approx(expected, rel=1e-12)
+
+
+def test_full_queue_answers_busy_and_metrics_show_the_depth():
+    async def scenario():
+        service = MarketService(tick=0.001, queue_size=2)
+        service.create_market('m', 2)
+        #nothing runs the worker until this coroutine yields: two trades fill the queue
+        futures = [service.trade('m', 'buy', 0, 1.0), service.trade('m', 'buy', 1, 1.0)]
+        depth = service.snapshot()['queues']['m']
+        busy = await service.handle({'op': 'buy', 'market': 'm', 'outcome': 0, 'paid': 1.0})
+        results = await asyncio.gather(*futures)
+        return depth, busy, results, (await service.handle({'op': 'metrics'}))['result']
+
+    depth, busy, results, metrics = _run(scenario())
+    assert depth == {'depth': 2, 'max_depth': 2}
+    assert not busy['ok'] and busy['error'].startswith('busy')
+    assert all(result['shares'] > 0 for result in results)
+    assert metrics['queues']['m'] == {'depth': 0, 'max_depth': 2}
+    assert metrics['counters']['busy'] == 1
+
+
+def test_non_finite_numbers_are_null():
+    async def scenario():
+        service = MarketService(tick=0.001)
+        service.create_market('m', 2)
+        return await service.handle({'op': 'quote', 'market': 'm', 'outcome': 0, 'shares': 0.0})
+
+    response = _run(scenario())
+    assert response['ok'] and response['result'] == {'cost': 0.0, 'average_price': None}
+    json.loads(json.dumps(response, allow_nan=False))
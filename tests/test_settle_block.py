@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+
+def test_charges_add_up_to_the_block_cost(traded_market):
+    market = traded_market()
+    x, cost, b = market.x, market.cost(market.x), market.b
+    orders = [('a', 10.0, 0), ('b', -4.0, 0), ('c', 7.5, 2), ('d', -2.0, 1), ('e', 3.0, 2)]
+    for name, shares, outcome in orders:
+        market.submit_order(name, shares, outcome)
+    assert market.pending_orders == 5
+    entries, history = len(market._book), len(market._states)
+    charges = market.settle_block()
+    net = np.array([6.0, -2.0, 10.5])
+    expected = b*np.log(np.exp((x + net)/b).sum()) - cost
+    assert charges.sum() == pytest.approx(expected, rel=1e-10)
+    np.testing.assert_allclose(market.x, x + net)
+    assert market.pending_orders == 0
+    #one book entry per order, one history entry per block
+    assert len(market._book) == entries + 5
+    assert len(market._states) == history + 1
+    #cancelling orders share the gain, so the buy of outcome 0 pays less than alone
+    alone, _, _ = traded_market().quote_many([10.0], [0])
+    assert charges[0] < alone[0]
+
+
+def test_single_order_pays_its_quote(traded_market):
+    market = traded_market()
+    quote = market.price(12.0, 1)
+    market.submit_order('a', 12.0, 1)
+    charges = market.settle_block()
+    assert charges[0] == pytest.approx(quote, rel=1e-12)
+    assert market.settle_block().size == 0
+    with pytest.raises(IndexError):
+        market.submit_order('a', 1.0, 3)
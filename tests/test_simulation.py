@@ -0,0 +1,130 @@
+from rikiddo_simulation import MarketSimulation
+from rikiddo_core_functions import fixFee, z_r, minRevenue, lsdCostFunction
+from rikiddo_volume import VolumeRatioTracker, BatchVolumeRatioTracker
+from rikiddo_orders import order_stream
+from rikiddo_record import read_columns
+import subprocess
+import math
+import sys
+import os
+import numpy as np
+import pytest
+
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'rikiddo.py')
+
+
+def _replay(steps, next_order):
+    '''
+    The rules of the rikiddo.py loop for one market. `next_order(transactions)` gives the
+    (asset, sell, amount) of every iteration
+    '''
+    fee = fixFee(0.04, 2)
+    min_revenue = minRevenue(0.7, fee)
+    q = [1000000.0, 1000000.0]
+    pool = [0.0, 0.0]
+    tracker = VolumeRatioTracker(1, 6, warmup=3)
+    tracker.update(0.0)
+    transactions, profit, previous = 0, 0.0, 0.0
+    for _ in range(steps):
+        index, sell, delta = next_order(transactions)
+        if (q[0] >= 1000000) | (q[1] >= 1000000) | (pool[0] <= 0) | (pool[1] <= 0) & sell:
+            sell = False
+        total = fee + z_r(tracker.ratio)
+        if total < min_revenue:
+            total = min_revenue
+        if (q[0] < 15000) | (q[1] < 15000):
+            total = 0.15
+        if total > 0.1:
+            continue
+        dynamic_fee = total*sum(pool)
+        signed = -delta if sell else delta
+        if q[index] - signed < 0:
+            break
+        q[index] -= signed
+        pool[index] += signed
+        cost = lsdCostFunction(pool, dynamic_fee)
+        if math.isfinite(cost - previous):
+            profit += cost - previous
+        previous = cost
+        tracker.update(sum(pool))
+        transactions += 1
+    return q, pool, profit, transactions
+
+
+def _simulation_orders(seed, hold_signal, period=500):
+    '''
+    Orders drawn from the generator in the order MarketSimulation draws them
+    '''
+    rng = np.random.default_rng(seed)
+    state = {'signal': 0.5, 'block': -1}
+
+    def next_order(transactions):
+        if hold_signal:
+            if transactions//period != state['block']:
+                state['signal'] = float(rng.random(1)[0])
+                state['block'] = transactions//period
+        else:
+            draw = float(rng.random(1)[0])
+            state['signal'] = draw if transactions % period == 0 else 0.5
+        index = int(rng.random(1)[0] >= state['signal'])
+        sell = bool(rng.random(1)[0] < state['signal'])
+        return index, sell, float(rng.uniform(0, 3000, 1)[0])
+    return next_order
+
+
+@pytest.mark.parametrize('hold_signal', [True, False])
+def test_single_market_matches_the_script_rules(hold_signal):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        q, pool, profit, transactions = _replay(1200, _simulation_orders(5, hold_signal))
+        summary = MarketSimulation(1, seed=5, hold_signal=hold_signal).run(1200)
+    assert summary['transactions'][0] == transactions
+    np.testing.assert_allclose(summary['accounts'][0], q)
+    np.testing.assert_allclose(summary['pool'][0], pool)
+    np.testing.assert_allclose(summary['profit'][0], profit, rtol=1e-9)
+
+
+def test_replayed_rules_match_the_script(tmp_path):
+    #the same rules fed with the pre-drawn order flow of rikiddo.py give the script's run, so
+    #MarketSimulation (checked against the rules above) only differs from it by its draws
+    subprocess.run([sys.executable, SCRIPT, '--transactions', '500', '--seed', '3', '--quiet'],
+                   cwd=tmp_path, capture_output=True, check=True, timeout=120)
+    record = read_columns(str(tmp_path/'simulationRecord_columns'), mmap=False)
+    flow = order_stream(2, 'signal', rng=np.random.default_rng(3), max_amount=3000, signal_period=500)
+    orders = (order for batch in flow for order in zip(*(column.tolist() for column in batch)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        q, pool, profit, transactions = _replay(500, lambda transactions: next(orders))
+    assert transactions == record['transactionNumber'][-1] + 1 == 500
+    np.testing.assert_allclose([record['account_Will'][-1], record['account_Will_not'][-1]], q)
+    np.testing.assert_allclose([record['account_Will_pool'][-1], record['account_Will_not_pool'][-1]], pool)
+    np.testing.assert_allclose(record['profitCumSum'][-1], profit, rtol=1e-9)
+
+
+def test_reset_signal_only_applies_at_period_boundaries():
+    simulation = MarketSimulation(200, seed=1, hold_signal=False, signal_period=7)
+    for _ in range(50):
+        boundary = simulation.transactions % 7 == 0
+        simulation.step()
+        assert np.all(simulation.signal[~boundary] == 0.5)
+        assert np.all(simulation.signal[boundary] != 0.5)
+    held = MarketSimulation(200, seed=1, signal_period=7)
+    signals = []
+    for _ in range(5):
+        held.step()
+        signals.append(held.signal.copy())
+    #no market can have made 7 transactions yet: the first signal is kept
+    assert all(np.array_equal(signals[0], signal) for signal in signals)
+
+
+def test_batch_tracker_matches_the_scalar_tracker():
+    rng = np.random.default_rng(2)
+    batch = BatchVolumeRatioTracker(4, 1, 6, warmup=3)
+    trackers = [VolumeRatioTracker(1, 6, warmup=3) for _ in range(4)]
+    for _ in range(40):
+        volumes = rng.integers(0, 50, 4).astype(float)
+        mask = rng.random(4) < 0.7
+        batch.update(volumes, mask)
+        for tracker, volume, traded in zip(trackers, volumes, mask):
+            if traded:
+                tracker.update(volume)
+        np.testing.assert_array_equal(batch.ratio, [tracker.ratio for tracker in trackers])
@@ -0,0 +1,81 @@
+from rikiddo_cpmm_compare.cpmm import CPMM
+from rikiddo_combo import RikiddoComboScoringRule
+from rikiddo_snapshot import SnapshotWriter, Snapshot, read_segment
+from rikiddo_events import NullSink
+import os
+import numpy as np
+import pytest
+
+
+def _markets(traded_market):
+    rikiddo = traded_market(trades=60, init=500.0)
+    combo = RikiddoComboScoringRule([0, 1, 2, 3], [0.01, 6, 2], 10, init=100.0, events=NullSink())
+    for i in range(20):
+        combo.buy_shares('trader', 1.0 + i % 3, (5*i) % combo.n)
+    cpmm = CPMM({'ZTG': 1000.0, 'A': 400.0, 'B': 600.0}, 0.01)
+    cpmm.buy_shares(10.0, 'A')
+    cpmm.provide_liquidity(1, 50.0)
+    return {'rikiddo': rikiddo, 7: combo, 'cpmm': cpmm}
+
+
+def test_round_trip(tmp_path, traded_market):
+    markets = _markets(traded_market)
+    SnapshotWriter(str(tmp_path)).save(markets)
+    snapshot = Snapshot(str(tmp_path), events=NullSink())
+    assert set(snapshot) == {'rikiddo', 7, 'cpmm'}
+    assert snapshot.kind(7) == 'combo'
+
+    rikiddo, restored = markets['rikiddo'], snapshot['rikiddo']
+    np.testing.assert_array_equal(restored.x, rikiddo.x)
+    assert restored.b == rikiddo.b
+    assert restored.market_value == rikiddo.market_value
+    #the volume tracker and the book tail come back too: the next trades are the same
+    for i in range(10):
+        assert restored.buy_shares('trader', 3.0, i % 3) == rikiddo.buy_shares('trader', 3.0, i % 3)
+    assert snapshot['rikiddo'] is restored
+
+    combo, restored = markets[7], snapshot[7]
+    np.testing.assert_array_equal(restored.x.to_dense(), combo.x.to_dense())
+    assert restored.buy_shares('trader', 2.0, 11) == pytest.approx(combo.buy_shares('trader', 2.0, 11), rel=1e-12)
+
+    cpmm, restored = markets['cpmm'], snapshot['cpmm']
+    assert restored.state == cpmm.state
+    assert restored._liquidity == cpmm._liquidity
+    assert restored.buy_shares(5.0, 'B') == cpmm.buy_shares(5.0, 'B')
+
+
+def test_incremental_saves(tmp_path, traded_market):
+    markets = _markets(traded_market)
+    writer = SnapshotWriter(str(tmp_path))
+    writer.save(markets)
+    markets['rikiddo'].buy_shares('trader', 4.0, 1)
+    del markets['cpmm']
+    path = writer.save(markets)
+    header, groups = read_segment(path)
+    assert list(groups) == ['rikiddo'] and groups['rikiddo'][0] == ['rikiddo']
+    assert header['deleted'] == ['cpmm']
+    snapshot = Snapshot(str(tmp_path), events=NullSink())
+    assert set(snapshot) == {'rikiddo', 7}
+    np.testing.assert_array_equal(snapshot['rikiddo'].x, markets['rikiddo'].x)
+    #a full save replaces the older files
+    writer.save(markets, full=True)
+    assert len(os.listdir(str(tmp_path))) == 1
+    with pytest.raises(TypeError):
+        writer.save({(1, 2): markets[7]})
+
+
+def test_corruption_is_detected(tmp_path, traded_market):
+    markets = _markets(traded_market)
+    path = SnapshotWriter(str(tmp_path)).save(markets)
+    data = bytearray(open(path, 'rb').read())
+    #a byte of the rikiddo state vector (the end of the file is alignment padding)
+    data[data.find(markets['rikiddo'].x.tobytes())] ^= 0xFF
+    open(path, 'wb').write(bytes(data))
+    with pytest.raises(ValueError, match='Checksum'):
+        Snapshot(str(tmp_path))
+    #without verification only the header is checked
+    Snapshot(str(tmp_path), verify=False)
+    data[40] ^= 0xFF
+    open(path, 'wb').write(bytes(data))
+    with pytest.raises(ValueError):
+        Snapshot(str(tmp_path), verify=False)
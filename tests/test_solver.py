@@ -0,0 +1,36 @@
+from rikiddo_kernel import cost_and_prices
+from rikiddo_solver import solve_shares_terms
+import numpy as np
+import pytest
+
+
+def test_closed_form_costs_exactly_paid(traded_market):
+    market = traded_market(trades=60, seed=3, max_paid=50.0, vig=0.1)
+    rng = np.random.default_rng(4)
+    paid = rng.uniform(-50, 500, 200)
+    outcomes = rng.integers(0, 3, 200)
+    shares = market.calculate_shares(paid, outcomes)
+    costs, _, _ = market.quote_many(shares, outcomes)
+    np.testing.assert_allclose(costs, paid, rtol=1e-10, atol=1e-8)
+    assert market.calculate_shares(paid[7], outcomes[7]) == shares[7]
+
+
+def test_closed_form_matches_cobyla(traded_market):
+    pytest.importorskip('scipy')
+    market = traded_market(trades=60, seed=3, max_paid=50.0, vig=0.1)
+    for paid, outcome in [(1.0, 0), (25.0, 1), (300.0, 2)]:
+        exact = market.calculate_shares(paid, outcome)
+        search = market.calculate_shares(paid, outcome, method='cobyla')
+        assert abs(market.price(exact, outcome) - paid) <= abs(market.price(search, outcome) - paid) + 1e-9
+
+
+def test_large_balances_and_impossible_sells():
+    x = np.array([1e6, 2e6, 3e6])
+    b = 10.0
+    cost, _, terms = cost_and_prices(x, b)
+    shares = solve_shares_terms(x[0], b, 5.0, terms.shift, terms.total, terms.terms[0])
+    moved = x.copy()
+    moved[0] += shares
+    assert abs(float(cost_and_prices(moved, b)[0]) - cost - 5.0) < 1e-6
+    #selling would need to take out more than the whole cost
+    assert np.isnan(solve_shares_terms(x[0], b, -2*cost, terms.shift, terms.total, terms.terms[0]))
@@ -0,0 +1,44 @@
+from rikiddo_combo import RikiddoComboScoringRule
+from rikiddo_sparse import SparseState
+from rikiddo_events import NullSink
+import numpy as np
+import pytest
+
+
+def _dense_cost(x, b):
+    return b*np.log(np.sum(np.exp(x/b)))
+
+
+def test_closed_form_matches_dense():
+    rng = np.random.default_rng(0)
+    state = SparseState(1000, 0.25, capacity=2)
+    dense = np.full(1000, 0.25)
+    for _ in range(50):
+        id, amount = int(rng.integers(1000)), float(rng.uniform(-2, 5))
+        state.add(id, amount)
+        dense[id] += amount
+    state[7] = 3.0
+    dense[7] = 3.0
+    np.testing.assert_array_equal(state.to_dense(), dense)
+    assert state.sum() == pytest.approx(dense.sum(), rel=1e-12)
+    for b in (0.5, 2.0, 40.0):
+        assert state.cost(b) == pytest.approx(_dense_cost(dense, b), rel=1e-12)
+        p = state.probabilities(b)
+        assert p.touched == state.touched
+        np.testing.assert_allclose(p.to_dense(), np.exp(dense/b)/np.exp(dense/b).sum(), rtol=1e-12)
+    with pytest.raises(IndexError):
+        state[1000]
+
+
+def test_combo_market_matches_a_dense_state():
+    market = RikiddoComboScoringRule(list(range(5)), [0.01, 6, 2], 10, init=100.0, events=NullSink())
+    for i in range(30):
+        market.buy_shares('trader', 1.0 + i % 4, (7*i) % market.n)
+    x = market.x
+    #only the traded combos are stored
+    assert x.touched <= 30 < market.n
+    dense = x.to_dense()
+    b = market.b
+    assert market.cost(x) == pytest.approx(_dense_cost(dense, b), rel=1e-12)
+    np.testing.assert_allclose(market.p, np.exp(dense/b)/np.exp(dense/b).sum(), rtol=1e-10)
+    assert market.probability(3) == pytest.approx(market.p[3], rel=1e-12)
@@ -0,0 +1,75 @@
+from rikiddo_sweep import grid, sweep, run_cell, completed_cells
+from rikiddo_cpmm_compare.rikiddo import RikiddoScoringRule
+from rikiddo_orders import order_stream
+from rikiddo_events import NullSink
+import json
+import numpy as np
+import pytest
+
+
+def _cells():
+    return grid([[0.01, 6, 2]], [0.1], [0.4], [100, 1000], flow=('uniform', 'signal'))
+
+
+def _lines(path):
+    with open(path) as results:
+        return [json.loads(line) for line in results]
+
+
+def test_resume_drops_the_partial_line(tmp_path):
+    path = str(tmp_path/'results.jsonl')
+    cells = _cells()
+    first = run_cell(cells[0], orders=50)
+    with open(path, 'w') as results:
+        results.write(json.dumps(first) + '\n' + json.dumps(run_cell(cells[1], orders=50))[:40])
+    assert completed_cells(path) == {0}
+
+    assert sweep(cells, path, orders=50, workers=1) == 3
+    lines = _lines(path)
+    assert sorted(line['cell'] for line in lines) == [0, 1, 2, 3]
+    assert lines[0] == first
+    assert sweep(cells, path, orders=50, workers=1) == 0
+
+
+def test_results_are_deterministic(tmp_path):
+    cells = _cells()
+    sweep(cells, str(tmp_path/'a.jsonl'), orders=50, workers=1)
+    sweep(cells, str(tmp_path/'b.jsonl'), orders=50, workers=2)
+    a = {line['cell']: line for line in _lines(tmp_path/'a.jsonl')}
+    b = {line['cell']: line for line in _lines(tmp_path/'b.jsonl')}
+    assert a == b
+    assert all(line['solves'] <= 50 for line in a.values())
+
+
+def test_failing_cell_writes_an_error_record(tmp_path):
+    path = str(tmp_path/'results.jsonl')
+    cells = _cells()
+    cells[1]['flow'] = 'unknown'
+    assert sweep(cells, path, orders=50, workers=1) == 4
+    lines = {line['cell']: line for line in _lines(path)}
+    assert set(lines) == {0, 1, 2, 3}
+    assert 'error' in lines[1] and 'error' not in lines[0]
+    assert completed_cells(path) == {0, 1, 2, 3}
+
+
+def test_slippage_of_buys_and_sells_doesnt_cancel():
+    cell = grid([[0.01, 6, 2]], [0.1], [0.4], [100], flow=('uniform',))[0]
+    result = run_cell(cell, orders=200)
+    #replay of the cell: buys pay above the pre-trade probability, sells get less
+    rng = np.random.default_rng([0, cell['cell']])
+    market = RikiddoScoringRule([0, 1], cell['n_params'], vig=0.1, init=100, mrc=0.4, events=NullSink())
+    outcome, sell, amount = next(order_stream(2, 'uniform', rng=rng, orders=200, batch_size=200))
+    signed = []
+    for o, s, a in zip(outcome.tolist(), sell.tolist(), amount.tolist()):
+        probability = market.p[o]
+        if s:
+            shares = a/probability
+            paid = -market.sell_shares('trader', shares, o)
+        else:
+            paid, shares = a, market.buy_shares('trader', a, o)
+        signed.append((paid/shares)/probability - 1)
+    signed = np.array(signed)
+    assert (signed[~sell] > 0).all() and (signed[sell] < 0).all()
+    assert result['slippage'] == pytest.approx(np.abs(signed).mean(), rel=1e-12)
+    assert result['slippage'] > abs(signed.mean())
+    assert result['fee_paid'] > 0
@@ -0,0 +1,60 @@
+from rikiddo_volume import VolumeRatioTracker, volume_ratio_series
+from rikiddo_core_functions import getVolumeRatio
+import math
+import numpy as np
+import pytest
+
+pd = pytest.importorskip('pandas')
+
+
+def _series():
+    rng = np.random.default_rng(7)
+    return {'random': rng.uniform(0, 100, 300),
+            'integer': rng.integers(0, 20, 300).astype(float),
+            'tiny': rng.uniform(0, 1e-3, 300),
+            'zeros_then_volume': np.concatenate([np.zeros(60), rng.uniform(0, 5, 60)])}
+
+
+def _rolling_ratio(volumes, short_window, long_window):
+    '''
+    RikiddoScoringRule.ratio_function before the tracker, for a book of at least
+    `long_window` trades (shorter books priced with _b_init and never reached it)
+    '''
+    shares = pd.Series(volumes)
+    longWindow = math.ceil(shares.rolling(long_window).mean().tolist()[-1])
+    shortWindow = math.ceil(shares.rolling(short_window).mean().tolist()[-1])
+    return 0 if longWindow == 0 else shortWindow/longWindow
+
+
+@pytest.mark.parametrize('name', sorted(_series()))
+def test_tracker_matches_pandas_ratio_function(name):
+    volumes = _series()[name]
+    tracker = VolumeRatioTracker(25, 45, warmup=5)
+    for t, volume in enumerate(volumes, 1):
+        tracker.update(volume)
+        if t >= 45:
+            assert tracker.ratio == _rolling_ratio(volumes[:t], 25, 45)
+
+
+@pytest.mark.parametrize('name', sorted(_series()))
+def test_tracker_matches_get_volume_ratio(name):
+    #rikiddo.py's 1 vs 6 windows, including the <= 3 volumes warm-up and the round-up
+    volumes = _series()[name]
+    tracker = VolumeRatioTracker(1, 6, warmup=3)
+    for t, volume in enumerate(volumes, 1):
+        tracker.update(volume)
+        frame = pd.DataFrame({'totalPoolVolume': volumes[:t]})
+        assert tracker.ratio == getVolumeRatio('totalPoolVolume', frame, t - 1)
+
+
+@pytest.mark.parametrize('round_up', [True, False])
+def test_ratio_series_matches_tracker(round_up):
+    volumes = _series()['random']
+    tracker = VolumeRatioTracker(1, 6, warmup=3, round_up=round_up)
+    expected = [tracker.update(volume) for volume in volumes]
+    series = volume_ratio_series(volumes, 1, 6, warmup=3, round_up=round_up)
+    if round_up:
+        np.testing.assert_array_equal(series, expected)
+    else:
+        #window sums taken in a different order than the running sums
+        np.testing.assert_allclose(series, expected, rtol=1e-12)